@@ -1,12 +1,11 @@
 '''Аутентификация пользователей через email и пароль с JWT токенами'''
 import json
 import os
-import psycopg2
-import bcrypt
 import jwt
 from datetime import datetime, timedelta
+from db_pool import get_connection, release_connection
+from password_hasher import hash_password, verify_password, needs_rehash, PasswordHasherBusy, PasswordHasherTimeout
 
-DATABASE_URL = os.environ['DATABASE_URL']
 SCHEMA = os.environ['MAIN_DB_SCHEMA']
 JWT_SECRET = os.environ['JWT_SECRET']
 
@@ -52,6 +51,18 @@ def handler(event: dict, context) -> dict:
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({'error': 'Invalid action'})
             }
+    except PasswordHasherTimeout:
+        return {
+            'statusCode': 503,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Retry-After': '1'},
+            'body': json.dumps({'error': 'Сервер перегружен, повторите попытку через несколько секунд'})
+        }
+    except PasswordHasherBusy:
+        return {
+            'statusCode': 429,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Retry-After': '1'},
+            'body': json.dumps({'error': 'Сервер перегружен, повторите попытку через несколько секунд'})
+        }
     except Exception as e:
         return {
             'statusCode': 500,
@@ -70,7 +81,7 @@ def login(body: dict) -> dict:
             'body': json.dumps({'error': 'Email и пароль обязательны'})
         }
     
-    conn = psycopg2.connect(DATABASE_URL)
+    conn = get_connection()
     cur = conn.cursor()
     
     try:
@@ -99,7 +110,7 @@ def login(body: dict) -> dict:
                 'body': json.dumps({'error': 'Аккаунт заблокирован. Слишком много попыток входа'})
             }
         
-        if not bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8')):
+        if not verify_password(password, password_hash):
             cur.execute(f'''
                 UPDATE {SCHEMA}.users 
                 SET failed_login_attempts = failed_login_attempts + 1,
@@ -114,12 +125,22 @@ def login(body: dict) -> dict:
                 'body': json.dumps({'error': 'Неверный email или пароль'})
             }
         
-        cur.execute(f'''
-            UPDATE {SCHEMA}.users 
-            SET last_login_at = CURRENT_TIMESTAMP,
-                failed_login_attempts = 0
-            WHERE id = %s
-        ''', (user_id,))
+        # Стоимость bcrypt изменилась - пересчитываем хеш, пока пароль под рукой
+        if needs_rehash(password_hash):
+            cur.execute(f'''
+                UPDATE {SCHEMA}.users 
+                SET last_login_at = CURRENT_TIMESTAMP,
+                    failed_login_attempts = 0,
+                    password_hash = %s
+                WHERE id = %s
+            ''', (hash_password(password), user_id))
+        else:
+            cur.execute(f'''
+                UPDATE {SCHEMA}.users 
+                SET last_login_at = CURRENT_TIMESTAMP,
+                    failed_login_attempts = 0
+                WHERE id = %s
+            ''', (user_id,))
         conn.commit()
         
         access_token = jwt.encode({
@@ -155,7 +176,7 @@ def login(body: dict) -> dict:
         }
     finally:
         cur.close()
-        conn.close()
+        release_connection(conn)
 
 def register(body: dict) -> dict:
     email = body.get('email', '').strip().lower()
@@ -177,7 +198,7 @@ def register(body: dict) -> dict:
             'body': json.dumps({'error': 'Пароль должен быть не менее 6 символов'})
         }
     
-    conn = psycopg2.connect(DATABASE_URL)
+    conn = get_connection()
     cur = conn.cursor()
     
     try:
@@ -189,7 +210,7 @@ def register(body: dict) -> dict:
                 'body': json.dumps({'error': 'Пользователь с таким email уже существует'})
             }
         
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password_hash = hash_password(password)
         
         cur.execute(f'''
             INSERT INTO {SCHEMA}.users (email, password_hash, username, role, created_at)
@@ -231,7 +252,7 @@ def register(body: dict) -> dict:
         }
     finally:
         cur.close()
-        conn.close()
+        release_connection(conn)
 
 def verify_token(body: dict) -> dict:
     token = body.get('token', '')
@@ -279,7 +300,7 @@ def forgot_password(body: dict) -> dict:
             'body': json.dumps({'error': 'Email обязателен'})
         }
     
-    conn = psycopg2.connect(DATABASE_URL)
+    conn = get_connection()
     cur = conn.cursor()
     
     try:
@@ -319,7 +340,7 @@ def forgot_password(body: dict) -> dict:
         }
     finally:
         cur.close()
-        conn.close()
+        release_connection(conn)
 
 def reset_password(body: dict) -> dict:
     token = body.get('token', '')
@@ -350,11 +371,11 @@ def reset_password(body: dict) -> dict:
                 'body': json.dumps({'error': 'Неверный тип токена'})
             }
         
-        conn = psycopg2.connect(DATABASE_URL)
+        conn = get_connection()
         cur = conn.cursor()
         
         try:
-            password_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+            password_hash = hash_password(new_password)
             
             cur.execute(f'''
                 UPDATE {SCHEMA}.users 
@@ -378,7 +399,7 @@ def reset_password(body: dict) -> dict:
             }
         finally:
             cur.close()
-            conn.close()
+            release_connection(conn)
             
     except jwt.ExpiredSignatureError:
         return {
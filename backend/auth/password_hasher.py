@@ -0,0 +1,51 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', str(os.cpu_count() or 2)))
+BCRYPT_MAX_QUEUE = int(os.environ.get('BCRYPT_MAX_QUEUE', str(BCRYPT_WORKERS * 4)))
+BCRYPT_TIMEOUT = float(os.environ.get('BCRYPT_TIMEOUT', '10'))
+
+class PasswordHasherBusy(Exception):
+    """Очередь хеширования переполнена, запрос нужно отклонить с 429"""
+
+class PasswordHasherTimeout(PasswordHasherBusy):
+    """Задача не уложилась в BCRYPT_TIMEOUT, запрос нужно отклонить с 503"""
+
+# bcrypt отпускает GIL, поэтому пул потоков занимает все ядра,
+# а семафор ограничивает число принятых в работу задач
+_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix='bcrypt')
+_slots = threading.BoundedSemaphore(BCRYPT_MAX_QUEUE)
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise PasswordHasherBusy('Очередь хеширования паролей переполнена')
+    try:
+        future = _executor.submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=BCRYPT_TIMEOUT)
+    except FutureTimeout:
+        # Задача, ещё ждущая поток, снимается; выполняющаяся освободит слот по завершении
+        future.cancel()
+        raise PasswordHasherTimeout('Хеширование пароля не уложилось в отведённое время')
+
+def hash_password(password: str) -> str:
+    """bcrypt-хеш с текущей стоимостью BCRYPT_ROUNDS"""
+    return _run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+def verify_password(password: str, password_hash: str) -> bool:
+    return _run(bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+def needs_rehash(password_hash: str) -> bool:
+    """Хеш создан с другой стоимостью и должен быть пересчитан при входе"""
+    parts = password_hash.split('$')
+    try:
+        return int(parts[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
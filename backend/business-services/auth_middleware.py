@@ -0,0 +1,77 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import jwt
+
+JWT_CACHE_SIZE = int(os.environ.get('JWT_CACHE_SIZE', '1024'))
+JWT_CACHE_MAX_TTL = int(os.environ.get('JWT_CACHE_MAX_TTL', '900'))
+
+_claims_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _cache_get(key: str):
+    with _cache_lock:
+        entry = _claims_cache.get(key)
+        if not entry:
+            return None
+        if entry[0] <= time.time():
+            del _claims_cache[key]
+            return None
+        _claims_cache.move_to_end(key)
+        return entry[1]
+
+def _cache_put(key: str, claims: dict) -> None:
+    if JWT_CACHE_SIZE <= 0:
+        return
+    expires_at = time.time() + JWT_CACHE_MAX_TTL
+    if isinstance(claims.get('exp'), (int, float)):
+        expires_at = min(expires_at, claims['exp'])
+    with _cache_lock:
+        _claims_cache[key] = (expires_at, claims)
+        _claims_cache.move_to_end(key)
+        while len(_claims_cache) > JWT_CACHE_SIZE:
+            _claims_cache.popitem(last=False)
+
+def verify_token(token: str):
+    """
+    Проверка HS256 JWT, выданного функцией auth.
+    Расшифрованные claims кешируются по хешу токена до его истечения,
+    повторные запросы с тем же токеном не пересчитывают HMAC.
+    """
+    if not token:
+        return None
+    key = hashlib.sha256(token.encode()).hexdigest()
+    claims = _cache_get(key)
+    if claims is not None:
+        return claims
+    secret = os.environ.get('JWT_SECRET')
+    if not secret:
+        return None
+    try:
+        claims = jwt.decode(token, secret, algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        return None
+    if claims.get('type') not in (None, 'access'):
+        return None
+    _cache_put(key, claims)
+    return claims
+
+def get_token_from_headers(headers: dict) -> str:
+    auth_header = (headers or {}).get('x-authorization', (headers or {}).get('X-Authorization', ''))
+    return auth_header.replace('Bearer ', '').strip() if auth_header else ''
+
+def get_user_id(claims: dict) -> int:
+    """user_id из claims: auth кладёт user_id, auth-email и vk-auth - sub"""
+    if not claims:
+        return None
+    user_id = claims.get('user_id', claims.get('sub'))
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+def get_user_id_from_token(headers: dict) -> int:
+    """Извлечение user_id из проверенного JWT в заголовке X-Authorization"""
+    return get_user_id(verify_token(get_token_from_headers(headers)))
@@ -1,16 +1,255 @@
 import json
-import os
+import base64
+import csv
+import io
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from db_pool import get_connection, release_connection
+from auth_middleware import get_user_id_from_token
 
-def get_user_id_from_token(headers: dict) -> int:
-    """Извлечение user_id из токена (упрощенная версия)"""
-    auth_header = headers.get('x-authorization', headers.get('X-Authorization', ''))
-    if not auth_header:
-        return None
-    token = auth_header.replace('Bearer ', '')
-    return int(token.split(':')[0]) if ':' in token else None
+MAX_BULK_SERVICES = 500
+MAX_SERVICE_PROGRAMS = 100
+MAX_SERVICE_IMAGES = 20
+MAX_PROGRAM_PRICE = Decimal('99999999.99')
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(created_at: datetime, service_id: int) -> str:
+    """Непрозрачный курсор для keyset-пагинации по (created_at, id)"""
+    raw = json.dumps([created_at.isoformat(), service_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> tuple:
+    """Разбор курсора, ValueError при некорректном значении"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, service_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(service_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def parse_list_params(query_params: dict) -> tuple:
+    """Условия WHERE, параметры и размер страницы для списка услуг; ValueError при некорректных значениях"""
+    conditions = ['s.status = %s']
+    params = [query_params.get('status', 'active')]
+    
+    category_id = query_params.get('categoryId')
+    if category_id:
+        try:
+            params.append(int(category_id))
+        except ValueError:
+            raise ValueError('Invalid categoryId')
+        conditions.append('s.category_id = %s')
+    
+    cursor = query_params.get('cursor')
+    if cursor:
+        conditions.append('(s.created_at, s.id) < (%s, %s)')
+        params.extend(decode_cursor(cursor))
+    
+    limit = query_params.get('limit')
+    try:
+        limit = int(limit) if limit else DEFAULT_PAGE_SIZE
+    except ValueError:
+        raise ValueError('Invalid limit')
+    return conditions, params, max(1, min(limit, MAX_PAGE_SIZE))
+
+def fetch_programs(cur, service_ids: list) -> dict:
+    """Программы только для услуг текущей страницы, сгруппированные по service_id"""
+    programs = {service_id: [] for service_id in service_ids}
+    if not service_ids:
+        return programs
+    cur.execute("""
+        SELECT id, service_id, name, description, unit, price, currency
+        FROM service_programs
+        WHERE service_id = ANY(%s)
+        ORDER BY service_id, price
+    """, (service_ids,))
+    for program in cur.fetchall():
+        programs[program['service_id']].append({
+            'id': program['id'],
+            'name': program['name'],
+            'description': program['description'],
+            'unit': program['unit'],
+            'price': float(program['price']),
+            'currency': program['currency']
+        })
+    return programs
+
+def insert_programs(cur, rows: list) -> None:
+    """Вставка программ одним multi-row INSERT; rows - кортежи (service_id, name, description, unit, price, currency)"""
+    if rows:
+        execute_values(cur, """
+            INSERT INTO service_programs (
+                service_id, name, description, unit, price, currency
+            ) VALUES %s
+        """, rows, page_size=len(rows))
+
+def validate_program(program: dict) -> tuple:
+    """Проверка программы, возвращает (name, description, unit, price, currency); ValueError при ошибке"""
+    name = str(program.get('name') or '').strip()
+    unit = str(program.get('unit') or '').strip()
+    currency = str(program.get('currency') or 'RUB').strip()
+    if not name or len(name) > 255:
+        raise ValueError('Program name is required (max 255 chars)')
+    if not unit or len(unit) > 50:
+        raise ValueError('Program unit is required (max 50 chars)')
+    if len(currency) > 10:
+        raise ValueError('Invalid currency')
+    try:
+        price = Decimal(str(program.get('price')).strip())
+    except (InvalidOperation, TypeError):
+        raise ValueError('Invalid program price')
+    if not price.is_finite() or price < 0 or price > MAX_PROGRAM_PRICE:
+        raise ValueError('Invalid program price')
+    description = program.get('description')
+    if description is not None and not isinstance(description, str):
+        raise ValueError('Program description must be a string')
+    return name, description, unit, price, currency
+
+def parse_bulk_services(data: dict) -> list:
+    """
+    Разбор загрузки агентства в список (row, service).
+    JSON: {"services": [{title, description, categoryId, images, programs: [...]}]}, row - индекс в массиве.
+    CSV: {"csv": "..."} с колонками title, description, category_id, program_name,
+    program_description, unit, price, currency; строки с одинаковым title объединяются
+    в одну услугу, row - номер строки файла.
+    """
+    if 'csv' in data:
+        services = {}
+        reader = csv.DictReader(io.StringIO(data.get('csv') or ''))
+        for line_no, record in enumerate(reader, start=2):
+            title = (record.get('title') or '').strip()
+            service = services.setdefault(title, {
+                'row': line_no,
+                'title': title,
+                'description': record.get('description') or None,
+                'categoryId': record.get('category_id') or None,
+                'images': [],
+                'programs': []
+            })
+            if record.get('program_name'):
+                service['programs'].append({
+                    '_line': line_no,
+                    'name': record.get('program_name'),
+                    'description': record.get('program_description') or None,
+                    'unit': record.get('unit'),
+                    'price': record.get('price'),
+                    'currency': record.get('currency') or 'RUB'
+                })
+        return [(service.pop('row'), service) for service in services.values()]
+    
+    services = data.get('services')
+    if not isinstance(services, list):
+        raise ValueError('Provide services array or csv')
+    return list(enumerate(services))
+
+def validate_service(row, service) -> tuple:
+    """
+    Проверка услуги из загрузки, возвращает (row, title, description, category_id, images, programs).
+    ValueError с номером строки ошибки (для CSV - строки программы) вторым аргументом.
+    """
+    if not isinstance(service, dict):
+        raise ValueError('Service must be an object', row)
+    title = str(service.get('title') or '').strip()
+    if not title or len(title) > 255:
+        raise ValueError('Title is required (max 255 chars)', row)
+    description = service.get('description')
+    if description is not None and not isinstance(description, str):
+        raise ValueError('Description must be a string', row)
+    category_id = service.get('categoryId')
+    if category_id is not None:
+        try:
+            category_id = int(category_id)
+        except (ValueError, TypeError):
+            raise ValueError('Invalid categoryId', row)
+    images = service.get('images') or []
+    if not isinstance(images, list) or not all(isinstance(image, str) for image in images):
+        raise ValueError('Images must be a list of strings', row)
+    if len(images) > MAX_SERVICE_IMAGES:
+        raise ValueError(f'Too many images, max {MAX_SERVICE_IMAGES}', row)
+    programs = service.get('programs') or []
+    if not isinstance(programs, list):
+        raise ValueError('Programs must be a list', row)
+    if len(programs) > MAX_SERVICE_PROGRAMS:
+        raise ValueError(f'Too many programs, max {MAX_SERVICE_PROGRAMS}', row)
+    validated = []
+    for program in programs:
+        if not isinstance(program, dict):
+            raise ValueError('Program must be an object', row)
+        try:
+            validated.append(validate_program(program))
+        except ValueError as e:
+            raise ValueError(str(e), program.get('_line', row))
+    return row, title, description, category_id, images, validated
+
+def insert_services(cur, user_id: int, valid: list) -> list:
+    """Вставка услуг с программами за три запроса: выделение id, вставка услуг, вставка программ"""
+    # Заранее выделяем id, чтобы однозначно связать программы с услугами
+    cur.execute(
+        "SELECT nextval(pg_get_serial_sequence('business_services', 'id')) AS id FROM generate_series(1, %s)",
+        (len(valid),)
+    )
+    service_ids = [record['id'] for record in cur.fetchall()]
+    now = datetime.utcnow()
+    
+    execute_values(cur, """
+        INSERT INTO business_services (
+            id, user_id, category_id, title, description,
+            status, images, published_at
+        ) VALUES %s
+    """, [
+        (service_id, user_id, category_id, title, description, 'active', images, now)
+        for service_id, (_, title, description, category_id, images, _) in zip(service_ids, valid)
+    ], template='(%s, %s, %s, %s, %s, %s, %s::text[], %s)', page_size=len(valid))
+    
+    insert_programs(cur, [
+        (service_id,) + program
+        for service_id, entry in zip(service_ids, valid)
+        for program in entry[5]
+    ])
+    return service_ids
+
+def bulk_import_services(cur, user_id: int, entries: list) -> tuple:
+    """
+    Импорт услуг одним пакетом. Услуга с ошибкой пропускается целиком и попадает в errors,
+    остальные импортируются.
+    Если пакет отклонила база (например, несуществующая категория), он откатывается
+    до точки сохранения и повторяется построчно, каждая строка в своей точке сохранения.
+    """
+    valid = []
+    errors = []
+    for row, service in entries:
+        try:
+            valid.append(validate_service(row, service))
+        except ValueError as e:
+            errors.append({'row': e.args[1] if len(e.args) > 1 else row, 'error': e.args[0]})
+    
+    if not valid:
+        return [], errors
+    
+    cur.execute('SAVEPOINT bulk_import')
+    try:
+        service_ids = insert_services(cur, user_id, valid)
+        imported = [{'row': entry[0], 'serviceId': service_id} for service_id, entry in zip(service_ids, valid)]
+    except psycopg2.Error:
+        cur.execute('ROLLBACK TO SAVEPOINT bulk_import')
+        imported = []
+        for entry in valid:
+            cur.execute('SAVEPOINT bulk_import_row')
+            try:
+                service_id = insert_services(cur, user_id, [entry])[0]
+            except psycopg2.Error as e:
+                cur.execute('ROLLBACK TO SAVEPOINT bulk_import_row')
+                errors.append({'row': entry[0], 'error': (e.pgerror or str(e)).strip().split('\n')[0]})
+                continue
+            cur.execute('RELEASE SAVEPOINT bulk_import_row')
+            imported.append({'row': entry[0], 'serviceId': service_id})
+    cur.execute('RELEASE SAVEPOINT bulk_import')
+    
+    errors.sort(key=lambda error: error['row'])
+    return imported, errors
 
 def handler(event: dict, context) -> dict:
     """API для управления бизнес-услугами"""
@@ -30,10 +269,7 @@ def handler(event: dict, context) -> dict:
         }
     
     try:
-        db_url = os.environ.get('DATABASE_URL')
-        schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-        
-        conn = psycopg2.connect(db_url, options=f'-c search_path={schema}')
+        conn = get_connection()
         conn.autocommit = False
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
@@ -41,39 +277,44 @@ def handler(event: dict, context) -> dict:
             
             if method == 'GET':
                 query_params = event.get('queryStringParameters', {}) or {}
-                status = query_params.get('status', 'active')
                 
-                cur.execute("""
+                try:
+                    conditions, params, limit = parse_list_params(query_params)
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': str(e)}),
+                        'isBase64Encoded': False
+                    }
+                
+                cur.execute(f"""
                     SELECT 
                         s.id, s.user_id, s.category_id, s.title, s.description,
                         s.status, s.images, s.created_at, s.published_at,
-                        u.username as owner_name, u.business_type,
-                        COALESCE(
-                            json_agg(
-                                json_build_object(
-                                    'id', p.id,
-                                    'name', p.name,
-                                    'description', p.description,
-                                    'unit', p.unit,
-                                    'price', p.price,
-                                    'currency', p.currency
-                                ) ORDER BY p.price
-                            ) FILTER (WHERE p.id IS NOT NULL),
-                            '[]'
-                        ) as programs
+                        s.programs_count, s.min_price,
+                        u.username as owner_name, u.business_type
                     FROM business_services s
                     LEFT JOIN users u ON s.user_id = u.id
-                    LEFT JOIN service_programs p ON s.id = p.service_id
-                    WHERE s.status = %s
-                    GROUP BY s.id, u.username, u.business_type
-                    ORDER BY s.created_at DESC
-                """, (status,))
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY s.created_at DESC, s.id DESC
+                    LIMIT %s
+                """, params + [limit + 1])
                 
                 services = cur.fetchall()
                 
+                next_cursor = None
+                if len(services) > limit:
+                    services = services[:limit]
+                    next_cursor = encode_cursor(services[-1]['created_at'], services[-1]['id'])
+                
+                programs = {}
+                if query_params.get('includePrograms', 'true') == 'true':
+                    programs = fetch_programs(cur, [service['id'] for service in services])
+                
                 result = []
                 for service in services:
-                    result.append({
+                    item = {
                         'id': service['id'],
                         'userId': service['user_id'],
                         'categoryId': service['category_id'],
@@ -83,15 +324,19 @@ def handler(event: dict, context) -> dict:
                         'images': service['images'] or [],
                         'ownerName': service['owner_name'],
                         'businessType': service['business_type'],
-                        'programs': service['programs'],
+                        'programsCount': service['programs_count'],
+                        'minPrice': float(service['min_price']) if service['min_price'] is not None else None,
                         'createdAt': service['created_at'].isoformat() if service['created_at'] else None,
                         'publishedAt': service['published_at'].isoformat() if service['published_at'] else None
-                    })
+                    }
+                    if service['id'] in programs:
+                        item['programs'] = programs[service['id']]
+                    result.append(item)
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'services': result}),
+                    'body': json.dumps({'services': result, 'nextCursor': next_cursor}),
                     'isBase64Encoded': False
                 }
             
@@ -107,6 +352,35 @@ def handler(event: dict, context) -> dict:
                 
                 data = json.loads(event.get('body', '{}'))
                 
+                if data.get('action') == 'bulk_import':
+                    try:
+                        entries = parse_bulk_services(data)
+                    except (ValueError, csv.Error) as e:
+                        return {
+                            'statusCode': 400,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': str(e)}),
+                            'isBase64Encoded': False
+                        }
+                    
+                    if len(entries) > MAX_BULK_SERVICES:
+                        return {
+                            'statusCode': 400,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': f'Too many services, max {MAX_BULK_SERVICES}'}),
+                            'isBase64Encoded': False
+                        }
+                    
+                    imported, errors = bulk_import_services(cur, user_id, entries)
+                    conn.commit()
+                    
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'success': True, 'imported': imported, 'errors': errors}),
+                        'isBase64Encoded': False
+                    }
+                
                 title = data.get('title')
                 description = data.get('description')
                 category_id = data.get('categoryId')
@@ -134,19 +408,17 @@ def handler(event: dict, context) -> dict:
                 
                 service_id = cur.fetchone()['id']
                 
-                for program in programs:
-                    cur.execute("""
-                        INSERT INTO service_programs (
-                            service_id, name, description, unit, price, currency
-                        ) VALUES (%s, %s, %s, %s, %s, %s)
-                    """, (
+                insert_programs(cur, [
+                    (
                         service_id,
                         program.get('name'),
                         program.get('description'),
                         program.get('unit'),
                         program.get('price'),
                         program.get('currency', 'RUB')
-                    ))
+                    )
+                    for program in programs
+                ])
                 
                 conn.commit()
                 
@@ -219,7 +491,7 @@ def handler(event: dict, context) -> dict:
             raise e
         finally:
             cur.close()
-            conn.close()
+            release_connection(conn)
     
     except Exception as e:
         return {
@@ -0,0 +1,62 @@
+import threading
+import time
+
+class CounterBuffer:
+    """
+    Буфер инкрементов счётчиков (просмотры, бронирования) по id объявления.
+    Накопленное сбрасывается одним батчем через flush_fn при достижении
+    max_pending событий или max_age секунд с первого несброшенного события.
+    """
+
+    def __init__(self, flush_fn, max_pending: int = 100, max_age: float = 10.0):
+        self.flush_fn = flush_fn
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self._pending = {}
+        self._count = 0
+        self._first_at = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def add(self, item_id: int, views: int = 0, bookings: int = 0) -> None:
+        with self._lock:
+            current = self._pending.setdefault(item_id, [0, 0])
+            current[0] += views
+            current[1] += bookings
+            self._count += 1
+            if self._first_at is None:
+                self._first_at = time.monotonic()
+            due = self._count >= self.max_pending or time.monotonic() - self._first_at >= self.max_age
+        if due:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing counters: {e}")
+
+    def pending(self) -> dict:
+        with self._lock:
+            return {item_id: tuple(values) for item_id, values in self._pending.items()}
+
+    def flush(self) -> int:
+        """Сбросить буфер; при ошибке инкременты возвращаются в буфер и не теряются"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._count = 0
+                self._first_at = None
+            if not batch:
+                return 0
+            rows = [(item_id, views, bookings) for item_id, (views, bookings) in batch.items()]
+            try:
+                self.flush_fn(rows)
+            except Exception:
+                with self._lock:
+                    for item_id, (views, bookings) in batch.items():
+                        current = self._pending.setdefault(item_id, [0, 0])
+                        current[0] += views
+                        current[1] += bookings
+                        self._count += 1
+                    if self._first_at is None:
+                        self._first_at = time.monotonic()
+                raise
+            return len(rows)
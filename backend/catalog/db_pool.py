@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+DB_POOL_MAX_AGE = int(os.environ.get('DB_POOL_MAX_AGE', '600'))
+DB_POOL_HEALTHCHECK_AFTER = int(os.environ.get('DB_POOL_HEALTHCHECK_AFTER', '30'))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+
+class ConnectionPool:
+    """Пул подключений к БД, живущий между тёплыми вызовами контейнера"""
+
+    def __init__(self, dsn: str, options: str = None, size: int = DB_POOL_SIZE,
+                 max_age: int = DB_POOL_MAX_AGE, healthcheck_after: int = DB_POOL_HEALTHCHECK_AFTER):
+        self.dsn = dsn
+        self.options = options
+        self.size = max(1, size)
+        self.max_age = max_age
+        self.healthcheck_after = healthcheck_after
+        self._idle = []
+        self._meta = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    def _connect(self):
+        if self.options:
+            conn = psycopg2.connect(self.dsn, options=self.options)
+        else:
+            conn = psycopg2.connect(self.dsn)
+        now = time.monotonic()
+        self._meta[id(conn)] = {'created_at': now, 'used_at': now}
+        return conn
+
+    def _discard(self, conn) -> None:
+        self._meta.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, conn) -> bool:
+        """Проверка соединения: не закрыто, не устарело, отвечает на ping после простоя"""
+        if conn.closed:
+            return False
+        meta = self._meta.get(id(conn))
+        if not meta:
+            return False
+        now = time.monotonic()
+        if now - meta['created_at'] > self.max_age:
+            return False
+        if now - meta['used_at'] > self.healthcheck_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def acquire(self, timeout: float = DB_POOL_ACQUIRE_TIMEOUT):
+        """Взять подключение из пула или открыть новое"""
+        if not self._slots.acquire(timeout=timeout):
+            raise Exception('Database connection pool exhausted')
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return self._connect()
+                if self._is_usable(conn):
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn) -> None:
+        """Вернуть подключение в пул, откатив незавершённую транзакцию"""
+        try:
+            if not conn.closed and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.closed or id(conn) not in self._meta:
+                self._discard(conn)
+                return
+            conn.autocommit = False
+            self._meta[id(conn)]['used_at'] = time.monotonic()
+            with self._lock:
+                self._idle.append(conn)
+        except psycopg2.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """Пул уровня модуля: создаётся при первом вызове и переиспользуется тёплым контейнером"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                db_url = os.environ.get('DATABASE_URL')
+                if not db_url:
+                    raise Exception('DATABASE_URL not configured')
+                schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+                _pool = ConnectionPool(db_url, options=f'-c search_path={schema}')
+    return _pool
+
+def get_connection():
+    """Получить подключение из общего пула"""
+    return get_pool().acquire()
+
+def release_connection(conn) -> None:
+    """Вернуть подключение в общий пул вместо conn.close()"""
+    get_pool().release(conn)
@@ -1,16 +1,256 @@
 import json
 import os
+import base64
+import atexit
+import signal
 from datetime import datetime
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from db_pool import get_connection, release_connection
+from auth_middleware import get_user_id_from_token
+from response_cache import ResponseCache
+from counter_buffer import CounterBuffer
 
-def get_user_id_from_token(headers: dict) -> int:
-    """Извлечение user_id из токена"""
-    auth_header = headers.get('x-authorization', headers.get('X-Authorization', ''))
-    if not auth_header:
-        return None
-    token = auth_header.replace('Bearer ', '')
-    return int(token.split(':')[0]) if ':' in token else None
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 100
+
+listing_cache = ResponseCache(
+    max_entries=int(os.environ.get('CATALOG_CACHE_SIZE', '256')),
+    ttl=float(os.environ.get('CATALOG_CACHE_TTL', '30'))
+)
+
+TRACKING_ACTIONS = {'track_view': 'views', 'track_booking': 'bookings'}
+
+def flush_counters(rows: list) -> None:
+    """Батчевое обновление счётчиков одним UPDATE ... FROM (VALUES ...)"""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        execute_values(cur, """
+            UPDATE catalog_items AS c
+            SET views_count = COALESCE(c.views_count, 0) + v.views,
+                bookings_count = COALESCE(c.bookings_count, 0) + v.bookings
+            FROM (VALUES %s) AS v(id, views, bookings)
+            WHERE c.id = v.id
+        """, sorted(rows))
+        conn.commit()
+        cur.close()
+    finally:
+        release_connection(conn)
+
+counters = CounterBuffer(
+    flush_counters,
+    max_pending=int(os.environ.get('CATALOG_COUNTERS_FLUSH_SIZE', '100')),
+    max_age=float(os.environ.get('CATALOG_COUNTERS_FLUSH_SECONDS', '10'))
+)
+
+def drain_counters() -> None:
+    """Сброс накопленных счётчиков при остановке контейнера"""
+    try:
+        counters.flush()
+    except Exception as e:
+        print(f"Error draining counters: {e}")
+
+atexit.register(drain_counters)
+
+try:
+    _previous_sigterm = signal.getsignal(signal.SIGTERM)
+
+    def _on_sigterm(signum, frame):
+        drain_counters()
+        if callable(_previous_sigterm):
+            _previous_sigterm(signum, frame)
+        else:
+            raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, _on_sigterm)
+except ValueError:
+    pass
+
+# Фильтры вида параметр -> (условие, тип значения)
+CATALOG_FILTERS = {
+    'category': ('category = %s', str),
+    'bodyType': ('body_type = %s', str),
+    'country': ('country = %s', str),
+    'minPrice': ('price_value >= %s', float),
+    'maxPrice': ('price_value <= %s', float),
+    'minAge': ('age >= %s', int),
+    'maxAge': ('age <= %s', int),
+    'minHeight': ('height >= %s', int),
+    'maxHeight': ('height <= %s', int),
+}
+
+CATALOG_COLUMNS = """
+    id, user_id, agency_id, agency_name, title, description,
+    price, category, age, height, body_type, country, location,
+    image_url, avatar_url, images, is_active, is_verified,
+    work_schedule, views_count, bookings_count, rating,
+    created_at, updated_at
+"""
+
+def encode_cursor(*key) -> str:
+    """Непрозрачный курсор для keyset-пагинации: (created_at, id) или (rank, id) в режиме поиска"""
+    raw = json.dumps([k.isoformat() if isinstance(k, datetime) else k for k in key]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str, *casts) -> list:
+    """Разбор курсора с приведением типов, ValueError при некорректном значении"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded))
+        if len(key) != len(casts):
+            raise ValueError
+        return [cast(value) for cast, value in zip(casts, key)]
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def build_catalog_filters(query_params: dict) -> tuple:
+    """Условия WHERE и параметры для выборки каталога, ValueError при некорректных фильтрах"""
+    conditions = ['is_active = %s']
+    params = [query_params.get('active', 'true') == 'true']
+    
+    location = query_params.get('location')
+    if location:
+        conditions.append('location ILIKE %s')
+        params.append(f"%{location}%")
+    
+    for name, (condition, cast) in CATALOG_FILTERS.items():
+        value = query_params.get(name)
+        if value in (None, ''):
+            continue
+        try:
+            params.append(cast(value))
+        except ValueError:
+            raise ValueError(f'Invalid value for {name}')
+        conditions.append(condition)
+    
+    verified = query_params.get('verified')
+    if verified in ('true', 'false'):
+        conditions.append('is_verified = %s')
+        params.append(verified == 'true')
+    
+    return conditions, params
+
+def parse_limit(value) -> int:
+    """Размер страницы с ограничением сверху"""
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('Invalid limit')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def build_catalog_query(query_params: dict) -> tuple:
+    """
+    SQL и параметры страницы каталога.
+    Обычный режим сортирует по (created_at, id), режим поиска (?q=) - по релевантности
+    full-text по title+description и триграммной близости title.
+    """
+    conditions, params = build_catalog_filters(query_params)
+    limit = parse_limit(query_params.get('limit'))
+    cursor = query_params.get('cursor')
+    search = (query_params.get('q') or '').strip()
+    
+    if not search:
+        if cursor:
+            conditions.append('(created_at, id) < (%s, %s)')
+            params.extend(decode_cursor(cursor, datetime.fromisoformat, int))
+        query = f"""
+            SELECT {CATALOG_COLUMNS}
+            FROM catalog_items
+            WHERE {' AND '.join(conditions)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """
+        return query, params + [limit + 1], limit, lambda row: (row['created_at'], row['id'])
+    
+    conditions.append("(search_vector @@ websearch_to_tsquery('russian', %s) OR title %% %s)")
+    params = [search, search] + params + [search, search]
+    
+    cursor_condition = ''
+    if cursor:
+        cursor_condition = 'WHERE (rank, id) < (%s::float8, %s)'
+        params.extend(decode_cursor(cursor, float, int))
+    
+    query = f"""
+        SELECT * FROM (
+            SELECT {CATALOG_COLUMNS},
+                (ts_rank(search_vector, websearch_to_tsquery('russian', %s)) + similarity(title, %s))::float8 AS rank
+            FROM catalog_items
+            WHERE {' AND '.join(conditions)}
+        ) ranked
+        {cursor_condition}
+        ORDER BY rank DESC, id DESC
+        LIMIT %s
+    """
+    return query, params + [limit + 1], limit, lambda row: (row['rank'], row['id'])
+
+def serialize_item(item: dict) -> dict:
+    """Преобразование строки catalog_items в формат API"""
+    return {
+        'id': item['id'],
+        'userId': item['user_id'],
+        'agencyId': item['agency_id'],
+        'agencyName': item['agency_name'],
+        'title': item['title'],
+        'description': item['description'],
+        'price': item['price'],
+        'category': item['category'],
+        'age': item['age'],
+        'height': item['height'],
+        'bodyType': item['body_type'],
+        'country': item['country'],
+        'location': item['location'],
+        'imageUrl': item['image_url'],
+        'avatarUrl': item['avatar_url'],
+        'images': item['images'] or [],
+        'isActive': item['is_active'],
+        'isVerified': item['is_verified'],
+        'workSchedule': item['work_schedule'],
+        'viewsCount': item['views_count'],
+        'bookingsCount': item['bookings_count'],
+        'rating': float(item['rating']) if item['rating'] else 0,
+        'createdAt': item['created_at'].isoformat() if item['created_at'] else None
+    }
+
+def listing_response(body: str, etag: str, cache_status: str, headers: dict) -> dict:
+    """Ответ со списком объявлений, 304 если клиент прислал актуальный ETag"""
+    response_headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag, X-Cache, X-Cache-Hits, X-Cache-Misses',
+        'ETag': etag
+    }
+    response_headers.update(listing_cache.stats_headers(cache_status))
+    
+    if_none_match = headers.get('if-none-match', headers.get('If-None-Match', ''))
+    client_etags = [tag.strip().replace('W/', '', 1) for tag in if_none_match.split(',')]
+    if etag in client_etags or if_none_match.strip() == '*':
+        return {'statusCode': 304, 'headers': response_headers, 'body': '', 'isBase64Encoded': False}
+    
+    return {'statusCode': 200, 'headers': response_headers, 'body': body, 'isBase64Encoded': False}
+
+def track_event(data: dict) -> dict:
+    """Учёт просмотра/бронирования без обращения к БД на каждый запрос"""
+    try:
+        item_id = int(data.get('itemId'))
+    except (TypeError, ValueError):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Item ID is required'}),
+            'isBase64Encoded': False
+        }
+    
+    counter = TRACKING_ACTIONS[data['action']]
+    counters.add(item_id, views=1 if counter == 'views' else 0, bookings=1 if counter == 'bookings' else 0)
+    
+    return {
+        'statusCode': 202,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'success': True}),
+        'isBase64Encoded': False
+    }
 
 def handler(event: dict, context) -> dict:
     """API для работы с объявлениями каталога"""
@@ -22,18 +262,37 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
+    headers = event.get('headers', {}) or {}
+    cache_key = None
+    if method == 'GET' and not get_user_id_from_token(headers):
+        cache_key = ResponseCache.make_key(event.get('queryStringParameters'), {'active': 'true'})
+        cached = listing_cache.get(cache_key)
+        if cached:
+            return listing_response(cached[0], cached[1], 'HIT', headers)
+    
     try:
-        db_url = os.environ.get('DATABASE_URL')
-        schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+        if method == 'POST':
+            try:
+                data = json.loads(event.get('body') or '{}')
+            except json.JSONDecodeError:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Invalid JSON'}),
+                    'isBase64Encoded': False
+                }
+            # Учёт просмотров/бронирований не берёт соединение из пула
+            if isinstance(data, dict) and data.get('action') in TRACKING_ACTIONS:
+                return track_event(data)
         
-        conn = psycopg2.connect(db_url, options=f'-c search_path={schema}')
+        conn = get_connection()
         conn.autocommit = False
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
@@ -41,69 +300,33 @@ def handler(event: dict, context) -> dict:
             
             if method == 'GET':
                 query_params = event.get('queryStringParameters', {}) or {}
-                location = query_params.get('location')
-                category = query_params.get('category')
-                is_active = query_params.get('active', 'true') == 'true'
-                
-                query = """
-                    SELECT 
-                        id, user_id, agency_id, agency_name, title, description,
-                        price, category, age, height, body_type, country, location,
-                        image_url, avatar_url, images, is_active, is_verified,
-                        work_schedule, views_count, bookings_count, rating,
-                        created_at, updated_at
-                    FROM catalog_items
-                    WHERE is_active = %s
-                """
-                params = [is_active]
-                
-                if location:
-                    query += " AND location ILIKE %s"
-                    params.append(f"%{location}%")
-                
-                if category:
-                    query += " AND category = %s"
-                    params.append(category)
-                
-                query += " ORDER BY created_at DESC LIMIT 100"
+                
+                try:
+                    query, params, limit, cursor_key = build_catalog_query(query_params)
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': str(e)}),
+                        'isBase64Encoded': False
+                    }
                 
                 cur.execute(query, params)
                 items = cur.fetchall()
                 
-                result = []
-                for item in items:
-                    result.append({
-                        'id': item['id'],
-                        'userId': item['user_id'],
-                        'agencyId': item['agency_id'],
-                        'agencyName': item['agency_name'],
-                        'title': item['title'],
-                        'description': item['description'],
-                        'price': item['price'],
-                        'category': item['category'],
-                        'age': item['age'],
-                        'height': item['height'],
-                        'bodyType': item['body_type'],
-                        'country': item['country'],
-                        'location': item['location'],
-                        'imageUrl': item['image_url'],
-                        'avatarUrl': item['avatar_url'],
-                        'images': item['images'] or [],
-                        'isActive': item['is_active'],
-                        'isVerified': item['is_verified'],
-                        'workSchedule': item['work_schedule'],
-                        'viewsCount': item['views_count'],
-                        'bookingsCount': item['bookings_count'],
-                        'rating': float(item['rating']) if item['rating'] else 0,
-                        'createdAt': item['created_at'].isoformat() if item['created_at'] else None
-                    })
+                next_cursor = None
+                if len(items) > limit:
+                    items = items[:limit]
+                    next_cursor = encode_cursor(*cursor_key(items[-1]))
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'items': result}),
-                    'isBase64Encoded': False
-                }
+                result = [serialize_item(item) for item in items]
+                body = json.dumps({'items': result, 'nextCursor': next_cursor})
+                
+                if cache_key is None:
+                    return listing_response(body, ResponseCache.make_etag(body), 'BYPASS', headers)
+                
+                etag = listing_cache.put(cache_key, body)
+                return listing_response(body, etag, 'MISS', headers)
             
             elif method == 'POST':
                 user_id = get_user_id_from_token(event.get('headers', {}))
@@ -146,6 +369,7 @@ def handler(event: dict, context) -> dict:
                 
                 item_id = cur.fetchone()['id']
                 conn.commit()
+                listing_cache.invalidate()
                 
                 return {
                     'statusCode': 201,
@@ -209,6 +433,7 @@ def handler(event: dict, context) -> dict:
                     query = f"UPDATE catalog_items SET {', '.join(update_fields)} WHERE id = %s"
                     cur.execute(query, params)
                     conn.commit()
+                    listing_cache.invalidate()
                 
                 return {
                     'statusCode': 200,
@@ -230,7 +455,7 @@ def handler(event: dict, context) -> dict:
             raise e
         finally:
             cur.close()
-            conn.close()
+            release_connection(conn)
     
     except Exception as e:
         return {
@@ -0,0 +1,63 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+class ResponseCache:
+    """LRU-кеш готовых JSON-ответов с TTL, живёт в тёплом контейнере"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(params: dict, defaults: dict = None) -> tuple:
+        """Нормализованный ключ: пустые значения отброшены, порядок параметров не важен"""
+        merged = dict(defaults or {})
+        merged.update({k: v for k, v in (params or {}).items() if v not in (None, '')})
+        return tuple(sorted((k, str(v).strip()) for k, v in merged.items()))
+
+    @staticmethod
+    def make_etag(body: str) -> str:
+        return '"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+
+    def get(self, key: tuple):
+        """(body, etag) или None; считает попадания и промахи"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], entry[2]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, body: str) -> str:
+        """Сохранить сериализованный ответ, вернуть его ETag"""
+        etag = self.make_etag(body)
+        if self.max_entries <= 0:
+            return etag
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, body, etag)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag
+
+    def invalidate(self) -> None:
+        """Сбросить все записи после изменения объявлений"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats_headers(self, status: str) -> dict:
+        return {
+            'X-Cache': status,
+            'X-Cache-Hits': str(self.hits),
+            'X-Cache-Misses': str(self.misses)
+        }
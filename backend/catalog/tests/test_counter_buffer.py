@@ -0,0 +1,125 @@
+"""Буфер счётчиков не теряет инкременты при параллельных вызовах"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from counter_buffer import CounterBuffer  # noqa: E402
+
+THREADS = 16
+EVENTS_PER_THREAD = 2000
+ITEMS = 7
+
+class Sink:
+    """flush_fn, складывающий батчи как UPDATE ... FROM (VALUES ...)"""
+
+    def __init__(self, fail_every: int = 0):
+        self.views = Counter()
+        self.bookings = Counter()
+        self.calls = 0
+        self.fail_every = fail_every
+        self._lock = threading.Lock()
+
+    def __call__(self, rows: list) -> None:
+        with self._lock:
+            self.calls += 1
+            if self.fail_every and self.calls % self.fail_every == 0:
+                raise RuntimeError('database is unavailable')
+        # Медленный батч: добавления идут параллельно с его записью
+        time.sleep(0.0005)
+        with self._lock:
+            for item_id, views, bookings in rows:
+                self.views[item_id] += views
+                self.bookings[item_id] += bookings
+
+def run_concurrently(buffer: CounterBuffer) -> None:
+    # Частое переключение потоков, чтобы гонка в add/flush проявилась
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        start_workers(buffer)
+    finally:
+        sys.setswitchinterval(interval)
+
+def start_workers(buffer: CounterBuffer) -> None:
+    barrier = threading.Barrier(THREADS)
+
+    def worker(n):
+        barrier.wait()
+        for i in range(EVENTS_PER_THREAD):
+            item_id = (n + i) % ITEMS
+            if i % 3 == 0:
+                buffer.add(item_id, bookings=1)
+            else:
+                buffer.add(item_id, views=1)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def expected_totals() -> tuple:
+    views, bookings = Counter(), Counter()
+    for n in range(THREADS):
+        for i in range(EVENTS_PER_THREAD):
+            item_id = (n + i) % ITEMS
+            if i % 3 == 0:
+                bookings[item_id] += 1
+            else:
+                views[item_id] += 1
+    return views, bookings
+
+def drain(buffer: CounterBuffer) -> None:
+    while buffer.pending():
+        try:
+            buffer.flush()
+        except RuntimeError:
+            pass
+
+def test_concurrent_adds_lose_no_increments():
+    sink = Sink()
+    buffer = CounterBuffer(sink, max_pending=50, max_age=0.01)
+    run_concurrently(buffer)
+    drain(buffer)
+
+    views, bookings = expected_totals()
+    assert sink.views == views
+    assert sink.bookings == bookings
+    assert sink.calls > 1
+
+def test_failed_flushes_return_increments_to_buffer(capsys):
+    sink = Sink(fail_every=3)
+    buffer = CounterBuffer(sink, max_pending=50, max_age=0.01)
+    run_concurrently(buffer)
+    drain(buffer)
+
+    views, bookings = expected_totals()
+    assert sink.views == views
+    assert sink.bookings == bookings
+    assert 'Error flushing counters' in capsys.readouterr().out
+
+def test_flush_merges_increments_per_item():
+    batches = []
+    buffer = CounterBuffer(batches.append, max_pending=1000, max_age=60)
+    buffer.add(1, views=1)
+    buffer.add(1, views=1)
+    buffer.add(2, bookings=1)
+    buffer.add(1, bookings=1)
+
+    assert buffer.flush() == 2
+    assert sorted(batches[0]) == [(1, 2, 1), (2, 0, 1)]
+    assert buffer.pending() == {}
+    assert buffer.flush() == 0
+
+def test_flush_on_size_threshold():
+    batches = []
+    buffer = CounterBuffer(batches.append, max_pending=3, max_age=60)
+    buffer.add(1, views=1)
+    buffer.add(2, views=1)
+    assert batches == []
+    buffer.add(1, views=1)
+    assert sorted(batches[0]) == [(1, 2, 0), (2, 1, 0)]
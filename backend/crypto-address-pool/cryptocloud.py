@@ -0,0 +1,73 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+CRYPTOCLOUD_API_URL = os.environ.get('CRYPTOCLOUD_API_URL', 'https://api.cryptocloud.plus/v2').rstrip('/')
+CRYPTOCLOUD_TIMEOUT = float(os.environ.get('CRYPTOCLOUD_TIMEOUT', '10'))
+CRYPTOCLOUD_WORKERS = int(os.environ.get('CRYPTOCLOUD_WORKERS', '5'))
+
+# HTTP-сессия с keep-alive и пул потоков живут в тёплом контейнере между вызовами
+_session = None
+_session_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=CRYPTOCLOUD_WORKERS, thread_name_prefix='cryptocloud')
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CRYPTOCLOUD_WORKERS)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+def create_invoice(currency: str, order_id: str, api_key: str, add_fields: dict = None, amount: float = 0) -> dict:
+    """Создание инвойса в CryptoCloud для генерации адреса; возвращает result с address, tag, uuid"""
+    url = f'{CRYPTOCLOUD_API_URL}/invoice/create'
+
+    headers = {
+        'Authorization': f'Token {api_key}',
+        'Content-Type': 'application/json'
+    }
+
+    payload = {
+        'amount': amount,
+        'currency': currency,
+        'order_id': order_id
+    }
+    if add_fields:
+        payload['add_fields'] = add_fields
+
+    response = get_session().post(url, headers=headers, json=payload, timeout=CRYPTOCLOUD_TIMEOUT)
+    response.raise_for_status()
+
+    invoice = response.json()
+    if invoice.get('status') != 'success':
+        raise Exception('Failed to create CryptoCloud invoice')
+
+    result = invoice.get('result', {})
+    if not result.get('address'):
+        raise Exception('CryptoCloud invoice has no address')
+    return result
+
+def create_invoices(orders: list, api_key: str) -> list:
+    """
+    Параллельное создание инвойсов: orders - список (currency, order_id, add_fields).
+    Возвращает список (currency, result или исключение) в том же порядке.
+    """
+    futures = [
+        (currency, _executor.submit(create_invoice, currency, order_id, api_key, add_fields))
+        for currency, order_id, add_fields in orders
+    ]
+    results = []
+    for currency, future in futures:
+        try:
+            results.append((currency, future.result()))
+        except Exception as e:
+            print(f"Error creating CryptoCloud invoice for {currency}: {e}")
+            results.append((currency, e))
+    return results
@@ -0,0 +1,158 @@
+'''Пополнение пула заранее созданных адресов депозита CryptoCloud'''
+import json
+import os
+import uuid
+import psycopg2
+from psycopg2.extras import execute_values
+from cryptocloud import create_invoices
+from worker_auth import is_worker_request
+
+SUPPORTED_CURRENCIES = ['BTC', 'ETH', 'USDT', 'LTC', 'BCH']
+
+# Пул валюты пополняется, когда свободных адресов меньше POOL_LOW_WATER, до POOL_TARGET
+POOL_LOW_WATER = int(os.environ.get('CRYPTO_POOL_LOW_WATER', '20'))
+POOL_TARGET = int(os.environ.get('CRYPTO_POOL_TARGET', '50'))
+POOL_MAX_CREATE_PER_RUN = int(os.environ.get('CRYPTO_POOL_MAX_CREATE_PER_RUN', '100'))
+# Свободный адрес старше этого срока не выдаётся: инвойс на стороне CryptoCloud мог истечь
+POOL_ADDRESS_TTL = int(os.environ.get('CRYPTO_POOL_ADDRESS_TTL', '43200'))
+
+# Ключ advisory-блокировки: два пополнения одновременно не идут
+REFILL_LOCK_KEY = 72310503
+
+def expire_pooled(cur) -> int:
+    cur.execute("""
+        UPDATE crypto_deposit_addresses
+        SET status = 'expired', updated_at = CURRENT_TIMESTAMP
+        WHERE status = 'pooled' AND expires_at <= CURRENT_TIMESTAMP
+    """)
+    return cur.rowcount
+
+def pool_levels(cur) -> dict:
+    cur.execute("""
+        SELECT currency, COUNT(*) FROM crypto_deposit_addresses
+        WHERE status = 'pooled' AND expires_at > CURRENT_TIMESTAMP
+        GROUP BY currency
+    """)
+    levels = {currency: 0 for currency in SUPPORTED_CURRENCIES}
+    levels.update(dict(cur.fetchall()))
+    return levels
+
+def plan_refill(levels: dict) -> list:
+    """
+    Заказы инвойсов для валют ниже POOL_LOW_WATER, не больше POOL_MAX_CREATE_PER_RUN за запуск;
+    первыми пополняются самые пустые пулы
+    """
+    orders = []
+    for currency in sorted(SUPPORTED_CURRENCIES, key=lambda c: levels.get(c, 0)):
+        if levels.get(currency, 0) >= POOL_LOW_WATER:
+            continue
+        for _ in range(POOL_TARGET - levels.get(currency, 0)):
+            if len(orders) >= POOL_MAX_CREATE_PER_RUN:
+                return orders
+            orders.append((currency, f'pool_{currency}_{uuid.uuid4().hex}', None))
+    return orders
+
+def refill(conn, api_key: str) -> dict:
+    """
+    Снять с пула просроченные адреса и дозаказать недостающие.
+    Запросы к CryptoCloud идут вне транзакции, новые адреса вставляются одним INSERT.
+    """
+    cur = conn.cursor()
+    cur.execute('SELECT pg_try_advisory_lock(%s)', (REFILL_LOCK_KEY,))
+    if not cur.fetchone()[0]:
+        cur.close()
+        return {'skipped': 'another refill is in progress'}
+
+    try:
+        expired = expire_pooled(cur)
+        levels = pool_levels(cur)
+
+        rows, failed = [], 0
+        for currency, result in create_invoices(plan_refill(levels), api_key):
+            if isinstance(result, Exception):
+                failed += 1
+            else:
+                rows.append((currency, result.get('address'), result.get('tag'), result.get('uuid')))
+
+        if rows:
+            execute_values(cur, """
+                INSERT INTO crypto_deposit_addresses (
+                    currency, address, tag, invoice_id, status, expires_at
+                ) VALUES %s
+            """, rows, template=f"(%s, %s, %s, %s, 'pooled', CURRENT_TIMESTAMP + INTERVAL '{POOL_ADDRESS_TTL} seconds')")
+            for currency, *_ in rows:
+                levels[currency] += 1
+    finally:
+        cur.execute('SELECT pg_advisory_unlock(%s)', (REFILL_LOCK_KEY,))
+        cur.close()
+
+    return {'expired': expired, 'created': len(rows), 'failed': failed, 'pool': levels}
+
+def handler(event: dict, context) -> dict:
+    '''
+    Вызывается по расписанию POST-запросом с заголовком X-Worker-Secret.
+    Держит в crypto_deposit_addresses запас свободных адресов (status = pooled) по каждой валюте,
+    чтобы crypto-deposit выдавал адрес из БД без запроса к CryptoCloud.
+    '''
+    method = event.get('httpMethod', 'POST')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Worker-Secret',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    if not is_worker_request(event.get('headers')):
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'}),
+            'isBase64Encoded': False
+        }
+
+    api_key = os.environ.get('CRYPTOCLOUD_API_KEY')
+    if not api_key:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'CryptoCloud API key not configured'}),
+            'isBase64Encoded': False
+        }
+
+    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], options=f'-c search_path={schema}')
+    conn.autocommit = True
+    try:
+        result = refill(conn, api_key)
+    except Exception as e:
+        print(f"Error refilling deposit address pool: {e}")
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    finally:
+        conn.close()
+
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(result),
+        'isBase64Encoded': False
+    }
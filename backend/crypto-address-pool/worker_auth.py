@@ -0,0 +1,14 @@
+import hmac
+import os
+
+def is_worker_request(headers: dict) -> bool:
+    """
+    Проверка служебного вызова (по расписанию или вручную): заголовок X-Worker-Secret
+    должен совпадать с WORKER_SECRET. Если секрет не задан, вызов отклоняется.
+    """
+    secret = os.environ.get('WORKER_SECRET', '')
+    if not secret:
+        return False
+    headers = headers or {}
+    provided = headers.get('X-Worker-Secret') or headers.get('x-worker-secret') or ''
+    return hmac.compare_digest(provided.encode('utf-8'), secret.encode('utf-8'))
@@ -1,90 +1,169 @@
 import json
 import os
-import requests
+import threading
+import time
 from datetime import datetime
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from db_pool import get_connection, release_connection
+from auth_middleware import get_user_id_from_token
+from cryptocloud import create_invoices
 
-def get_user_id_from_token(headers: dict) -> int:
-    """Извлечение user_id из токена"""
-    auth_header = headers.get('x-authorization', headers.get('X-Authorization', ''))
-    if not auth_header:
-        return None
-    token = auth_header.replace('Bearer ', '')
-    return int(token.split(':')[0]) if ':' in token else None
+ADDRESS_CACHE_TTL = int(os.environ.get('ADDRESS_CACHE_TTL', '300'))
 
-def create_cryptocloud_invoice(amount: float, currency: str, user_id: int, api_key: str) -> dict:
-    """Создание инвойса в CryptoCloud для генерации адреса"""
-    url = 'https://api.cryptocloud.plus/v2/invoice/create'
-    
-    headers = {
-        'Authorization': f'Token {api_key}',
-        'Content-Type': 'application/json'
-    }
-    
-    payload = {
-        'amount': amount,
+SUPPORTED_CURRENCIES = ['BTC', 'ETH', 'USDT', 'LTC', 'BCH']
+
+# Ключ advisory-блокировки выдачи адресов; второй ключ - user_id
+PROVISION_LOCK_KEY = 72310502
+
+# (user_id, currency) -> (срок жизни записи по time.monotonic(), адрес)
+_address_cache = {}
+_cache_lock = threading.Lock()
+
+def format_address(row: dict, currency: str) -> dict:
+    return {
+        'address': row['address'],
+        'tag': row['tag'],
         'currency': currency,
-        'order_id': f'deposit_{user_id}_{int(datetime.utcnow().timestamp())}',
-        'add_fields': {
-            'user_id': str(user_id)
-        }
+        'invoice_id': row['invoice_id'],
+        'created_at': row['created_at'].isoformat() if row['created_at'] else None
     }
-    
-    response = requests.post(url, headers=headers, json=payload, timeout=10)
-    response.raise_for_status()
-    
-    return response.json()
 
-def get_or_create_deposit_address(user_id: int, currency: str, conn, api_key: str) -> dict:
-    """Получить существующий или создать новый адрес для депозита"""
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
+def cache_get(user_id: int, currencies: list) -> dict:
+    now = time.monotonic()
+    found = {}
+    with _cache_lock:
+        for currency in currencies:
+            entry = _address_cache.get((user_id, currency))
+            if entry and entry[0] > now:
+                found[currency] = entry[1]
+    return found
+
+def cache_put(user_id: int, addresses: dict, lifetimes: dict) -> None:
+    """
+    Запись в кеш не переживает expires_at адреса: lifetimes - секунды до истечения
+    адреса по валютам (нет ключа или None - срок не ограничен)
+    """
+    now = time.monotonic()
+    with _cache_lock:
+        for currency, info in addresses.items():
+            if 'error' in info:
+                continue
+            lifetime = ADDRESS_CACHE_TTL
+            if lifetimes.get(currency) is not None:
+                lifetime = min(lifetime, float(lifetimes[currency]))
+            if lifetime > 0:
+                _address_cache[(user_id, currency)] = (now + lifetime, info)
+
+def collect_addresses(rows: list, found: dict, lifetimes: dict) -> None:
+    """Строки crypto_deposit_addresses с колонкой expires_in - в адреса и сроки для кеша"""
+    for row in rows:
+        found[row['currency']] = format_address(row, row['currency'])
+        lifetimes[row['currency']] = row['expires_in']
+
+def load_addresses(cur, user_id: int, currencies: list) -> list:
+    """
+    Активные адреса пользователя по всем валютам одним запросом.
+    Адрес из пула с истёкшим expires_at не возвращается: его инвойс в CryptoCloud мог истечь,
+    и пользователь получит новый адрес.
+    """
     cur.execute("""
-        SELECT address, tag, invoice_id, created_at
+        SELECT DISTINCT ON (currency) currency, address, tag, invoice_id, created_at,
+               EXTRACT(EPOCH FROM expires_at - CURRENT_TIMESTAMP) AS expires_in
         FROM crypto_deposit_addresses
-        WHERE user_id = %s AND currency = %s AND status = 'active'
-        ORDER BY created_at DESC
-        LIMIT 1
-    """, (user_id, currency))
-    
-    existing = cur.fetchone()
+        WHERE user_id = %s AND currency = ANY(%s) AND status = 'active'
+          AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+        ORDER BY currency, created_at DESC
+    """, (user_id, currencies))
+    return cur.fetchall()
+
+def claim_pooled(cur, user_id: int, currencies: list) -> list:
+    """
+    Закрепить за пользователем по одному адресу из пула на каждую валюту.
+    Берётся самый свежий адрес: до истечения его инвойса остаётся больше всего времени.
+    SKIP LOCKED: параллельные запросы разных пользователей берут разные строки, не дожидаясь друг друга.
+    """
+    cur.execute("""
+        UPDATE crypto_deposit_addresses a
+        SET user_id = %s, status = 'active', updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT p.id
+            FROM unnest(%s::varchar[]) AS c(currency)
+            CROSS JOIN LATERAL (
+                SELECT id FROM crypto_deposit_addresses
+                WHERE status = 'pooled' AND currency = c.currency AND expires_at > CURRENT_TIMESTAMP
+                ORDER BY created_at DESC
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            ) p
+        ) picked
+        WHERE a.id = picked.id
+        RETURNING a.currency, a.address, a.tag, a.invoice_id, a.created_at,
+                  EXTRACT(EPOCH FROM a.expires_at - CURRENT_TIMESTAMP) AS expires_in
+    """, (user_id, currencies))
+    return cur.fetchall()
+
+def get_deposit_addresses(user_id: int, currencies: list, conn, api_key: str) -> dict:
+    """
+    Адреса для депозита по списку валют: кеш, затем одна выборка из БД,
+    затем свободные адреса из пула (наполняет функция crypto-address-pool);
+    только если пул пуст, инвойсы создаются в CryptoCloud параллельно.
+    Выдача новых адресов пользователю идёт под advisory-блокировкой до коммита,
+    поэтому двойной клик не создаёт два инвойса на одну валюту.
+    Для валюты, инвойс которой создать не удалось, возвращается {'error': ...}.
+    """
+    addresses = cache_get(user_id, currencies)
+    missing = [c for c in currencies if c not in addresses]
+    if not missing:
+        return addresses
     
-    if existing:
-        return {
-            'address': existing['address'],
-            'tag': existing['tag'],
-            'currency': currency,
-            'invoice_id': existing['invoice_id'],
-            'created_at': existing['created_at'].isoformat() if existing['created_at'] else None
-        }
+    cur = conn.cursor(cursor_factory=RealDictCursor)
     
-    invoice = create_cryptocloud_invoice(0, currency, user_id, api_key)
+    found, lifetimes = {}, {}
+    collect_addresses(load_addresses(cur, user_id, missing), found, lifetimes)
+    if len(found) < len(missing):
+        cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (PROVISION_LOCK_KEY, user_id))
+        # Пока ждали блокировку, параллельный запрос мог уже создать адреса
+        collect_addresses(load_addresses(cur, user_id, missing), found, lifetimes)
     
-    if invoice.get('status') == 'success':
-        result = invoice.get('result', {})
-        address = result.get('address')
-        tag = result.get('tag')
-        invoice_id = result.get('uuid')
+        to_create = [c for c in missing if c not in found]
+        if to_create:
+            collect_addresses(claim_pooled(cur, user_id, to_create), found, lifetimes)
+            to_create = [c for c in to_create if c not in found]
         
-        cur.execute("""
-            INSERT INTO crypto_deposit_addresses (
-                user_id, currency, address, tag, invoice_id, status
-            ) VALUES (%s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (user_id, currency, address, tag, invoice_id, 'active'))
+        # Пул по валюте пуст - создаём инвойс сразу, как раньше
+        timestamp = int(datetime.utcnow().timestamp())
+        orders = [
+            (currency, f'deposit_{user_id}_{currency}_{timestamp}', {'user_id': str(user_id)})
+            for currency in to_create
+        ]
         
-        conn.commit()
+        rows = []
+        for currency, result in create_invoices(orders, api_key):
+            if isinstance(result, Exception):
+                found[currency] = {'error': str(result)}
+            else:
+                rows.append((user_id, currency, result.get('address'), result.get('tag'), result.get('uuid'), 'active'))
         
-        return {
-            'address': address,
-            'tag': tag,
-            'currency': currency,
-            'invoice_id': invoice_id,
-            'created_at': datetime.utcnow().isoformat()
-        }
+        if rows:
+            created = execute_values(cur, """
+                INSERT INTO crypto_deposit_addresses (
+                    user_id, currency, address, tag, invoice_id, status
+                ) VALUES %s
+                RETURNING currency, address, tag, invoice_id, created_at, NULL AS expires_in
+            """, rows, fetch=True)
+            collect_addresses(created, found, lifetimes)
     
-    raise Exception('Failed to create CryptoCloud invoice')
+    conn.commit()
+    cache_put(user_id, found, lifetimes)
+    addresses.update(found)
+    return {currency: addresses[currency] for currency in currencies if currency in addresses}
+
+def get_or_create_deposit_address(user_id: int, currency: str, conn, api_key: str) -> dict:
+    """Получить существующий или создать новый адрес для депозита"""
+    address = get_deposit_addresses(user_id, [currency], conn, api_key)[currency]
+    if 'error' in address:
+        raise Exception(address['error'])
+    return address
 
 def handler(event: dict, context) -> dict:
     """API для работы с криптовалютными депозитами через CryptoCloud"""
@@ -113,8 +192,6 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
         
-        db_url = os.environ.get('DATABASE_URL')
-        schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
         api_key = os.environ.get('CRYPTOCLOUD_API_KEY')
         
         if not api_key:
@@ -125,7 +202,7 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
         
-        conn = psycopg2.connect(db_url, options=f'-c search_path={schema}')
+        conn = get_connection()
         conn.autocommit = False
         
         try:
@@ -147,15 +224,7 @@ def handler(event: dict, context) -> dict:
                 action = data.get('action')
                 
                 if action == 'get_all_addresses':
-                    supported_currencies = ['BTC', 'ETH', 'USDT', 'LTC', 'BCH']
-                    addresses = {}
-                    
-                    for currency in supported_currencies:
-                        try:
-                            addr_info = get_or_create_deposit_address(user_id, currency, conn, api_key)
-                            addresses[currency] = addr_info
-                        except Exception as e:
-                            addresses[currency] = {'error': str(e)}
+                    addresses = get_deposit_addresses(user_id, SUPPORTED_CURRENCIES, conn, api_key)
                     
                     return {
                         'statusCode': 200,
@@ -184,7 +253,7 @@ def handler(event: dict, context) -> dict:
             conn.rollback()
             raise e
         finally:
-            conn.close()
+            release_connection(conn)
     
     except Exception as e:
         return {
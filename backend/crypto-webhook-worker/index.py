@@ -0,0 +1,332 @@
+'''Обработка уведомлений CryptoCloud из crypto_webhook_inbox пачками'''
+import json
+import os
+import select
+import time
+from datetime import datetime
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from worker_auth import is_worker_request
+
+BATCH_SIZE = int(os.environ.get('WEBHOOK_WORKER_BATCH_SIZE', '50'))
+MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_WORKER_MAX_ATTEMPTS', '8'))
+BACKOFF_SECONDS = int(os.environ.get('WEBHOOK_WORKER_BACKOFF_SECONDS', '15'))
+MAX_BACKOFF_SECONDS = int(os.environ.get('WEBHOOK_WORKER_MAX_BACKOFF_SECONDS', '3600'))
+LEASE_SECONDS = int(os.environ.get('WEBHOOK_WORKER_LEASE_SECONDS', '120'))
+RUN_SECONDS = float(os.environ.get('WEBHOOK_WORKER_RUN_SECONDS', '50'))
+MAX_REPLAY_ROWS = int(os.environ.get('WEBHOOK_WORKER_MAX_REPLAY_ROWS', '10000'))
+
+NOTIFY_CHANNEL = 'crypto_webhook_inbox'
+
+# Зачисление депозита одним запросом. Транзакция вставляется по invoice_id,
+# а повтор уже завершённого инвойса не возвращает строк - проводка не создаётся.
+# Параллельный дубль ждёт на уникальном индексе invoice_id и после коммита
+# первого видит status = 'completed', поэтому зачисление происходит ровно один раз.
+# Баланс в wallet_balances обновляет триггер на ledger_entries.
+CREDIT_DEPOSIT_SQL = """
+    WITH tx AS (
+        INSERT INTO crypto_transactions (
+            user_id, invoice_id, currency, amount_crypto,
+            type, status, processed_at
+        ) VALUES (%(user_id)s, %(invoice_id)s, %(currency)s, %(amount)s, 'deposit', 'completed', %(now)s)
+        ON CONFLICT (invoice_id) DO UPDATE
+        SET status = 'completed',
+            currency = EXCLUDED.currency,
+            amount_crypto = EXCLUDED.amount_crypto,
+            processed_at = EXCLUDED.processed_at
+        WHERE crypto_transactions.status <> 'completed'
+        RETURNING id, user_id, invoice_id, currency, amount_crypto
+    ), posting AS (
+        INSERT INTO ledger_entries (posting_id, account, user_id, currency, amount, entry_type, reference)
+        SELECT 'deposit:' || tx.invoice_id, leg.account, tx.user_id, tx.currency,
+               leg.sign * tx.amount_crypto, 'deposit', tx.invoice_id
+        FROM tx
+        CROSS JOIN (VALUES ('wallet', 1), ('cryptocloud', -1)) AS leg(account, sign)
+        ON CONFLICT (posting_id, account, user_id, currency) DO NOTHING
+    )
+    SELECT id FROM tx
+"""
+
+def process_payment(invoice_id: str, amount_crypto: float, currency: str, status: str, cur):
+    """
+    Обработка входящего платежа; повторные уведомления по тому же инвойсу безопасны.
+    Транзакцией управляет вызывающий код: результат фиксируется вместе с отметкой в инбоксе.
+    """
+    cur.execute("""
+        SELECT user_id, address
+        FROM crypto_deposit_addresses
+        WHERE invoice_id = %s AND user_id IS NOT NULL
+        LIMIT 1
+    """, (invoice_id,))
+    
+    deposit_info = cur.fetchone()
+    
+    if not deposit_info:
+        raise Exception(f'Invoice {invoice_id} not found')
+    
+    user_id = deposit_info['user_id']
+    
+    if status == 'success':
+        cur.execute(CREDIT_DEPOSIT_SQL, {
+            'user_id': user_id,
+            'invoice_id': invoice_id,
+            'currency': currency,
+            'amount': amount_crypto,
+            'now': datetime.utcnow()
+        })
+        
+        credited = cur.fetchone()
+        
+        if not credited:
+            # Инвойс уже зачислен ранее - повтор уведомления или replay
+            cur.execute("""
+                SELECT id FROM crypto_transactions WHERE invoice_id = %s
+            """, (invoice_id,))
+            existing = cur.fetchone()
+            
+            return {
+                'success': True,
+                'duplicate': True,
+                'transaction_id': existing['id'] if existing else None,
+                'user_id': user_id,
+                'amount': amount_crypto,
+                'currency': currency
+            }
+        
+        return {
+            'success': True,
+            'transaction_id': credited['id'],
+            'user_id': user_id,
+            'amount': amount_crypto,
+            'currency': currency
+        }
+    
+    elif status == 'pending':
+        # Запоздавший pending не должен откатывать уже завершённую транзакцию
+        cur.execute("""
+            INSERT INTO crypto_transactions (
+                user_id, invoice_id, currency, amount_crypto,
+                type, status
+            ) VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (invoice_id) DO NOTHING
+        """, (user_id, invoice_id, currency, amount_crypto, 'deposit', 'pending'))
+        
+        return {
+            'success': True,
+            'status': 'pending',
+            'message': 'Transaction is pending confirmation'
+        }
+    
+    else:
+        return {
+            'success': False,
+            'status': status,
+            'message': f'Unknown status: {status}'
+        }
+
+def claim_batch(conn) -> list:
+    """
+    Взять пачку уведомлений в аренду на LEASE_SECONDS.
+    Уведомления, взятые упавшим обработчиком, снова становятся доступны после окончания аренды.
+    """
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        UPDATE crypto_webhook_inbox
+        SET status = 'processing',
+            next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+        WHERE id IN (
+            SELECT id FROM crypto_webhook_inbox
+            WHERE status IN ('pending', 'processing') AND next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY next_attempt_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, payload, attempts
+    """, (LEASE_SECONDS, BATCH_SIZE))
+    rows = cur.fetchall()
+    conn.commit()
+    cur.close()
+    return rows
+
+def process_row(conn, row: dict) -> bool:
+    """
+    Зачисление и отметка processed в одной транзакции: после сбоя между ними
+    уведомление не потеряется и не зачислится дважды.
+    При ошибке - повтор с экспоненциальной задержкой, после MAX_ATTEMPTS статус dead.
+    """
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        payload = json.loads(row['payload'])
+        result = process_payment(
+            payload.get('uuid'),
+            float(payload.get('amount_crypto', 0)),
+            payload.get('currency', ''),
+            payload.get('status', ''),
+            cur
+        )
+        cur.execute("""
+            UPDATE crypto_webhook_inbox
+            SET status = 'processed', processed_at = CURRENT_TIMESTAMP, attempts = attempts + 1,
+                last_error = %s
+            WHERE id = %s
+        """, (None if result.get('success') else result.get('message'), row['id']))
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        print(f"Error processing webhook inbox row {row['id']}: {e}")
+        delay = min(BACKOFF_SECONDS * (2 ** row['attempts']), MAX_BACKOFF_SECONDS)
+        cur.execute("""
+            UPDATE crypto_webhook_inbox
+            SET status = CASE WHEN attempts + 1 >= %s THEN 'dead' ELSE 'pending' END,
+                attempts = attempts + 1,
+                next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second',
+                last_error = %s
+            WHERE id = %s
+        """, (MAX_ATTEMPTS, delay, str(e)[:1000], row['id']))
+        conn.commit()
+        return False
+    finally:
+        cur.close()
+
+def drain(conn, deadline: float) -> dict:
+    """Обрабатывать пачки, пока инбокс не опустеет; затем ждать NOTIFY от crypto-webhook до deadline"""
+    totals = {'processed': 0, 'failed': 0}
+    cur = conn.cursor()
+    cur.execute(f'LISTEN {NOTIFY_CHANNEL}')
+    conn.commit()
+    try:
+        while True:
+            rows = claim_batch(conn)
+            if rows:
+                for row in rows:
+                    if process_row(conn, row):
+                        totals['processed'] += 1
+                    else:
+                        totals['failed'] += 1
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if select.select([conn], [], [], remaining) != ([], [], []):
+                conn.poll()
+                conn.notifies.clear()
+    finally:
+        cur.execute(f'UNLISTEN {NOTIFY_CHANNEL}')
+        conn.commit()
+        cur.close()
+    return totals
+
+def replay(conn, received_from: datetime, received_to: datetime, include_processed: bool) -> int:
+    """
+    Вернуть в очередь уведомления, полученные в [received_from, received_to).
+    По умолчанию только dead; с include_processed - и уже обработанные:
+    зачисление идемпотентно по invoice_id, поэтому повтор не удвоит баланс.
+    """
+    statuses = ['dead', 'processed'] if include_processed else ['dead']
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE crypto_webhook_inbox
+        SET status = 'pending', attempts = 0, next_attempt_at = CURRENT_TIMESTAMP, last_error = NULL
+        WHERE id IN (
+            SELECT id FROM crypto_webhook_inbox
+            WHERE received_at >= %s AND received_at < %s AND status = ANY(%s)
+            ORDER BY received_at
+            LIMIT %s
+        )
+    """, (received_from, received_to, statuses, MAX_REPLAY_ROWS))
+    count = cur.rowcount
+    if count:
+        cur.execute('SELECT pg_notify(%s, %s)', (NOTIFY_CHANNEL, 'replay'))
+    conn.commit()
+    cur.close()
+    return count
+
+def handler(event: dict, context) -> dict:
+    '''
+    Вызывается по расписанию (раз в минуту) или вручную POST-запросом с заголовком X-Worker-Secret.
+    {} или {"action": "drain"} - обрабатывать инбокс до RUN_SECONDS, просыпаясь по NOTIFY;
+    {"action": "replay", "from": ISO, "to": ISO, "includeProcessed": false} - повторная обработка
+    уведомлений за интервал (dead, а с includeProcessed - и обработанных).
+    '''
+    method = event.get('httpMethod', 'POST')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Worker-Secret',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    if not is_worker_request(event.get('headers')):
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        body = json.loads(event.get('body') or '{}')
+        if not isinstance(body, dict):
+            raise ValueError('Body must be a JSON object')
+        action = body.get('action', 'drain')
+        if action == 'replay':
+            try:
+                received_from = datetime.fromisoformat(body['from'])
+                received_to = datetime.fromisoformat(body['to'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError('from and to must be ISO timestamps')
+        elif action == 'drain':
+            try:
+                run_seconds = min(float(body.get('runSeconds', RUN_SECONDS)), RUN_SECONDS)
+            except (TypeError, ValueError):
+                raise ValueError('runSeconds must be a number')
+        else:
+            raise ValueError('Unknown action')
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid JSON' if isinstance(e, json.JSONDecodeError) else str(e)}),
+            'isBase64Encoded': False
+        }
+
+    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], options=f'-c search_path={schema}')
+    try:
+        if action == 'replay':
+            result = {'requeued': replay(conn, received_from, received_to, bool(body.get('includeProcessed')))}
+        else:
+            result = drain(conn, time.monotonic() + run_seconds)
+    except Exception as e:
+        print(f"Error running webhook worker {action}: {e}")
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    finally:
+        conn.close()
+
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(result),
+        'isBase64Encoded': False
+    }
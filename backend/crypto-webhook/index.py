@@ -2,9 +2,7 @@ import json
 import os
 import hashlib
 import hmac
-from datetime import datetime
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from db_pool import get_connection, release_connection
 
 def verify_webhook_signature(payload: str, signature: str, secret: str) -> bool:
     """Проверка подписи вебхука от CryptoCloud"""
@@ -15,91 +13,27 @@ def verify_webhook_signature(payload: str, signature: str, secret: str) -> bool:
     ).hexdigest()
     return hmac.compare_digest(signature, expected_signature)
 
-def process_payment(invoice_id: str, amount_crypto: float, currency: str, status: str, conn):
-    """Обработка входящего платежа"""
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
+NOTIFY_CHANNEL = 'crypto_webhook_inbox'
+
+def enqueue_webhook(body: str, invoice_id: str, conn) -> int:
+    """
+    Сохранить сырое уведомление в инбокс и разбудить crypto-webhook-worker.
+    Повторная доставка того же тела не создаёт новую строку; возвращает id строки инбокса.
+    """
+    payload_hash = hashlib.sha256(body.encode()).hexdigest()
+    cur = conn.cursor()
+    # DO UPDATE, а не DO NOTHING: RETURNING отдаёт id и тогда, когда такую же доставку
+    # только что закоммитила параллельная транзакция (DO NOTHING её строку не вернул бы)
     cur.execute("""
-        SELECT user_id, address
-        FROM crypto_deposit_addresses
-        WHERE invoice_id = %s
-        LIMIT 1
-    """, (invoice_id,))
-    
-    deposit_info = cur.fetchone()
-    
-    if not deposit_info:
-        raise Exception(f'Invoice {invoice_id} not found')
-    
-    user_id = deposit_info['user_id']
-    
-    if status == 'success':
-        cur.execute("""
-            INSERT INTO crypto_transactions (
-                user_id, invoice_id, currency, amount_crypto, 
-                type, status, processed_at
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (
-            user_id, invoice_id, currency, amount_crypto,
-            'deposit', 'completed', datetime.utcnow()
-        ))
-        
-        transaction_id = cur.fetchone()['id']
-        
-        cur.execute("""
-            SELECT amount FROM wallet_balances
-            WHERE user_id = %s AND currency = %s
-        """, (user_id, currency))
-        
-        balance = cur.fetchone()
-        
-        if balance:
-            cur.execute("""
-                UPDATE wallet_balances
-                SET amount = amount + %s, updated_at = %s
-                WHERE user_id = %s AND currency = %s
-            """, (amount_crypto, datetime.utcnow(), user_id, currency))
-        else:
-            cur.execute("""
-                INSERT INTO wallet_balances (user_id, currency, amount, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (user_id, currency, amount_crypto, datetime.utcnow(), datetime.utcnow()))
-        
-        conn.commit()
-        
-        return {
-            'success': True,
-            'transaction_id': transaction_id,
-            'user_id': user_id,
-            'amount': amount_crypto,
-            'currency': currency
-        }
-    
-    elif status == 'pending':
-        cur.execute("""
-            INSERT INTO crypto_transactions (
-                user_id, invoice_id, currency, amount_crypto,
-                type, status
-            ) VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (invoice_id) DO UPDATE
-            SET status = 'pending'
-        """, (user_id, invoice_id, currency, amount_crypto, 'deposit', 'pending'))
-        
-        conn.commit()
-        
-        return {
-            'success': True,
-            'status': 'pending',
-            'message': 'Transaction is pending confirmation'
-        }
-    
-    else:
-        return {
-            'success': False,
-            'status': status,
-            'message': f'Unknown status: {status}'
-        }
+        INSERT INTO crypto_webhook_inbox (payload_hash, invoice_id, payload)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (payload_hash) DO UPDATE SET payload_hash = EXCLUDED.payload_hash
+        RETURNING id
+    """, (payload_hash, invoice_id, body))
+    inbox_id = cur.fetchone()[0]
+    cur.execute('SELECT pg_notify(%s, %s)', (NOTIFY_CHANNEL, str(inbox_id)))
+    conn.commit()
+    return inbox_id
 
 def handler(event: dict, context) -> dict:
     """Вебхук для обработки уведомлений от CryptoCloud о входящих платежах"""
@@ -164,27 +98,21 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
         
-        db_url = os.environ.get('DATABASE_URL')
-        schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-        
-        conn = psycopg2.connect(db_url, options=f'-c search_path={schema}')
-        conn.autocommit = False
+        # Быстрый путь: только запись в инбокс, зачисление делает crypto-webhook-worker.
+        # CryptoCloud получает ответ за миллисекунды и не повторяет вызов из-за медленной БД
+        conn = get_connection()
         
         try:
-            result = process_payment(invoice_id, amount_crypto, currency, status, conn)
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json'},
-                'body': json.dumps(result),
-                'isBase64Encoded': False
-            }
-        
-        except Exception as e:
-            conn.rollback()
-            raise e
+            inbox_id = enqueue_webhook(body, invoice_id, conn)
         finally:
-            conn.close()
+            release_connection(conn)
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'success': True, 'queued': True, 'inbox_id': inbox_id}),
+            'isBase64Encoded': False
+        }
     
     except Exception as e:
         return {
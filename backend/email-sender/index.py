@@ -0,0 +1,275 @@
+'''Отправка писем из очереди email_outbox пачками через одну SMTP-сессию'''
+import json
+import os
+import select
+import smtplib
+import time
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+import psycopg2
+from worker_auth import is_worker_request
+
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+BATCH_SIZE = int(os.environ.get('EMAIL_SENDER_BATCH_SIZE', '50'))
+MAX_ATTEMPTS = int(os.environ.get('EMAIL_SENDER_MAX_ATTEMPTS', '6'))
+BACKOFF_SECONDS = int(os.environ.get('EMAIL_SENDER_BACKOFF_SECONDS', '30'))
+MAX_BACKOFF_SECONDS = int(os.environ.get('EMAIL_SENDER_MAX_BACKOFF_SECONDS', '3600'))
+LEASE_SECONDS = int(os.environ.get('EMAIL_SENDER_LEASE_SECONDS', '120'))
+RUN_SECONDS = float(os.environ.get('EMAIL_SENDER_RUN_SECONDS', '50'))
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', '10'))
+RETENTION_DAYS = int(os.environ.get('EMAIL_OUTBOX_RETENTION_DAYS', '7'))
+PURGE_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_PURGE_BATCH_SIZE', '5000'))
+
+NOTIFY_CHANNEL = 'email_outbox'
+
+# SMTP-сессия живёт в тёплом контейнере между вызовами
+_smtp = None
+
+def smtp_settings() -> dict:
+    port = int(os.environ.get('SMTP_PORT', '587'))
+    return {
+        'host': os.environ.get('SMTP_HOST', 'smtp.gmail.com'),
+        'port': port,
+        'user': os.environ.get('SMTP_USER', ''),
+        'password': os.environ.get('SMTP_PASSWORD', ''),
+        'from': os.environ.get('SMTP_FROM') or os.environ.get('SMTP_USER', ''),
+        'ssl': port == 465,
+        'starttls': os.environ.get('SMTP_STARTTLS', 'true').lower() == 'true'
+    }
+
+def get_smtp(settings: dict):
+    """
+    Открытая SMTP-сессия: переиспользуется, пока сервер отвечает на NOOP.
+    Без TLS и без AUTH, если сервер их не объявляет (локальный aiosmtpd в тестах).
+    """
+    global _smtp
+    if _smtp is not None:
+        try:
+            if _smtp.noop()[0] == 250:
+                return _smtp
+        except (smtplib.SMTPException, OSError):
+            pass
+        close_smtp()
+
+    if settings['ssl']:
+        server = smtplib.SMTP_SSL(settings['host'], settings['port'], timeout=SMTP_TIMEOUT)
+    else:
+        server = smtplib.SMTP(settings['host'], settings['port'], timeout=SMTP_TIMEOUT)
+        server.ehlo()
+        if settings['starttls'] and server.has_extn('starttls'):
+            server.starttls()
+            server.ehlo()
+    if settings['user'] and settings['password'] and server.has_extn('auth'):
+        server.login(settings['user'], settings['password'])
+    _smtp = server
+    return _smtp
+
+def close_smtp() -> None:
+    global _smtp
+    if _smtp is not None:
+        try:
+            _smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+    _smtp = None
+
+def build_message(sender: str, row: dict) -> MIMEMultipart:
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = row['subject']
+    msg['From'] = sender
+    msg['To'] = row['to_email']
+    msg.attach(MIMEText(row['text_body'], 'plain', 'utf-8'))
+    msg.attach(MIMEText(row['html_body'], 'html', 'utf-8'))
+    return msg
+
+def claim_batch(cur) -> list:
+    """
+    Взять пачку писем в аренду на LEASE_SECONDS.
+    Письма, взятые упавшим отправителем, снова становятся доступны после окончания аренды.
+    """
+    cur.execute(f'''
+        UPDATE {SCHEMA}.email_outbox
+        SET status = 'sending',
+            next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+        WHERE id IN (
+            SELECT id FROM {SCHEMA}.email_outbox
+            WHERE status IN ('pending', 'sending') AND next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY next_attempt_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, to_email, subject, html_body, text_body, attempts
+    ''', (LEASE_SECONDS, BATCH_SIZE))
+    columns = [c[0] for c in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+def mark_sent(cur, ids: list) -> None:
+    if ids:
+        cur.execute(f'''
+            UPDATE {SCHEMA}.email_outbox
+            SET status = 'sent', sent_at = CURRENT_TIMESTAMP, attempts = attempts + 1, last_error = NULL,
+                html_body = NULL, text_body = NULL
+            WHERE id = ANY(%s)
+        ''', (ids,))
+
+def mark_failed(cur, failures: list) -> None:
+    """
+    Повтор с экспоненциальной задержкой; после MAX_ATTEMPTS письмо получает статус failed,
+    тело с кодом при этом очищается, как и у отправленных
+    """
+    for row_id, attempts, error, permanent in failures:
+        delay = min(BACKOFF_SECONDS * (2 ** attempts), MAX_BACKOFF_SECONDS)
+        give_up = permanent or attempts + 1 >= MAX_ATTEMPTS
+        cur.execute(f'''
+            UPDATE {SCHEMA}.email_outbox
+            SET status = CASE WHEN %s THEN 'failed' ELSE 'pending' END,
+                attempts = attempts + 1,
+                next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second',
+                last_error = %s,
+                html_body = CASE WHEN %s THEN NULL ELSE html_body END,
+                text_body = CASE WHEN %s THEN NULL ELSE text_body END
+            WHERE id = %s
+        ''', (give_up, delay, error[:1000], give_up, give_up, row_id))
+
+def purge_finished(cur) -> int:
+    """Удалить отправленные и окончательно не отправленные письма старше RETENTION_DAYS"""
+    cur.execute(f'''
+        DELETE FROM {SCHEMA}.email_outbox
+        WHERE id IN (
+            SELECT id FROM {SCHEMA}.email_outbox
+            WHERE status IN ('sent', 'failed') AND created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+            LIMIT %s
+        )
+    ''', (RETENTION_DAYS, PURGE_BATCH_SIZE))
+    return cur.rowcount
+
+def send_batch(cur, settings: dict, rows: list) -> tuple:
+    sent, failures = [], []
+    for row in rows:
+        try:
+            server = get_smtp(settings)
+            server.sendmail(settings['from'], [row['to_email']], build_message(settings['from'], row).as_string())
+            sent.append(row['id'])
+        except smtplib.SMTPRecipientsRefused as e:
+            # Адрес отвергнут - повтор не поможет
+            failures.append((row['id'], row['attempts'], str(e), True))
+        except (smtplib.SMTPException, OSError) as e:
+            close_smtp()
+            failures.append((row['id'], row['attempts'], str(e), False))
+    mark_sent(cur, sent)
+    mark_failed(cur, failures)
+    return len(sent), len(failures)
+
+def drain(conn, settings: dict, deadline: float) -> dict:
+    """
+    Отправлять пачки, пока очередь не опустеет; затем ждать NOTIFY от новых писем до deadline.
+    Соединение в autocommit: каждое UPDATE - отдельная короткая транзакция.
+    Перед этим удаляется одна пачка писем старше срока хранения.
+    """
+    totals = {'sent': 0, 'failed': 0}
+    cur = conn.cursor()
+    totals['purged'] = purge_finished(cur)
+    cur.execute(f'LISTEN {NOTIFY_CHANNEL}')
+    try:
+        while True:
+            rows = claim_batch(cur)
+            if rows:
+                sent, failed = send_batch(cur, settings, rows)
+                totals['sent'] += sent
+                totals['failed'] += failed
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if select.select([conn], [], [], remaining) != ([], [], []):
+                conn.poll()
+                conn.notifies.clear()
+    finally:
+        cur.execute(f'UNLISTEN {NOTIFY_CHANNEL}')
+        cur.close()
+    return totals
+
+def handler(event: dict, context) -> dict:
+    '''
+    Вызывается по расписанию (раз в минуту) или вручную POST-запросом с заголовком X-Worker-Secret.
+    Работает до RUN_SECONDS, просыпаясь по NOTIFY, поэтому письмо уходит через
+    доли секунды после постановки в очередь, а API не ждёт SMTP.
+    '''
+    method = event.get('httpMethod', 'POST')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Worker-Secret',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    if not is_worker_request(event.get('headers')):
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        body = json.loads(event.get('body') or '{}')
+        if not isinstance(body, dict):
+            raise ValueError('Body must be a JSON object')
+        try:
+            run_seconds = min(float(body.get('runSeconds', RUN_SECONDS)), RUN_SECONDS)
+        except (TypeError, ValueError):
+            raise ValueError('runSeconds must be a number')
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid JSON' if isinstance(e, json.JSONDecodeError) else str(e)}),
+            'isBase64Encoded': False
+        }
+
+    settings = smtp_settings()
+    if not settings['from']:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'SMTP не настроен: добавьте SMTP_USER (или SMTP_FROM) в секреты проекта'}),
+            'isBase64Encoded': False
+        }
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], options=f'-c search_path={SCHEMA}')
+    conn.autocommit = True
+    try:
+        totals = drain(conn, settings, time.monotonic() + run_seconds)
+    except Exception as e:
+        print(f"Error draining email outbox: {e}")
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    finally:
+        conn.close()
+
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(totals),
+        'isBase64Encoded': False
+    }
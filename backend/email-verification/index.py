@@ -3,16 +3,18 @@ import json
 import os
 import psycopg2
 import random
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
 import hashlib
+import time
+from email_templates import render, resolve_locale
 
 DATABASE_URL = os.environ['DATABASE_URL']
 SCHEMA = os.environ['MAIN_DB_SCHEMA']
 SMTP_USER = os.environ.get('SMTP_USER', '')
 SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')
+# Повторные запросы кода на один адрес в пределах окна дают одно письмо;
+# прежний код при этом остаётся действительным
+EMAIL_DEDUPE_SECONDS = int(os.environ.get('EMAIL_DEDUPE_SECONDS', '60'))
 
 def handler(event: dict, context) -> dict:
     method = event.get('httpMethod', 'GET')
@@ -41,7 +43,7 @@ def handler(event: dict, context) -> dict:
         action = body.get('action')
         
         if action == 'send_code':
-            return send_verification_code(body)
+            return send_verification_code(body, event.get('headers') or {})
         elif action == 'verify_code':
             return verify_code(body)
         else:
@@ -57,7 +59,7 @@ def handler(event: dict, context) -> dict:
             'body': json.dumps({'error': str(e)})
         }
 
-def send_verification_code(body: dict) -> dict:
+def send_verification_code(body: dict, headers: dict) -> dict:
     email = body.get('email', '').strip().lower()
     
     if not email:
@@ -91,42 +93,25 @@ def send_verification_code(body: dict) -> dict:
             INSERT INTO {SCHEMA}.email_verification_tokens (user_id, token_hash, expires_at, created_at)
             VALUES (NULL, %s, %s, CURRENT_TIMESTAMP)
         ''', (code_hash, datetime.utcnow() + timedelta(minutes=10)))
-        conn.commit()
-        
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = 'Код подтверждения email'
-        msg['From'] = SMTP_USER
-        msg['To'] = email
-        
-        html = f'''
-        <html>
-          <body style="font-family: Arial, sans-serif; padding: 20px; background-color: #f5f5f5;">
-            <div style="max-width: 600px; margin: 0 auto; background-color: white; padding: 30px; border-radius: 10px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);">
-              <h2 style="color: #333; margin-bottom: 20px;">Подтверждение email</h2>
-              <p style="color: #666; font-size: 16px; line-height: 1.5;">
-                Ваш код подтверждения:
-              </p>
-              <div style="background-color: #f0f0f0; padding: 20px; border-radius: 5px; text-align: center; margin: 20px 0;">
-                <span style="font-size: 32px; font-weight: bold; color: #333; letter-spacing: 5px;">{code}</span>
-              </div>
-              <p style="color: #999; font-size: 14px;">
-                Код действителен 10 минут
-              </p>
-            </div>
-          </body>
-        </html>
-        '''
         
-        text = f'Ваш код подтверждения: {code}\nКод действителен 10 минут'
+        locale = resolve_locale(body.get('locale'), headers.get('Accept-Language') or headers.get('accept-language'))
+        subject, html, text = render('verification', code, 10, locale)
         
-        part1 = MIMEText(text, 'plain')
-        part2 = MIMEText(html, 'html')
-        msg.attach(part1)
-        msg.attach(part2)
+        dedupe_key = hashlib.sha256(
+            f'verify-code:{email.lower()}:{int(time.time() // EMAIL_DEDUPE_SECONDS)}'.encode('utf-8')
+        ).hexdigest()
         
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-            server.login(SMTP_USER, SMTP_PASSWORD)
-            server.send_message(msg)
+        # Письмо уходит через очередь email_outbox (функция email-sender), запрос не ждёт SMTP
+        cur.execute(f'''
+            WITH queued AS (
+                INSERT INTO {SCHEMA}.email_outbox (dedupe_key, to_email, subject, html_body, text_body)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (dedupe_key) DO NOTHING
+                RETURNING id
+            )
+            SELECT pg_notify('email_outbox', '') FROM queued
+        ''', (dedupe_key, email, subject, html, text))
+        conn.commit()
         
         return {
             'statusCode': 200,
@@ -136,12 +121,6 @@ def send_verification_code(body: dict) -> dict:
                 'expires_in': 600
             })
         }
-    except smtplib.SMTPAuthenticationError:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Ошибка авторизации SMTP. Проверьте SMTP_USER и SMTP_PASSWORD в секретах.'})
-        }
     except Exception as e:
         return {
             'statusCode': 500,
@@ -1,55 +1,88 @@
-"""Health check handler - verifies database schema."""
-from utils.db import query_one, get_schema
+"""Health check handler - liveness and database schema readiness."""
+import os
+import threading
+import time
+
+from utils.db import query, get_schema
 from utils.http import response, error
 
 
-REQUIRED_TABLES = ['users', 'refresh_tokens', 'password_reset_tokens', 'email_verification_tokens']
+REQUIRED_TABLES = ['users', 'refresh_tokens', 'password_reset_tokens', 'email_verification_tokens', 'login_attempts', 'email_outbox']
 
 REQUIRED_COLUMNS = {
     'users': ['id', 'email', 'password_hash', 'name', 'email_verified', 'failed_login_attempts', 'last_failed_login_at', 'last_login_at', 'created_at', 'updated_at'],
-    'refresh_tokens': ['id', 'user_id', 'token_hash', 'expires_at', 'created_at'],
+    'refresh_tokens': ['id', 'user_id', 'token_hash', 'expires_at', 'created_at', 'family_id'],
     'password_reset_tokens': ['id', 'user_id', 'token_hash', 'expires_at', 'created_at'],
     'email_verification_tokens': ['id', 'user_id', 'token_hash', 'expires_at', 'created_at'],
+    'login_attempts': ['id', 'email', 'ip_address', 'attempted_at'],
+    'email_outbox': ['id', 'dedupe_key', 'to_email', 'subject', 'html_body', 'text_body', 'status'],
 }
 
+# A passing schema check is reused for this many seconds; failures are never cached
+HEALTH_CACHE_SECONDS = float(os.environ.get('HEALTH_CACHE_SECONDS', '60'))
 
-def handle(event: dict, origin: str = '*') -> dict:
-    """Check database schema has all required tables and columns."""
-    S = get_schema()
+_ready_lock = threading.Lock()
+_ready_until = 0.0
 
-    if not S:
-        return error(500, 'MAIN_DB_SCHEMA not configured', origin)
 
-    schema_name = S.rstrip('.')
-    errors = []
+def _schema_errors(schema_name: str) -> list:
+    """Compare required tables/columns against a single information_schema query."""
+    rows = query("""
+        SELECT table_name, column_name FROM information_schema.columns
+        WHERE table_schema = %s AND table_name::text = ANY(%s)
+    """, (schema_name, REQUIRED_TABLES))
 
-    for table in REQUIRED_TABLES:
-        result = query_one(f"""
-            SELECT 1 FROM information_schema.tables
-            WHERE table_schema = '{schema_name}' AND table_name = '{table}'
-        """)
+    found = {}
+    for table, column in rows:
+        found.setdefault(table, set()).add(column)
 
-        if not result:
+    errors = []
+    for table in REQUIRED_TABLES:
+        if table not in found:
             errors.append(f"Table '{table}' not found in schema '{schema_name}'")
             continue
-
         for column in REQUIRED_COLUMNS[table]:
-            col_result = query_one(f"""
-                SELECT 1 FROM information_schema.columns
-                WHERE table_schema = '{schema_name}'
-                AND table_name = '{table}'
-                AND column_name = '{column}'
-            """)
-
-            if not col_result:
+            if column not in found[table]:
                 errors.append(f"Column '{column}' not found in table '{schema_name}.{table}'")
+    return errors
 
-    if errors:
-        return error(500, f"Schema validation failed: {'; '.join(errors)}", origin)
 
-    return response(200, {
+def handle(event: dict, origin: str = '*') -> dict:
+    """
+    GET ?action=health&mode=live  - process is up, no database access.
+    GET ?action=health[&mode=ready] - schema has all required tables and columns.
+    """
+    global _ready_until
+    params = event.get('queryStringParameters') or {}
+
+    if params.get('mode') == 'live':
+        return response(200, {'status': 'ok', 'mode': 'live'}, origin)
+
+    S = get_schema()
+
+    if not S:
+        return error(500, 'MAIN_DB_SCHEMA not configured', origin)
+
+    schema_name = S.rstrip('.')
+    body = {
         'status': 'ok',
+        'mode': 'ready',
         'schema': schema_name,
         'tables': REQUIRED_TABLES,
         'message': 'All required tables and columns exist'
-    }, origin)
+    }
+
+    with _ready_lock:
+        cached = time.monotonic() < _ready_until
+    if cached:
+        return response(200, {**body, 'cached': True}, origin)
+
+    errors = _schema_errors(schema_name)
+
+    if errors:
+        return error(500, f"Schema validation failed: {'; '.join(errors)}", origin)
+
+    with _ready_lock:
+        _ready_until = time.monotonic() + HEALTH_CACHE_SECONDS
+
+    return response(200, {**body, 'cached': False}, origin)
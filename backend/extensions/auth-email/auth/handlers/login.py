@@ -1,17 +1,112 @@
 """Login handler."""
 import json
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
 
-from utils.db import query_one, execute, escape, get_schema
-from utils.password import verify_password
+from utils.db import statement, get_schema
+from utils.password import verify_password, needs_rehash, hash_password
 from utils.jwt_utils import create_access_token, create_refresh_token, hash_token, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS
 from utils.email import is_email_enabled
-from utils.http import response, error
+from utils.http import response, error, get_client_ip
+from utils.rate_limit import SlidingWindowLimiter, AttemptLog
 
 
 MAX_LOGIN_ATTEMPTS = int(os.environ.get('MAX_LOGIN_ATTEMPTS', '5'))
+MAX_LOGIN_ATTEMPTS_PER_IP = int(os.environ.get('MAX_LOGIN_ATTEMPTS_PER_IP', '50'))
 LOCKOUT_MINUTES = int(os.environ.get('LOCKOUT_MINUTES', '15'))
+PERSIST_LOGIN_ATTEMPTS = os.environ.get('PERSIST_LOGIN_ATTEMPTS', 'true').lower() == 'true'
+
+# Failed attempts are counted in the warm container, so a locked email or IP
+# is rejected before any query or bcrypt call. With PERSIST_LOGIN_ATTEMPTS
+# they are also written to login_attempts in batches, which lets other
+# containers pick up the lockout on their first lookup of the email.
+email_limiter = SlidingWindowLimiter(MAX_LOGIN_ATTEMPTS, LOCKOUT_MINUTES * 60)
+ip_limiter = SlidingWindowLimiter(MAX_LOGIN_ATTEMPTS_PER_IP, LOCKOUT_MINUTES * 60)
+attempt_log = AttemptLog(
+    max_pending=int(os.environ.get('LOGIN_ATTEMPTS_FLUSH_SIZE', '50')),
+    max_age=float(os.environ.get('LOGIN_ATTEMPTS_FLUSH_SECONDS', '5'))
+)
+
+S = get_schema()
+LOCKOUT_WINDOW = f"NOW() AT TIME ZONE 'UTC' - INTERVAL '{LOCKOUT_MINUTES} minutes'"
+
+RECENT_FAILURES_SQL = "0, NULL"
+CLEAR_ATTEMPTS_SQL = ""
+if PERSIST_LOGIN_ATTEMPTS:
+    RECENT_FAILURES_SQL = f"""
+        (SELECT COUNT(*) FROM {S}login_attempts a
+         WHERE a.email = u.email AND a.attempted_at > {LOCKOUT_WINDOW}),
+        (SELECT EXTRACT(EPOCH FROM MAX(a.attempted_at)) FROM {S}login_attempts a
+         WHERE a.email = u.email)
+    """
+    CLEAR_ATTEMPTS_SQL = f"cleared AS (DELETE FROM {S}login_attempts WHERE email = $7),"
+
+# Credentials and failures recorded by other containers in one round-trip
+USER_LOOKUP = statement('login_user_lookup', f"""
+    SELECT u.id, u.email, u.name, u.password_hash, u.email_verified, {RECENT_FAILURES_SQL}
+    FROM {S}users u WHERE u.email = $1
+""")
+
+# Counter reset, optional rehash ($3) and refresh token insert in a single round-trip
+LOGIN_SUCCESS = statement('login_success', f"""
+    WITH {CLEAR_ATTEMPTS_SQL}
+    reset AS (
+        UPDATE {S}users
+        SET failed_login_attempts = 0,
+            last_failed_login_at = NULL,
+            last_login_at = $2,
+            password_hash = COALESCE($3, password_hash)
+        WHERE id = $1
+    )
+    INSERT INTO {S}refresh_tokens (user_id, token_hash, expires_at, created_at, family_id)
+    VALUES ($1, $4, $5, $2, $6)
+""")
+
+# Buffered failures go out as arrays in one INSERT; rows that left the window are dropped
+FLUSH_ATTEMPTS = statement('login_flush_attempts', f"""
+    WITH pruned AS (
+        DELETE FROM {S}login_attempts WHERE attempted_at < {LOCKOUT_WINDOW}
+    )
+    INSERT INTO {S}login_attempts (email, ip_address, attempted_at)
+    SELECT * FROM unnest($1::varchar[], $2::varchar[], $3::timestamp[])
+""")
+
+
+def _lockout_error(retry_after: float, origin: str) -> dict:
+    return error(429, f'Слишком много попыток. Повторите через {int(retry_after) // 60 + 1} мин.', origin)
+
+
+def _flush_attempts() -> None:
+    """Write buffered failures in one statement."""
+    rows = attempt_log.drain()
+    if not rows:
+        return
+    emails, ips, attempted = zip(*rows)
+    try:
+        FLUSH_ATTEMPTS.execute(list(emails), [ip or None for ip in ips], list(attempted))
+    except Exception:
+        attempt_log.restore(rows)
+        raise
+
+
+def _record_failure(email: str, ip: str) -> None:
+    email_limiter.hit(email)
+    if ip:
+        ip_limiter.hit(ip)
+    if PERSIST_LOGIN_ATTEMPTS:
+        attempt_log.add(email, ip, datetime.utcnow())
+        # The failure that locks a key is written immediately: later attempts are
+        # rejected before reaching here, and other containers must see the lockout.
+        locked = email_limiter.retry_after(email) or (ip and ip_limiter.retry_after(ip))
+        if locked or attempt_log.due():
+            _flush_attempts()
+
+
+def _reject_locked(retry_after: float, origin: str) -> dict:
+    """Lockout response; anything still buffered is written first."""
+    if PERSIST_LOGIN_ATTEMPTS and len(attempt_log):
+        _flush_attempts()
+    return _lockout_error(retry_after, origin)
 
 
 def handle(event: dict, origin: str = '*') -> dict:
@@ -29,41 +124,29 @@ def handle(event: dict, origin: str = '*') -> dict:
     if not email or not password:
         return error(400, 'Email и пароль обязательны', origin)
 
-    S = get_schema()
+    client_ip = get_client_ip(event)
+    retry_after = max(email_limiter.retry_after(email), ip_limiter.retry_after(client_ip) if client_ip else 0)
+    if retry_after:
+        return _reject_locked(retry_after, origin)
 
-    rate_check = query_one(f"""
-        SELECT failed_login_attempts, last_failed_login_at
-        FROM {S}users WHERE email = {escape(email)}
-    """)
-
-    if rate_check:
-        attempts, last_failed = rate_check
-        if attempts and attempts >= MAX_LOGIN_ATTEMPTS and last_failed:
-            lockout_until = last_failed + timedelta(minutes=LOCKOUT_MINUTES)
-            if datetime.utcnow() < lockout_until:
-                remaining = int((lockout_until - datetime.utcnow()).total_seconds())
-                return error(429, f'Слишком много попыток. Повторите через {remaining // 60 + 1} мин.', origin)
-
-    user = query_one(f"""
-        SELECT id, email, name, password_hash, email_verified
-        FROM {S}users WHERE email = {escape(email)}
-    """)
+    user = USER_LOOKUP.one(email)
 
     auth_error_msg = 'Неверный email или пароль'
 
     if not user:
+        _record_failure(email, client_ip)
         return error(401, auth_error_msg, origin)
 
-    user_id, user_email, user_name, stored_hash, email_verified = user
+    user_id, user_email, user_name, stored_hash, email_verified, recent_failures, last_failed_at = user
+
+    if recent_failures:
+        email_limiter.seed(email, int(recent_failures), float(last_failed_at))
+        retry_after = email_limiter.retry_after(email)
+        if retry_after:
+            return _reject_locked(retry_after, origin)
 
     if not verify_password(password, stored_hash):
-        now = datetime.utcnow().isoformat()
-        execute(f"""
-            UPDATE {S}users
-            SET failed_login_attempts = COALESCE(failed_login_attempts, 0) + 1,
-                last_failed_login_at = {escape(now)}
-            WHERE email = {escape(email)}
-        """)
+        _record_failure(email, client_ip)
         return error(401, auth_error_msg, origin)
 
     # Check email verification if SMTP is configured
@@ -71,24 +154,21 @@ def handle(event: dict, origin: str = '*') -> dict:
         return error(403, 'Email не подтверждён. Проверьте почту.', origin)
 
     now = datetime.utcnow().isoformat()
-    execute(f"""
-        UPDATE {S}users
-        SET failed_login_attempts = 0,
-            last_failed_login_at = NULL,
-            last_login_at = {escape(now)}
-        WHERE id = {escape(user_id)}
-    """)
-
     access_token = create_access_token(user_id, user_email)
-    refresh_token, refresh_expires = create_refresh_token(user_id)
+    refresh_token, refresh_expires, family_id = create_refresh_token(user_id)
 
     refresh_hash = hash_token(refresh_token)
     expires_at = refresh_expires.isoformat()
 
-    execute(f"""
-        INSERT INTO {S}refresh_tokens (user_id, token_hash, expires_at, created_at)
-        VALUES ({escape(user_id)}, {escape(refresh_hash)}, {escape(expires_at)}, {escape(now)})
-    """)
+    # Upgrade the stored hash while the plaintext is at hand if BCRYPT_ROUNDS changed
+    new_hash = hash_password(password) if needs_rehash(stored_hash) else None
+
+    email_limiter.reset(email)
+    params = [user_id, now, new_hash, refresh_hash, expires_at, family_id]
+    if PERSIST_LOGIN_ATTEMPTS:
+        attempt_log.discard(email)
+        params.append(email)
+    LOGIN_SUCCESS.execute(*params)
 
     return response(200, {
         'access_token': access_token,
@@ -1,20 +1,22 @@
 """Logout handler."""
 import json
 
-from utils.db import execute, escape, get_schema
-from utils.jwt_utils import hash_token
+from utils.jwt_utils import hash_token, decode_refresh_token
+from utils import token_store
 from utils.http import response
 
 
 def handle(event: dict, origin: str = '*') -> dict:
-    """Logout user by revoking refresh token from request body."""
+    """Logout user by revoking refresh token from request body ({"all": true} revokes every session)."""
     body_str = event.get('body', '{}')
     payload = json.loads(body_str)
     refresh_token = payload.get('refresh_token', '')
 
     if refresh_token:
-        token_hash = hash_token(refresh_token)
-        S = get_schema()
-        execute(f"DELETE FROM {S}refresh_tokens WHERE token_hash = {escape(token_hash)}")
+        decoded = decode_refresh_token(refresh_token) if payload.get('all') else None
+        if decoded:
+            token_store.revoke_user(int(decoded['sub']))
+        else:
+            token_store.revoke(hash_token(refresh_token))
 
     return response(200, {'message': 'Logged out successfully'}, origin)
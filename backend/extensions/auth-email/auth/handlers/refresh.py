@@ -1,15 +1,23 @@
 """Token refresh handler."""
 import json
 import os
-from datetime import datetime
 
-from utils.db import query_one, escape, get_schema
-from utils.jwt_utils import create_access_token, decode_refresh_token, hash_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from utils.jwt_utils import (
+    create_access_token, create_refresh_token, decode_refresh_token, hash_token,
+    ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS
+)
 from utils.http import response, error
+from utils import token_store
 
 
 def handle(event: dict, origin: str = '*') -> dict:
-    """Refresh access token using refresh token from request body."""
+    """
+    Rotate refresh token: the presented token is consumed and a new pair issued.
+
+    A correctly signed, unexpired token that is no longer stored has already
+    been used (or was revoked), so it is treated as stolen and every token of
+    its family is revoked.
+    """
     jwt_secret = os.environ.get('JWT_SECRET')
     if not jwt_secret:
         return error(500, 'JWT_SECRET not configured', origin)
@@ -26,30 +34,35 @@ def handle(event: dict, origin: str = '*') -> dict:
         return error(401, 'Invalid or expired refresh token', origin)
 
     user_id = int(decoded.get('sub'))
-    token_hash = hash_token(refresh_token)
-    now = datetime.utcnow().isoformat()
+    family_id = decoded.get('fam')
 
-    S = get_schema()
+    new_refresh_token, refresh_expires, family_id = create_refresh_token(user_id, family_id)
 
-    result = query_one(f"""
-        SELECT rt.id, u.email, u.name
-        FROM {S}refresh_tokens rt
-        JOIN {S}users u ON u.id = rt.user_id
-        WHERE rt.token_hash = {escape(token_hash)}
-          AND rt.user_id = {escape(user_id)}
-          AND rt.expires_at > {escape(now)}
-    """)
+    result = token_store.rotate(
+        user_id,
+        hash_token(refresh_token),
+        hash_token(new_refresh_token),
+        refresh_expires.isoformat(),
+        family_id
+    )
 
     if not result:
+        if decoded.get('fam'):
+            token_store.revoke_family(decoded['fam'])
         return error(401, 'Refresh token revoked or expired', origin)
 
-    _, user_email, user_name = result
+    # Expired tokens are pruned in batches, at most once per interval
+    token_store.prune_if_due()
+
+    user_email, user_name = result
     access_token = create_access_token(user_id, user_email)
 
     return response(200, {
         'access_token': access_token,
+        'refresh_token': new_refresh_token,
         'token_type': 'Bearer',
         'expires_in': ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        'refresh_expires_in': REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60,
         'user': {
             'id': user_id,
             'email': user_email,
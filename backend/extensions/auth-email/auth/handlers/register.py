@@ -2,31 +2,35 @@
 import json
 from datetime import datetime, timedelta
 
-from utils.db import query_one, execute_returning, execute, escape, get_schema
+from utils.db import query_one, execute_returning, execute, get_schema
 from utils.password import hash_password, verify_password, validate_password, validate_email
-from utils.email import is_email_enabled, generate_code, send_verification_code
+from utils.email import is_email_enabled, generate_code, recent_code, send_verification_code
 from utils.http import response, error
+from utils.email_templates import resolve_locale
 
 
 VERIFICATION_CODE_HOURS = 24
 
 
-def _send_verification_code(user_id: int, email: str, S: str) -> dict:
+def _send_verification_code(user_id: int, email: str, S: str, locale: str) -> dict:
     """Generate and send verification code, return result dict."""
-    now = datetime.utcnow().isoformat()
-    code = generate_code()
-    expires_at = (datetime.utcnow() + timedelta(hours=VERIFICATION_CODE_HOURS)).isoformat()
-
-    # Delete old codes
-    execute(f"DELETE FROM {S}email_verification_tokens WHERE user_id = {escape(user_id)}")
-
-    # Store new code
-    execute(f"""
-        INSERT INTO {S}email_verification_tokens (user_id, token_hash, expires_at, created_at)
-        VALUES ({escape(user_id)}, {escape(code)}, {escape(expires_at)}, {escape(now)})
-    """)
-
-    if send_verification_code(email, code):
+    # A double-submitted form reuses the code just sent instead of invalidating it
+    code = recent_code('email_verification_tokens', user_id)
+    if code is None:
+        now = datetime.utcnow().isoformat()
+        code = generate_code()
+        expires_at = (datetime.utcnow() + timedelta(hours=VERIFICATION_CODE_HOURS)).isoformat()
+
+        # Delete old codes
+        execute(f"DELETE FROM {S}email_verification_tokens WHERE user_id = %s", (user_id,))
+
+        # Store new code
+        execute(f"""
+            INSERT INTO {S}email_verification_tokens (user_id, token_hash, expires_at, created_at)
+            VALUES (%s, %s, %s, %s)
+        """, (user_id, code, expires_at, now))
+
+    if send_verification_code(email, code, locale, VERIFICATION_CODE_HOURS * 60):
         return {'message': 'Код подтверждения отправлен на email', 'sent': True}
     return {'message': 'Не удалось отправить код', 'sent': False}
 
@@ -49,9 +53,11 @@ def handle(event: dict, origin: str = '*') -> dict:
 
     S = get_schema()
     email_enabled = is_email_enabled()
+    headers = event.get('headers') or {}
+    locale = resolve_locale(payload.get('locale'), headers.get('Accept-Language') or headers.get('accept-language'))
 
     # Check if user exists
-    existing = query_one(f"SELECT id, email_verified, password_hash FROM {S}users WHERE email = {escape(email)}")
+    existing = query_one(f"SELECT id, email_verified, password_hash FROM {S}users WHERE email = %s", (email,))
 
     if existing:
         user_id, email_verified, stored_hash = existing
@@ -66,7 +72,7 @@ def handle(event: dict, origin: str = '*') -> dict:
 
         # Password correct - resend code
         if email_enabled:
-            send_result = _send_verification_code(user_id, email, S)
+            send_result = _send_verification_code(user_id, email, S, locale)
             return response(200, {
                 'user_id': user_id,
                 'message': send_result['message'],
@@ -76,7 +82,7 @@ def handle(event: dict, origin: str = '*') -> dict:
         else:
             # No SMTP - mark as verified and let them login
             now = datetime.utcnow().isoformat()
-            execute(f"UPDATE {S}users SET email_verified = TRUE, updated_at = {escape(now)} WHERE id = {escape(user_id)}")
+            execute(f"UPDATE {S}users SET email_verified = TRUE, updated_at = %s WHERE id = %s", (now, user_id))
             return response(200, {
                 'user_id': user_id,
                 'message': 'Регистрация успешна',
@@ -89,9 +95,9 @@ def handle(event: dict, origin: str = '*') -> dict:
 
     user_id = execute_returning(f"""
         INSERT INTO {S}users (email, password_hash, name, email_verified, created_at, updated_at)
-        VALUES ({escape(email)}, {escape(password_hash)}, {escape(name or None)}, {escape(not email_enabled)}, {escape(now)}, {escape(now)})
+        VALUES (%s, %s, %s, %s, %s, %s)
         RETURNING id
-    """)
+    """, (email, password_hash, name or None, not email_enabled, now, now))
 
     result = {
         'user_id': user_id,
@@ -101,7 +107,7 @@ def handle(event: dict, origin: str = '*') -> dict:
 
     # Send verification code if SMTP configured
     if email_enabled:
-        send_result = _send_verification_code(user_id, email, S)
+        send_result = _send_verification_code(user_id, email, S, locale)
         result['message'] = send_result['message']
 
     return response(201, result, origin)
@@ -2,10 +2,12 @@
 import json
 from datetime import datetime, timedelta
 
-from utils.db import query_one, execute, escape, get_schema
+from utils.db import query_one, execute, get_schema
 from utils.password import hash_password, validate_password
-from utils.email import is_email_enabled, generate_code, send_password_reset_code
+from utils.email import is_email_enabled, generate_code, recent_code, send_password_reset_code
 from utils.http import response, error
+from utils.email_templates import resolve_locale
+from utils import token_store
 
 
 RESET_CODE_LIFETIME_HOURS = 1
@@ -31,28 +33,34 @@ def handle(event: dict, origin: str = '*') -> dict:
 
     # Step 1: Request reset code
     if email and not code and not new_password:
-        user = query_one(f"SELECT id FROM {S}users WHERE email = {escape(email)}")
+        user = query_one(f"SELECT id FROM {S}users WHERE email = %s", (email,))
         response_msg = 'Если пользователь существует, код сброса будет отправлен на email'
 
         if user:
             user_id = user[0]
-            now = datetime.utcnow().isoformat()
 
-            # Delete old tokens
-            execute(f"DELETE FROM {S}password_reset_tokens WHERE user_id = {escape(user_id)}")
+            # A double-submitted form reuses the code just sent instead of invalidating it
+            reset_code = recent_code('password_reset_tokens', user_id)
+            if reset_code is None:
+                now = datetime.utcnow().isoformat()
 
-            # Generate and store new code
-            reset_code = generate_code()
-            expires_at = (datetime.utcnow() + timedelta(hours=RESET_CODE_LIFETIME_HOURS)).isoformat()
+                # Delete old tokens
+                execute(f"DELETE FROM {S}password_reset_tokens WHERE user_id = %s", (user_id,))
 
-            execute(f"""
-                INSERT INTO {S}password_reset_tokens (user_id, token_hash, expires_at, created_at)
-                VALUES ({escape(user_id)}, {escape(reset_code)}, {escape(expires_at)}, {escape(now)})
-            """)
+                # Generate and store new code
+                reset_code = generate_code()
+                expires_at = (datetime.utcnow() + timedelta(hours=RESET_CODE_LIFETIME_HOURS)).isoformat()
+
+                execute(f"""
+                    INSERT INTO {S}password_reset_tokens (user_id, token_hash, expires_at, created_at)
+                    VALUES (%s, %s, %s, %s)
+                """, (user_id, reset_code, expires_at, now))
 
             # Send code via email if SMTP configured
             if is_email_enabled():
-                if send_password_reset_code(email, reset_code):
+                headers = event.get('headers') or {}
+                locale = resolve_locale(payload.get('locale'), headers.get('Accept-Language') or headers.get('accept-language'))
+                if send_password_reset_code(email, reset_code, locale, RESET_CODE_LIFETIME_HOURS * 60):
                     return response(200, {'message': response_msg}, origin)
                 else:
                     return response(200, {'message': 'Не удалось отправить код'}, origin)
@@ -75,7 +83,7 @@ def handle(event: dict, origin: str = '*') -> dict:
         now = datetime.utcnow().isoformat()
 
         # Find user
-        user = query_one(f"SELECT id FROM {S}users WHERE email = {escape(email)}")
+        user = query_one(f"SELECT id FROM {S}users WHERE email = %s", (email,))
         if not user:
             return error(400, 'Неверный код', origin)
 
@@ -84,10 +92,10 @@ def handle(event: dict, origin: str = '*') -> dict:
         # Verify code
         token_record = query_one(f"""
             SELECT id FROM {S}password_reset_tokens
-            WHERE user_id = {escape(user_id)}
-              AND token_hash = {escape(code)}
-              AND expires_at > {escape(now)}
-        """)
+            WHERE user_id = %s
+              AND token_hash = %s
+              AND expires_at > %s
+        """, (user_id, code, now))
 
         if not token_record:
             return error(400, 'Неверный или истёкший код', origin)
@@ -95,13 +103,13 @@ def handle(event: dict, origin: str = '*') -> dict:
         # Update password
         new_password_hash = hash_password(new_password)
         execute(f"""
-            UPDATE {S}users SET password_hash = {escape(new_password_hash)}, updated_at = {escape(now)}
-            WHERE id = {escape(user_id)}
-        """)
+            UPDATE {S}users SET password_hash = %s, updated_at = %s
+            WHERE id = %s
+        """, (new_password_hash, now, user_id))
 
         # Cleanup tokens
-        execute(f"DELETE FROM {S}password_reset_tokens WHERE user_id = {escape(user_id)}")
-        execute(f"DELETE FROM {S}refresh_tokens WHERE user_id = {escape(user_id)}")
+        execute(f"DELETE FROM {S}password_reset_tokens WHERE user_id = %s", (user_id,))
+        token_store.revoke_user(user_id)
 
         return response(200, {'message': 'Пароль успешно изменён'}, origin)
 
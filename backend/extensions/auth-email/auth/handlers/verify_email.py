@@ -2,10 +2,31 @@
 import json
 from datetime import datetime
 
-from utils.db import query_one, execute, escape, get_schema
+from utils.db import statement, get_schema
 from utils.http import response, error
 
 
+S = get_schema()
+
+# User state and code validity in one round-trip
+VERIFY_LOOKUP = statement('verify_email_lookup', f"""
+    SELECT u.id, u.email_verified,
+           EXISTS (
+               SELECT 1 FROM {S}email_verification_tokens t
+               WHERE t.user_id = u.id AND t.token_hash = $2 AND t.expires_at > $3
+           )
+    FROM {S}users u WHERE u.email = $1
+""")
+
+# Mark verified and drop used codes together
+VERIFY_CONFIRM = statement('verify_email_confirm', f"""
+    WITH used AS (
+        DELETE FROM {S}email_verification_tokens WHERE user_id = $1
+    )
+    UPDATE {S}users SET email_verified = TRUE, updated_at = $2 WHERE id = $1
+""")
+
+
 def handle(event: dict, origin: str = '*') -> dict:
     """Verify email with code. POST {email, code}."""
     body_str = event.get('body', '{}')
@@ -18,36 +39,19 @@ def handle(event: dict, origin: str = '*') -> dict:
         return error(400, 'Email и код обязательны', origin)
 
     now = datetime.utcnow().isoformat()
-    S = get_schema()
 
-    # Find user by email
-    user = query_one(f"SELECT id, email_verified FROM {S}users WHERE email = {escape(email)}")
+    user = VERIFY_LOOKUP.one(email, code, now)
     if not user:
         return error(404, 'Пользователь не найден', origin)
 
-    user_id, already_verified = user
+    user_id, already_verified, code_valid = user
 
     if already_verified:
         return response(200, {'message': 'Email уже подтверждён'}, origin)
 
-    # Find valid code
-    token_record = query_one(f"""
-        SELECT id FROM {S}email_verification_tokens
-        WHERE user_id = {escape(user_id)}
-          AND token_hash = {escape(code)}
-          AND expires_at > {escape(now)}
-    """)
-
-    if not token_record:
+    if not code_valid:
         return error(400, 'Неверный или истёкший код', origin)
 
-    # Mark email as verified
-    execute(f"""
-        UPDATE {S}users SET email_verified = TRUE, updated_at = {escape(now)}
-        WHERE id = {escape(user_id)}
-    """)
-
-    # Delete used token
-    execute(f"DELETE FROM {S}email_verification_tokens WHERE user_id = {escape(user_id)}")
+    VERIFY_CONFIRM.execute(user_id, now)
 
     return response(200, {'message': 'Email подтверждён'}, origin)
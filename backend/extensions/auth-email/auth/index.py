@@ -8,10 +8,12 @@ Routes (via ?action= query parameter):
   POST /auth?action=refresh        - Refresh access token
   POST /auth?action=logout         - Logout and revoke tokens
   POST /auth?action=reset-password - Request/complete password reset
-  GET  /auth?action=health         - Check DB schema
+  GET  /auth?action=health         - Check DB schema (&mode=live skips the database)
 """
 from handlers import register, login, logout, refresh, reset_password, health, verify_email
 from utils.http import options_response, error, get_origin_from_event
+from utils.db import request_scope
+from utils.password import PasswordHasherBusy, PasswordHasherTimeout
 
 
 ROUTES = {
@@ -42,7 +44,8 @@ def handler(event: dict, context) -> dict:
 
     # Some actions allow GET
     if action in GET_ACTIONS and method == 'GET':
-        return ROUTES[action](event, origin)
+        with request_scope():
+            return ROUTES[action](event, origin)
 
     if method != 'POST':
         return error(405, 'Method not allowed', origin)
@@ -50,4 +53,11 @@ def handler(event: dict, context) -> dict:
     if not action or action not in ROUTES:
         return error(404, f'Unknown action: {action}. Use ?action=health|login|register|refresh|logout|reset-password|verify-email', origin)
 
-    return ROUTES[action](event, origin)
+    # One connection and one commit per request
+    try:
+        with request_scope():
+            return ROUTES[action](event, origin)
+    except PasswordHasherTimeout:
+        return error(503, 'Сервер перегружен, повторите попытку через несколько секунд', origin)
+    except PasswordHasherBusy:
+        return error(429, 'Сервер перегружен, повторите попытку через несколько секунд', origin)
@@ -0,0 +1,174 @@
+"""Lockout semantics of the login limiter (MAX_LOGIN_ATTEMPTS within LOCKOUT_MINUTES)."""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.rate_limit import SlidingWindowLimiter, AttemptLog  # noqa: E402
+
+
+LIMIT = 5
+WINDOW = 15 * 60
+
+
+def _limiter(**kwargs) -> SlidingWindowLimiter:
+    return SlidingWindowLimiter(LIMIT, WINDOW, **kwargs)
+
+
+def test_locks_after_limit_failures():
+    limiter = _limiter()
+    for i in range(LIMIT - 1):
+        limiter.hit('a@example.com', now=1000 + i)
+        assert limiter.retry_after('a@example.com', now=1000 + i) == 0
+    limiter.hit('a@example.com', now=1010)
+    assert limiter.retry_after('a@example.com', now=1010) == WINDOW
+
+
+def test_lock_runs_from_latest_failure():
+    limiter = _limiter()
+    for i in range(LIMIT):
+        limiter.hit('a@example.com', now=1000 + i * 10)
+    last = 1000 + (LIMIT - 1) * 10
+    assert limiter.retry_after('a@example.com', now=last + 60) == WINDOW - 60
+    assert limiter.retry_after('a@example.com', now=last + WINDOW - 1) == 1
+
+
+def test_unlocks_after_window():
+    limiter = _limiter()
+    for _ in range(LIMIT):
+        limiter.hit('a@example.com', now=1000)
+    assert limiter.retry_after('a@example.com', now=1000 + WINDOW) == 0
+
+
+def test_failures_outside_window_do_not_count():
+    limiter = _limiter()
+    for i in range(LIMIT - 1):
+        limiter.hit('a@example.com', now=1000 + i)
+    limiter.hit('a@example.com', now=1000 + WINDOW + 5)
+    assert limiter.retry_after('a@example.com', now=1000 + WINDOW + 5) == 0
+
+
+def test_rejected_attempts_do_not_extend_lock():
+    # The handler checks retry_after and returns 429 without calling hit()
+    limiter = _limiter()
+    for _ in range(LIMIT):
+        limiter.hit('a@example.com', now=1000)
+    for t in range(1001, 1000 + WINDOW, 60):
+        assert limiter.retry_after('a@example.com', now=t) > 0
+    assert limiter.retry_after('a@example.com', now=1000 + WINDOW) == 0
+
+
+def test_keys_are_independent():
+    limiter = _limiter()
+    for _ in range(LIMIT):
+        limiter.hit('a@example.com', now=1000)
+    assert limiter.retry_after('a@example.com', now=1001) > 0
+    assert limiter.retry_after('b@example.com', now=1001) == 0
+
+
+def test_reset_clears_failures():
+    limiter = _limiter()
+    for _ in range(LIMIT):
+        limiter.hit('a@example.com', now=1000)
+    limiter.reset('a@example.com')
+    assert limiter.retry_after('a@example.com', now=1001) == 0
+    limiter.hit('a@example.com', now=1002)
+    assert limiter.retry_after('a@example.com', now=1002) == 0
+
+
+def test_seed_from_other_containers_locks():
+    limiter = _limiter()
+    limiter.seed('a@example.com', LIMIT, 1000)
+    assert limiter.retry_after('a@example.com', now=1100) == WINDOW - 100
+
+
+def test_seed_merges_with_local_failures():
+    limiter = _limiter()
+    for i in range(2):
+        limiter.hit('a@example.com', now=1000 + i)
+    limiter.seed('a@example.com', LIMIT, 1050)
+    assert limiter.retry_after('a@example.com', now=1050) == WINDOW
+    # Seeded failures never exceed the limit, and the latest one drives the lock
+    limiter.seed('a@example.com', 100, 900)
+    assert limiter.retry_after('a@example.com', now=1050) == WINDOW
+
+
+def test_seed_below_limit_does_not_lock():
+    limiter = _limiter()
+    limiter.seed('a@example.com', LIMIT - 1, 1000)
+    assert limiter.retry_after('a@example.com', now=1001) == 0
+
+
+def test_least_recently_used_keys_are_evicted():
+    limiter = _limiter(max_keys=2)
+    for key in ('a', 'b'):
+        for _ in range(LIMIT):
+            limiter.hit(key, now=1000)
+    limiter.hit('c', now=1000)
+    assert limiter.retry_after('a', now=1001) == 0
+    assert limiter.retry_after('b', now=1001) > 0
+
+
+def test_concurrent_hits_lock_exactly_at_limit():
+    limiter = SlidingWindowLimiter(LIMIT * 20, WINDOW)
+    barrier = threading.Barrier(20)
+
+    def worker():
+        barrier.wait()
+        for _ in range(LIMIT):
+            limiter.hit('a@example.com', now=1000)
+
+    threads = [threading.Thread(target=worker) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert limiter.retry_after('a@example.com', now=1000) == WINDOW
+
+
+def test_attempt_log_due_by_size():
+    log = AttemptLog(max_pending=3, max_age=60)
+    assert not log.due()
+    log.add('a@example.com', '1.1.1.1', 'ts1')
+    log.add('a@example.com', '1.1.1.1', 'ts2')
+    assert not log.due()
+    log.add('b@example.com', '1.1.1.1', 'ts3')
+    assert log.due()
+    assert len(log) == 3
+
+
+def test_attempt_log_due_by_age():
+    log = AttemptLog(max_pending=100, max_age=0)
+    assert not log.due()
+    log.add('a@example.com', '1.1.1.1', 'ts1')
+    assert log.due()
+
+
+def test_attempt_log_drain_empties_buffer():
+    log = AttemptLog(max_pending=100, max_age=60)
+    log.add('a@example.com', '1.1.1.1', 'ts1')
+    log.add('b@example.com', '', 'ts2')
+    assert log.drain() == [('a@example.com', '1.1.1.1', 'ts1'), ('b@example.com', '', 'ts2')]
+    assert len(log) == 0
+    assert log.drain() == []
+
+
+def test_attempt_log_discard_drops_email():
+    log = AttemptLog(max_pending=100, max_age=0)
+    log.add('a@example.com', '1.1.1.1', 'ts1')
+    log.add('b@example.com', '1.1.1.1', 'ts2')
+    log.discard('a@example.com')
+    assert log.drain() == [('b@example.com', '1.1.1.1', 'ts2')]
+    log.add('a@example.com', '1.1.1.1', 'ts3')
+    log.discard('a@example.com')
+    assert not log.due()
+
+
+def test_attempt_log_restore_puts_rows_first():
+    log = AttemptLog(max_pending=100, max_age=60)
+    log.add('a@example.com', '1.1.1.1', 'ts1')
+    failed = log.drain()
+    log.add('b@example.com', '1.1.1.1', 'ts2')
+    log.restore(failed)
+    assert log.drain() == [('a@example.com', '1.1.1.1', 'ts1'), ('b@example.com', '1.1.1.1', 'ts2')]
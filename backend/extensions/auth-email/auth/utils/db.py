@@ -1,7 +1,33 @@
-"""Database utilities for Simple Query Protocol."""
+"""
+Database utilities: parameterised queries and prepared statements.
+
+Connections come from a small pool kept by the warm container; each
+request scope checks out its own connection, so concurrent requests never
+share a transaction. Prepared statements live on the server session and
+are tracked per connection. PREPARE/EXECUTE needs a session-mode pooler
+(or a direct connection): behind a transaction-mode pooler the next
+transaction may land on a backend that never saw the PREPARE.
+"""
 import os
+import threading
+from contextlib import contextmanager
 import psycopg2
-from typing import Any
+from psycopg2 import extensions
+
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+
+_request = threading.local()
+
+# Idle connections survive between invocations together with the statements
+# prepared on them: id(conn) -> set of statement names.
+_idle = []
+_prepared = {}
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(1, DB_POOL_SIZE))
+
+_statements = {}
 
 
 def get_connection():
@@ -14,62 +40,185 @@ def get_connection():
 
 def get_schema() -> str:
     """Get schema prefix from env. Returns 'schema.' or empty string."""
-    schema = os.environ.get('MAIN_DB_SCHEMA', '')
+    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
     return f"{schema}." if schema else ""
 
 
-def escape(value: Any) -> str:
-    """Escape value for SQL (simple protocol)."""
-    if value is None:
-        return 'NULL'
-    if isinstance(value, bool):
-        return 'TRUE' if value else 'FALSE'
-    if isinstance(value, (int, float)):
-        return str(value)
-    # String - escape single quotes
-    s = str(value).replace("'", "''")
-    return f"'{s}'"
-
-
-def query(sql: str) -> list:
-    """Execute SELECT query and return all rows."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(sql)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return rows
-
-
-def query_one(sql: str):
-    """Execute SELECT query and return first row or None."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(sql)
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
-    return row
-
-
-def execute(sql: str) -> None:
-    """Execute INSERT/UPDATE/DELETE query."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(sql)
-    conn.commit()
-    cur.close()
-    conn.close()
-
-
-def execute_returning(sql: str):
+def _discard(conn) -> None:
+    """Close a connection and forget the statements prepared on it."""
+    _prepared.pop(id(conn), None)
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+def _acquire():
+    """Check out an idle connection, or open a new one while under DB_POOL_SIZE."""
+    if not _slots.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT):
+        raise RuntimeError('Database connection pool exhausted')
+    try:
+        while True:
+            with _pool_lock:
+                conn = _idle.pop() if _idle else None
+            if conn is None:
+                conn = get_connection()
+                _prepared[id(conn)] = set()
+                return conn
+            if not conn.closed:
+                return conn
+            _discard(conn)
+    except Exception:
+        _slots.release()
+        raise
+
+
+def _release(conn, broken: bool = False) -> None:
+    """Return a connection to the pool; broken or closed ones are dropped."""
+    try:
+        if broken or conn.closed:
+            _discard(conn)
+            return
+        if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        with _pool_lock:
+            _idle.append(conn)
+    except psycopg2.Error:
+        _discard(conn)
+    finally:
+        _slots.release()
+
+
+@contextmanager
+def request_scope():
+    """
+    Share one connection and one transaction across all helpers in a request.
+
+    A pooled connection is checked out lazily on the first query, committed
+    once when the block exits normally, rolled back if it raises, and
+    returned to the pool either way. Nested scopes reuse the outer one.
+    """
+    if getattr(_request, 'active', False):
+        yield
+        return
+
+    _request.active = True
+    _request.conn = None
+    broken = False
+    try:
+        yield
+        if _request.conn is not None:
+            _request.conn.commit()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    except Exception:
+        if _request.conn is not None:
+            _request.conn.rollback()
+        raise
+    finally:
+        conn, _request.conn = _request.conn, None
+        _request.active = False
+        if conn is not None:
+            _release(conn, broken)
+
+
+def _fetch(cur, fetch: str | None):
+    if fetch == 'all':
+        return cur.fetchall()
+    if fetch == 'one':
+        return cur.fetchone()
+    return None
+
+
+def _run(sql: str, params: tuple, fetch: str | None, prepare: tuple | None = None):
+    """Execute statement on the request connection, or in its own transaction outside a scope."""
+    in_scope = getattr(_request, 'active', False)
+    if in_scope:
+        if _request.conn is None:
+            _request.conn = _acquire()
+        conn = _request.conn
+    else:
+        conn = _acquire()
+
+    broken = False
+    try:
+        cur = conn.cursor()
+        try:
+            prepared = _prepared.setdefault(id(conn), set())
+            if prepare and prepare[0] not in prepared:
+                cur.execute(f"PREPARE {prepare[0]} AS {prepare[1]}")
+                prepared.add(prepare[0])
+            cur.execute(sql, params)
+            result = _fetch(cur, fetch)
+        finally:
+            cur.close()
+        if not in_scope:
+            conn.commit()
+        return result
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    except Exception:
+        if not in_scope:
+            conn.rollback()
+        raise
+    finally:
+        if not in_scope:
+            _release(conn, broken)
+
+
+def query(sql: str, params: tuple = ()) -> list:
+    """Execute SELECT query with %s placeholders and return all rows."""
+    return _run(sql, params, 'all')
+
+
+def query_one(sql: str, params: tuple = ()):
+    """Execute SELECT query with %s placeholders and return first row or None."""
+    return _run(sql, params, 'one')
+
+
+def execute(sql: str, params: tuple = ()) -> None:
+    """Execute INSERT/UPDATE/DELETE query with %s placeholders."""
+    _run(sql, params, None)
+
+
+def execute_returning(sql: str, params: tuple = ()):
     """Execute INSERT with RETURNING and return first value."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(sql)
-    result = cur.fetchone()
-    conn.commit()
-    cur.close()
-    conn.close()
+    result = _run(sql, params, 'one')
     return result[0] if result else None
+
+
+class Statement:
+    """
+    Server-side prepared statement with $1..$n placeholders.
+
+    PREPARE is sent once per pooled connection on first use; every later
+    call on that connection is a plain EXECUTE that reuses the cached plan.
+    """
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+
+    def _run(self, params: tuple, fetch: str | None):
+        placeholders = ', '.join(['%s'] * len(params))
+        sql = f"EXECUTE {self.name} ({placeholders})" if params else f"EXECUTE {self.name}"
+        return _run(sql, params, fetch, prepare=(self.name, self.sql))
+
+    def all(self, *params) -> list:
+        return self._run(params, 'all')
+
+    def one(self, *params):
+        return self._run(params, 'one')
+
+    def execute(self, *params) -> None:
+        self._run(params, None)
+
+
+def statement(name: str, sql: str) -> Statement:
+    """Register a prepared statement; names must be unique per function."""
+    if name in _statements and _statements[name].sql != sql:
+        raise ValueError(f'Statement {name} already registered with different SQL')
+    _statements[name] = Statement(name, sql)
+    return _statements[name]
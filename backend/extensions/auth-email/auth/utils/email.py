@@ -1,9 +1,17 @@
 """Email utilities for sending verification codes."""
+import hashlib
 import os
 import secrets
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import time
+from datetime import datetime, timedelta
+
+from utils.db import execute, query_one, get_schema
+from utils.email_templates import render, DEFAULT_LOCALE
+
+
+# Repeated requests for the same kind of email to the same address within
+# this window produce a single outbox row.
+EMAIL_DEDUPE_SECONDS = int(os.environ.get('EMAIL_DEDUPE_SECONDS', '60'))
 
 
 def is_email_enabled() -> bool:
@@ -16,78 +24,62 @@ def generate_code() -> str:
     return str(secrets.randbelow(900000) + 100000)
 
 
-def send_email(to_email: str, subject: str, html_body: str, text_body: str) -> bool:
-    """Send email via SMTP (Gmail by default)."""
-    smtp_host = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
-    smtp_port = int(os.environ.get('SMTP_PORT', '587'))
-    smtp_user = os.environ.get('SMTP_USER', '')
-    smtp_password = os.environ.get('SMTP_PASSWORD', '')
-    smtp_from = os.environ.get('SMTP_FROM', smtp_user)
-
-    if not smtp_user or not smtp_password:
-        return False
+def queue_email(to_email: str, subject: str, html_body: str, text_body: str, dedupe_key: str) -> bool:
+    """
+    Put email into the outbox; the email-sender function delivers it over SMTP.
 
-    msg = MIMEMultipart('alternative')
-    msg['Subject'] = subject
-    msg['From'] = smtp_from
-    msg['To'] = to_email
-
-    msg.attach(MIMEText(text_body, 'plain', 'utf-8'))
-    msg.attach(MIMEText(html_body, 'html', 'utf-8'))
-
-    try:
-        with smtplib.SMTP(smtp_host, smtp_port, timeout=10) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.sendmail(smtp_from, to_email, msg.as_string())
-        return True
-    except (smtplib.SMTPException, OSError):
+    The row is written in the request transaction and the sender is woken by
+    NOTIFY on commit, so the API never waits for SMTP. A repeated dedupe_key
+    (e.g. a double-submitted form) is ignored - see dedupe_key().
+    """
+    if not is_email_enabled():
         return False
 
-
-def send_verification_code(to_email: str, code: str) -> bool:
-    """Send email verification code."""
-    subject = "Код подтверждения"
-
-    html_body = f"""
-    <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-        <h2>Подтверждение email</h2>
-        <p>Ваш код подтверждения:</p>
-        <p style="font-size: 32px; font-weight: bold; letter-spacing: 8px;
-                  background: #f5f5f5; padding: 20px; text-align: center;
-                  border-radius: 8px; margin: 20px 0;">
-            {code}
-        </p>
-        <p style="color: #666; font-size: 14px;">
-            Код действителен 24 часа. Если вы не регистрировались — проигнорируйте это письмо.
-        </p>
-    </div>
+    S = get_schema()
+    key = hashlib.sha256(dedupe_key.encode()).hexdigest()
+    execute(f"""
+        WITH queued AS (
+            INSERT INTO {S}email_outbox (dedupe_key, to_email, subject, html_body, text_body)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (dedupe_key) DO NOTHING
+            RETURNING id
+        )
+        SELECT pg_notify('email_outbox', '') FROM queued
+    """, (key, to_email, subject, html_body, text_body))
+    return True
+
+
+def dedupe_key(kind: str, to_email: str) -> str:
     """
+    Outbox key for one kind of email to one address per EMAIL_DEDUPE_SECONDS bucket.
 
-    text_body = f"Ваш код подтверждения: {code}"
+    Callers reuse a code issued within the same window (see recent_code), so
+    a dropped duplicate always carried the same code as the email that was sent.
+    """
+    bucket = int(time.time() // EMAIL_DEDUPE_SECONDS)
+    return f'{kind}:{to_email}:{bucket}'
 
-    return send_email(to_email, subject, html_body, text_body)
 
+def recent_code(table: str, user_id: int):
+    """Code issued to the user within EMAIL_DEDUPE_SECONDS, or None."""
+    S = get_schema()
+    since = (datetime.utcnow() - timedelta(seconds=EMAIL_DEDUPE_SECONDS)).isoformat()
+    row = query_one(f"""
+        SELECT token_hash FROM {S}{table}
+        WHERE user_id = %s AND created_at > %s AND expires_at > %s
+        ORDER BY created_at DESC
+        LIMIT 1
+    """, (user_id, since, datetime.utcnow().isoformat()))
+    return row[0] if row else None
 
-def send_password_reset_code(to_email: str, code: str) -> bool:
-    """Send password reset code."""
-    subject = "Код для сброса пароля"
 
-    html_body = f"""
-    <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-        <h2>Сброс пароля</h2>
-        <p>Ваш код для сброса пароля:</p>
-        <p style="font-size: 32px; font-weight: bold; letter-spacing: 8px;
-                  background: #f5f5f5; padding: 20px; text-align: center;
-                  border-radius: 8px; margin: 20px 0;">
-            {code}
-        </p>
-        <p style="color: #666; font-size: 14px;">
-            Код действителен 1 час. Если вы не запрашивали сброс — проигнорируйте это письмо.
-        </p>
-    </div>
-    """
+def send_verification_code(to_email: str, code: str, locale: str = DEFAULT_LOCALE, lifetime_minutes: int = 24 * 60) -> bool:
+    """Queue email verification code."""
+    subject, html_body, text_body = render('verification', code, lifetime_minutes, locale)
+    return queue_email(to_email, subject, html_body, text_body, dedupe_key('verify', to_email))
 
-    text_body = f"Ваш код для сброса пароля: {code}"
 
-    return send_email(to_email, subject, html_body, text_body)
+def send_password_reset_code(to_email: str, code: str, locale: str = DEFAULT_LOCALE, lifetime_minutes: int = 60) -> bool:
+    """Queue password reset code."""
+    subject, html_body, text_body = render('password_reset', code, lifetime_minutes, locale)
+    return queue_email(to_email, subject, html_body, text_body, dedupe_key('reset', to_email))
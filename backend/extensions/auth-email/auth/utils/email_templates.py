@@ -0,0 +1,138 @@
+"""Localised email templates, compiled once per container."""
+import html
+from string import Template
+
+
+LOCALES = ('ru', 'en')
+DEFAULT_LOCALE = 'ru'
+
+# Placeholder left in place while the rest of a template is pre-rendered
+_CODE_MARKER = '\x00code\x00'
+
+_LAYOUT = Template("""
+<div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
+    <h2>$heading</h2>
+    <p>$intro</p>
+    <p style="font-size: 32px; font-weight: bold; letter-spacing: 8px;
+              background: #f5f5f5; padding: 20px; text-align: center;
+              border-radius: 8px; margin: 20px 0;">
+        $code
+    </p>
+    <p style="color: #666; font-size: 14px;">
+        $footer
+    </p>
+</div>
+""")
+
+_SOURCES = {
+    'verification': {
+        'ru': {
+            'subject': 'Код подтверждения',
+            'heading': 'Подтверждение email',
+            'intro': 'Ваш код подтверждения:',
+            'footer': 'Код действителен $lifetime. Если вы не регистрировались — проигнорируйте это письмо.',
+            'text': 'Ваш код подтверждения: $code\nКод действителен $lifetime.',
+        },
+        'en': {
+            'subject': 'Verification code',
+            'heading': 'Email confirmation',
+            'intro': 'Your verification code:',
+            'footer': 'The code is valid for $lifetime. If you did not sign up, please ignore this email.',
+            'text': 'Your verification code: $code\nThe code is valid for $lifetime.',
+        },
+    },
+    'password_reset': {
+        'ru': {
+            'subject': 'Код для сброса пароля',
+            'heading': 'Сброс пароля',
+            'intro': 'Ваш код для сброса пароля:',
+            'footer': 'Код действителен $lifetime. Если вы не запрашивали сброс — проигнорируйте это письмо.',
+            'text': 'Ваш код для сброса пароля: $code\nКод действителен $lifetime.',
+        },
+        'en': {
+            'subject': 'Password reset code',
+            'heading': 'Password reset',
+            'intro': 'Your password reset code:',
+            'footer': 'The code is valid for $lifetime. If you did not request a reset, please ignore this email.',
+            'text': 'Your password reset code: $code\nThe code is valid for $lifetime.',
+        },
+    },
+}
+
+# Compiled once at import: every field becomes a string.Template
+_TEMPLATES = {
+    (name, locale): {field: Template(value) for field, value in fields.items()}
+    for name, by_locale in _SOURCES.items()
+    for locale, fields in by_locale.items()
+}
+
+
+def resolve_locale(requested: str | None = None, accept_language: str | None = None) -> str:
+    """Pick 'ru' or 'en' from an explicit locale or an Accept-Language header."""
+    for candidate in (requested, accept_language):
+        if candidate:
+            primary = str(candidate).split(',')[0].strip().lower()[:2]
+            if primary in LOCALES:
+                return primary
+    return DEFAULT_LOCALE
+
+
+def _plural_ru(n: int, one: str, few: str, many: str) -> str:
+    if n % 10 == 1 and n % 100 != 11:
+        return one
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return few
+    return many
+
+
+def format_lifetime(minutes: int, locale: str) -> str:
+    """Human-readable code lifetime: '24 часа', '10 минут', '1 hour'."""
+    if minutes % 60 == 0:
+        hours = minutes // 60
+        if locale == 'en':
+            return f"{hours} hour{'s' if hours != 1 else ''}"
+        return f"{hours} {_plural_ru(hours, 'час', 'часа', 'часов')}"
+    if locale == 'en':
+        return f"{minutes} minute{'s' if minutes != 1 else ''}"
+    return f"{minutes} {_plural_ru(minutes, 'минута', 'минуты', 'минут')}"
+
+
+# (template, locale, lifetime) -> pre-rendered parts, filled on first use
+_skeletons = {}
+
+
+def _skeleton(name: str, locale: str, lifetime_minutes: int) -> tuple:
+    """
+    Everything except the code, rendered once per (template, locale, lifetime).
+
+    Returns (subject, html_parts, text_parts); a message is the parts
+    joined with its code.
+    """
+    template = _TEMPLATES[(name, locale)]
+    lifetime = format_lifetime(lifetime_minutes, locale)
+    values = {'code': _CODE_MARKER, 'lifetime': lifetime}
+    footer = template['footer'].substitute(values)
+    html_body = _LAYOUT.substitute(
+        heading=template['heading'].substitute(values),
+        intro=template['intro'].substitute(values),
+        footer=footer,
+        code=_CODE_MARKER
+    )
+    return (
+        template['subject'].substitute(values),
+        html_body.split(_CODE_MARKER),
+        template['text'].substitute(values).split(_CODE_MARKER),
+    )
+
+
+def render(name: str, code: str, lifetime_minutes: int, locale: str = DEFAULT_LOCALE) -> tuple[str, str, str]:
+    """Return (subject, html_body, text_body) for a code email."""
+    key = (name, locale, lifetime_minutes)
+    skeleton = _skeletons.get(key)
+    if skeleton is None:
+        if (name, locale) not in _TEMPLATES:
+            locale = DEFAULT_LOCALE
+        skeleton = _skeletons[key] = _skeleton(name, locale, lifetime_minutes)
+    subject, html_parts, text_parts = skeleton
+    html_code = code if code.isdigit() else html.escape(code)
+    return subject, html_code.join(html_parts), code.join(text_parts)
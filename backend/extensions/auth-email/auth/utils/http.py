@@ -15,6 +15,16 @@ def get_origin_from_event(event: dict) -> str:
     return os.environ.get('CORS_ORIGIN', '*')
 
 
+def get_client_ip(event: dict) -> str:
+    """Get client IP from the request context, falling back to X-Forwarded-For."""
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    if identity.get('sourceIp'):
+        return identity['sourceIp']
+    headers = event.get('headers') or {}
+    forwarded = headers.get('X-Forwarded-For') or headers.get('x-forwarded-for') or ''
+    return forwarded.split(',')[0].strip()
+
+
 def make_headers(origin: str = '*', set_cookie: Optional[str] = None) -> dict:
     """Create response headers with CORS."""
     headers = {
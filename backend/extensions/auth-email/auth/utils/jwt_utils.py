@@ -2,6 +2,8 @@
 import os
 import jwt
 import hashlib
+import secrets
+import uuid
 from datetime import datetime, timedelta
 
 
@@ -24,17 +26,26 @@ def create_access_token(user_id: int, email: str) -> str:
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
 
-def create_refresh_token(user_id: int) -> tuple[str, datetime]:
-    """Create long-lived JWT refresh token."""
+def create_refresh_token(user_id: int, family_id: str | None = None) -> tuple[str, datetime, str]:
+    """
+    Create long-lived JWT refresh token.
+
+    Every token rotated from the same login shares a family id ('fam'),
+    which lets a replayed token revoke the whole chain. A random 'jti'
+    keeps tokens issued within the same second distinct.
+    """
     expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    family_id = family_id or str(uuid.uuid4())
     payload = {
         'sub': str(user_id),
         'type': 'refresh',
+        'fam': family_id,
+        'jti': secrets.token_hex(8),
         'exp': expire,
         'iat': datetime.utcnow()
     }
     token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
-    return token, expire
+    return token, expire, family_id
 
 
 def decode_refresh_token(token: str) -> dict | None:
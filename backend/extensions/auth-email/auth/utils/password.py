@@ -1,16 +1,67 @@
 """Password utilities."""
+import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
 import bcrypt
 
 
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', str(os.cpu_count() or 2)))
+BCRYPT_MAX_QUEUE = int(os.environ.get('BCRYPT_MAX_QUEUE', str(BCRYPT_WORKERS * 4)))
+BCRYPT_TIMEOUT = float(os.environ.get('BCRYPT_TIMEOUT', '10'))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hash/verify jobs are already queued; map to 429."""
+
+
+class PasswordHasherTimeout(PasswordHasherBusy):
+    """Raised when an admitted job does not finish within BCRYPT_TIMEOUT; map to 503."""
+
+
+# bcrypt releases the GIL, so a small thread pool spreads hashing over all
+# cores while the number of admitted jobs stays bounded.
+_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix='bcrypt')
+_slots = threading.BoundedSemaphore(BCRYPT_MAX_QUEUE)
+
+
+def _run(fn, *args):
+    """Run a bcrypt call on the worker pool, shedding load when the queue is full."""
+    if not _slots.acquire(blocking=False):
+        raise PasswordHasherBusy('Password hasher queue is full')
+    try:
+        future = _executor.submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=BCRYPT_TIMEOUT)
+    except FutureTimeout:
+        # A job still waiting for a worker is dropped; a running one frees its slot when done
+        future.cancel()
+        raise PasswordHasherTimeout('Password hasher timed out')
+
+
 def hash_password(password: str) -> str:
-    """Hash password using bcrypt with cost factor 12."""
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=12)).decode()
+    """Hash password using bcrypt with the configured cost factor."""
+    return _run(bcrypt.hashpw, password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
 
 
 def verify_password(password: str, password_hash: str) -> bool:
     """Verify password against bcrypt hash."""
-    return bcrypt.checkpw(password.encode(), password_hash.encode())
+    return _run(bcrypt.checkpw, password.encode(), password_hash.encode())
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """True if the hash was made with a cost factor other than BCRYPT_ROUNDS."""
+    parts = password_hash.split('$')
+    try:
+        return int(parts[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
 
 
 def validate_password(password: str) -> tuple[bool, str]:
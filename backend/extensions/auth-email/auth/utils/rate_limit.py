@@ -0,0 +1,113 @@
+"""In-memory login rate limiting."""
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class SlidingWindowLimiter:
+    """
+    Failed-attempt limiter keyed by an arbitrary string (email, client IP).
+
+    A key is locked once it has `limit` failures inside the last `window`
+    seconds and stays locked until `window` seconds after its latest failure.
+    Rejected attempts are not recorded, so a lock never extends itself.
+    State lives in the warm container; the least recently used keys are
+    evicted past `max_keys`.
+    """
+
+    def __init__(self, limit: int, window: float, max_keys: int = 10000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self, key: str, now: float):
+        failures = self._failures.get(key)
+        if failures is None:
+            return None
+        if failures[-1] <= now - self.window:
+            del self._failures[key]
+            return None
+        return failures
+
+    def retry_after(self, key: str, now: float | None = None) -> float:
+        """Seconds until the key may try again; 0 if it is not locked."""
+        now = time.time() if now is None else now
+        with self._lock:
+            failures = self._prune(key, now)
+            # Only the last `limit` failures are kept: the key is locked when
+            # they all fall inside one window ending at the latest of them.
+            if not failures or len(failures) < self.limit or failures[-1] - failures[0] >= self.window:
+                return 0
+            return failures[-1] + self.window - now
+
+    def hit(self, key: str, now: float | None = None) -> None:
+        """Record a failed attempt."""
+        now = time.time() if now is None else now
+        with self._lock:
+            failures = self._failures.setdefault(key, deque(maxlen=self.limit))
+            failures.append(now)
+            self._failures.move_to_end(key)
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+
+    def seed(self, key: str, count: int, last_at: float) -> None:
+        """Merge failures known from another source (e.g. the login_attempts table)."""
+        with self._lock:
+            failures = list(self._failures.get(key, ()))
+            failures += [last_at] * max(min(count, self.limit) - len(failures), 0)
+            self._failures[key] = deque(sorted(failures), maxlen=self.limit)
+            self._failures.move_to_end(key)
+
+    def reset(self, key: str) -> None:
+        with self._lock:
+            self._failures.pop(key, None)
+
+
+class AttemptLog:
+    """Buffer of failed attempts written to login_attempts in batches."""
+
+    def __init__(self, max_pending: int = 50, max_age: float = 5.0):
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self._rows = []
+        self._first_at = None
+        self._lock = threading.Lock()
+
+    def add(self, email: str, ip: str, attempted_at) -> None:
+        with self._lock:
+            self._rows.append((email, ip, attempted_at))
+            if self._first_at is None:
+                self._first_at = time.monotonic()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def due(self) -> bool:
+        with self._lock:
+            return bool(self._rows) and (
+                len(self._rows) >= self.max_pending
+                or time.monotonic() - self._first_at >= self.max_age
+            )
+
+    def drain(self) -> list:
+        with self._lock:
+            rows, self._rows = self._rows, []
+            self._first_at = None
+            return rows
+
+    def discard(self, email: str) -> None:
+        """Drop pending failures for an email that has just logged in."""
+        with self._lock:
+            self._rows = [row for row in self._rows if row[0] != email]
+            if not self._rows:
+                self._first_at = None
+
+    def restore(self, rows: list) -> None:
+        """Put back rows whose flush failed so they go out with the next batch."""
+        with self._lock:
+            self._rows[:0] = rows
+            if self._rows and self._first_at is None:
+                self._first_at = time.monotonic()
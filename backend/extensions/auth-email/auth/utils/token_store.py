@@ -0,0 +1,90 @@
+"""Refresh token storage."""
+import os
+import threading
+import time
+
+from utils.db import execute, statement, get_schema
+
+
+PRUNE_INTERVAL_SECONDS = int(os.environ.get('REFRESH_TOKEN_PRUNE_INTERVAL', '300'))
+PRUNE_BATCH_SIZE = int(os.environ.get('REFRESH_TOKEN_PRUNE_BATCH', '1000'))
+
+_prune_lock = threading.Lock()
+_last_pruned = 0.0
+
+S = get_schema()
+
+# Refresh rotation is the hottest path after login, keep its plan prepared
+ROTATE = statement('refresh_rotate', f"""
+    WITH consumed AS (
+        DELETE FROM {S}refresh_tokens
+        WHERE token_hash = $2
+          AND user_id = $1
+          AND expires_at > NOW() AT TIME ZONE 'UTC'
+        RETURNING user_id
+    ), issued AS (
+        INSERT INTO {S}refresh_tokens (user_id, token_hash, expires_at, created_at, family_id)
+        SELECT user_id, $3::varchar, $4::timestamp, NOW() AT TIME ZONE 'UTC', $5::varchar
+        FROM consumed
+        RETURNING user_id
+    )
+    SELECT u.email, u.name FROM issued JOIN {S}users u ON u.id = issued.user_id
+""")
+
+REVOKE_FAMILY = statement('refresh_revoke_family', f"DELETE FROM {S}refresh_tokens WHERE family_id = $1")
+
+
+def rotate(user_id: int, old_hash: str, new_hash: str, expires_at: str, family_id: str):
+    """
+    Consume a live token and store its successor in one statement.
+
+    DELETE ... RETURNING takes the row lock, so of several concurrent
+    requests with the same token exactly one gets a row back. Returns
+    (email, name) of the owner, or None if the token was unknown, expired
+    or already consumed.
+    """
+    return ROTATE.one(user_id, old_hash, new_hash, expires_at, family_id)
+
+
+def revoke_family(family_id: str) -> None:
+    """Delete every token descended from the same login."""
+    REVOKE_FAMILY.execute(family_id)
+
+
+def revoke(token_hash: str) -> None:
+    """Delete a single refresh token."""
+    execute(f"DELETE FROM {S}refresh_tokens WHERE token_hash = %s", (token_hash,))
+
+
+def revoke_user(user_id: int) -> None:
+    """Delete every refresh token of a user (logout everywhere, password reset)."""
+    execute(f"DELETE FROM {S}refresh_tokens WHERE user_id = %s", (user_id,))
+
+
+def prune_expired(batch_size: int = PRUNE_BATCH_SIZE) -> None:
+    """Delete up to batch_size expired tokens using the expires_at index."""
+    execute(f"""
+        DELETE FROM {S}refresh_tokens
+        WHERE id IN (
+            SELECT id FROM {S}refresh_tokens
+            WHERE expires_at < NOW() AT TIME ZONE 'UTC'
+            ORDER BY expires_at
+            LIMIT %s
+        )
+    """, (batch_size,))
+
+
+def prune_if_due() -> None:
+    """
+    Run one pruning batch at most every PRUNE_INTERVAL_SECONDS per container.
+
+    Keeps expired-token cleanup off the hot path instead of scanning the
+    table on every request.
+    """
+    global _last_pruned
+    with _prune_lock:
+        now = time.monotonic()
+        if _last_pruned and now - _last_pruned < PRUNE_INTERVAL_SECONDS:
+            return
+        _last_pruned = now
+    prune_expired()
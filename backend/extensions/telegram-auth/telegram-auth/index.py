@@ -18,6 +18,8 @@ from typing import Optional
 import psycopg2
 import jwt
 
+import token_store
+
 
 # =============================================================================
 # CONFIGURATION
@@ -188,36 +190,6 @@ def create_or_update_user(
     }
 
 
-def save_refresh_token(cursor, user_id: int, token_hash: str, expires_at: datetime) -> None:
-    """Save hashed refresh token to DB."""
-    schema = get_schema()
-    cursor.execute(f"""
-        INSERT INTO {schema}refresh_tokens (user_id, token_hash, expires_at)
-        VALUES (%s, %s, %s)
-    """, (user_id, token_hash, expires_at))
-
-
-def find_refresh_token(cursor, token_hash: str) -> Optional[dict]:
-    """Find refresh token by hash."""
-    schema = get_schema()
-    cursor.execute(f"""
-        SELECT user_id, expires_at
-        FROM {schema}refresh_tokens
-        WHERE token_hash = %s AND expires_at > NOW()
-    """, (token_hash,))
-
-    row = cursor.fetchone()
-    if row:
-        return {"user_id": row[0], "expires_at": row[1]}
-    return None
-
-
-def delete_refresh_token(cursor, token_hash: str) -> None:
-    """Delete refresh token."""
-    schema = get_schema()
-    cursor.execute(f"DELETE FROM {schema}refresh_tokens WHERE token_hash = %s", (token_hash,))
-
-
 def get_user_by_id(cursor, user_id: int) -> Optional[dict]:
     """Get user by ID."""
     schema = get_schema()
@@ -238,12 +210,6 @@ def get_user_by_id(cursor, user_id: int) -> Optional[dict]:
     return None
 
 
-def cleanup_expired_refresh_tokens(cursor) -> None:
-    """Remove expired refresh tokens."""
-    schema = get_schema()
-    cursor.execute(f"DELETE FROM {schema}refresh_tokens WHERE expires_at < NOW()")
-
-
 # =============================================================================
 # CORS HELPERS
 # =============================================================================
@@ -333,7 +299,7 @@ def handle_callback(cursor, body: dict) -> dict:
     refresh_token_hash = hash_token(refresh_token)
     refresh_expires = datetime.now(timezone.utc) + timedelta(days=30)
 
-    save_refresh_token(cursor, user["id"], refresh_token_hash, refresh_expires)
+    token_store.save(cursor, user["id"], refresh_token_hash, refresh_expires)
 
     return cors_response(200, {
         "access_token": access_token,
@@ -353,13 +319,15 @@ def handle_refresh(cursor, body: dict) -> dict:
         return cors_response(400, {"error": "Missing refresh_token"})
 
     jwt_secret = get_env("JWT_SECRET")
-    token_hash = hash_token(refresh_token)
 
-    token_data = find_refresh_token(cursor, token_hash)
-    if not token_data:
+    # Replace the presented token; a token already rotated by a concurrent request is rejected
+    new_refresh_token = generate_token(48)
+    refresh_expires = datetime.now(timezone.utc) + timedelta(days=30)
+    user_id = token_store.rotate(cursor, hash_token(refresh_token), hash_token(new_refresh_token), refresh_expires)
+    if not user_id:
         return cors_response(401, {"error": "Invalid or expired refresh token"})
 
-    user = get_user_by_id(cursor, token_data["user_id"])
+    user = get_user_by_id(cursor, user_id)
     if not user:
         return cors_response(401, {"error": "User not found"})
 
@@ -368,6 +336,7 @@ def handle_refresh(cursor, body: dict) -> dict:
 
     return cors_response(200, {
         "access_token": access_token,
+        "refresh_token": new_refresh_token,
         "expires_in": 900,
         "user": user,
     })
@@ -376,12 +345,15 @@ def handle_refresh(cursor, body: dict) -> dict:
 def handle_logout(cursor, body: dict) -> dict:
     """
     POST ?action=logout
-    Invalidate refresh token.
+    Invalidate refresh token, or all of the user's tokens with {"all": true}.
     """
     refresh_token = body.get("refresh_token")
     if refresh_token:
         token_hash = hash_token(refresh_token)
-        delete_refresh_token(cursor, token_hash)
+        if body.get("all"):
+            token_store.revoke_all(cursor, token_hash)
+        else:
+            token_store.revoke(cursor, token_hash)
 
     return cors_response(200, {"success": True})
 
@@ -418,7 +390,7 @@ def handler(event, context):
 
         # Cleanup expired tokens periodically
         cleanup_expired_tokens(cursor)
-        cleanup_expired_refresh_tokens(cursor)
+        token_store.prune_if_due(cursor)
 
         # Route to action handler
         if action == "callback" and method == "POST":
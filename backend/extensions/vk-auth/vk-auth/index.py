@@ -12,6 +12,8 @@ from urllib.error import HTTPError
 import jwt
 import psycopg2
 
+import token_store
+
 # =============================================================================
 # CONSTANTS
 # =============================================================================
@@ -45,12 +47,6 @@ def get_schema() -> str:
     return f"{schema}." if schema else ""
 
 
-def cleanup_expired_tokens(cur, schema: str) -> None:
-    """Delete expired refresh tokens."""
-    now = datetime.now(timezone.utc).isoformat()
-    cur.execute(f"DELETE FROM {schema}refresh_tokens WHERE expires_at < %s", (now,))
-
-
 # =============================================================================
 # SECURITY
 # =============================================================================
@@ -323,8 +319,8 @@ def handle_callback(event: dict, origin: str) -> dict:
             cur = conn.cursor()
             now = datetime.now(timezone.utc).isoformat()
 
-            # Cleanup expired tokens periodically
-            cleanup_expired_tokens(cur, S)
+            # Expired tokens are pruned in batches, at most once per interval
+            token_store.prune_if_due(cur)
 
             # 1. Check if user exists by vk_id
             cur.execute(
@@ -385,11 +381,7 @@ def handle_callback(event: dict, origin: str) -> dict:
             refresh_expires = (datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)).isoformat()
 
             # Store hashed refresh token
-            cur.execute(
-                f"""INSERT INTO {S}refresh_tokens (user_id, token_hash, expires_at, created_at)
-                    VALUES (%s, %s, %s, %s)""",
-                (user_id, refresh_token_hash, refresh_expires, now)
-            )
+            token_store.save(cur, user_id, refresh_token_hash, refresh_expires)
 
             conn.commit()
 
@@ -443,28 +435,23 @@ def handle_refresh(event: dict, origin: str) -> dict:
 
     try:
         cur = conn.cursor()
-        now = datetime.now(timezone.utc)
-
-        # Cleanup expired tokens
-        cleanup_expired_tokens(cur, S)
 
-        # Hash the provided token to compare with stored hash
-        token_hash = hash_token(refresh_token)
+        # Replace the presented token; a token already rotated by a concurrent request is rejected
+        new_refresh_token = create_refresh_token()
+        refresh_expires = (datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)).isoformat()
+        user_id = token_store.rotate(cur, hash_token(refresh_token), hash_token(new_refresh_token), refresh_expires)
+        if not user_id:
+            return error(401, 'Invalid or expired refresh token', origin)
 
         cur.execute(
-            f"""SELECT rt.user_id, u.email, u.name, u.avatar_url, u.vk_id
-                FROM {S}refresh_tokens rt
-                JOIN {S}users u ON u.id = rt.user_id
-                WHERE rt.token_hash = %s AND rt.expires_at > %s""",
-            (token_hash, now.isoformat())
+            f"SELECT email, name, avatar_url, vk_id FROM {S}users WHERE id = %s",
+            (user_id,)
         )
-
         row = cur.fetchone()
         if not row:
-            conn.commit()  # Commit cleanup
             return error(401, 'Invalid or expired refresh token', origin)
 
-        user_id, email, name, avatar_url, vk_id = row
+        email, name, avatar_url, vk_id = row
 
         access_token, expires_in = create_access_token(user_id, email)
 
@@ -472,6 +459,7 @@ def handle_refresh(event: dict, origin: str) -> dict:
 
         return response(200, {
             'access_token': access_token,
+            'refresh_token': new_refresh_token,
             'expires_in': expires_in,
             'user': {
                 'id': user_id,
@@ -489,7 +477,7 @@ def handle_refresh(event: dict, origin: str) -> dict:
 
 
 def handle_logout(event: dict, origin: str) -> dict:
-    """Logout user by invalidating refresh token."""
+    """Logout user by invalidating refresh token (or all of the user's tokens)."""
     body_str = event.get('body', '{}')
     if event.get('isBase64Encoded'):
         body_str = base64.b64decode(body_str).decode('utf-8')
@@ -501,17 +489,15 @@ def handle_logout(event: dict, origin: str) -> dict:
 
     refresh_token = payload.get('refresh_token', '')
     if refresh_token:
-        S = get_schema()
         conn = get_connection()
         try:
             cur = conn.cursor()
             token_hash = hash_token(refresh_token)
-            cur.execute(
-                f"DELETE FROM {S}refresh_tokens WHERE token_hash = %s",
-                (token_hash,)
-            )
-            # Also cleanup expired tokens
-            cleanup_expired_tokens(cur, S)
+            # {"all": true} signs the user out on every device
+            if payload.get('all'):
+                token_store.revoke_all(cur, token_hash)
+            else:
+                token_store.revoke(cur, token_hash)
             conn.commit()
         except Exception:
             pass
@@ -0,0 +1,95 @@
+"""Refresh token storage shared by the auth extensions."""
+import os
+import threading
+import time
+
+
+PRUNE_INTERVAL_SECONDS = int(os.environ.get('REFRESH_TOKEN_PRUNE_INTERVAL', '300'))
+PRUNE_BATCH_SIZE = int(os.environ.get('REFRESH_TOKEN_PRUNE_BATCH', '1000'))
+
+_prune_lock = threading.Lock()
+_last_pruned = 0.0
+
+
+def get_schema() -> str:
+    """Get database schema prefix."""
+    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+    return f"{schema}." if schema else ""
+
+
+def save(cur, user_id: int, token_hash: str, expires_at) -> None:
+    """Store a hashed refresh token."""
+    S = get_schema()
+    cur.execute(
+        f"""INSERT INTO {S}refresh_tokens (user_id, token_hash, expires_at, created_at)
+            VALUES (%s, %s, %s, NOW() AT TIME ZONE 'UTC')""",
+        (user_id, token_hash, expires_at)
+    )
+
+
+def rotate(cur, old_hash: str, new_hash: str, expires_at) -> int | None:
+    """
+    Replace a live token with a new one in a single statement.
+
+    Returns the owner's user_id, or None if the old token was unknown,
+    expired or already rotated by a concurrent request.
+    """
+    S = get_schema()
+    cur.execute(
+        f"""UPDATE {S}refresh_tokens
+            SET token_hash = %s, expires_at = %s, created_at = NOW() AT TIME ZONE 'UTC'
+            WHERE token_hash = %s AND expires_at > NOW() AT TIME ZONE 'UTC'
+            RETURNING user_id""",
+        (new_hash, expires_at, old_hash)
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def revoke(cur, token_hash: str) -> None:
+    """Delete a single refresh token."""
+    S = get_schema()
+    cur.execute(f"DELETE FROM {S}refresh_tokens WHERE token_hash = %s", (token_hash,))
+
+
+def revoke_all(cur, token_hash: str) -> int:
+    """Delete every refresh token of the user owning token_hash (logout everywhere)."""
+    S = get_schema()
+    cur.execute(
+        f"""DELETE FROM {S}refresh_tokens
+            WHERE user_id = (SELECT user_id FROM {S}refresh_tokens WHERE token_hash = %s)""",
+        (token_hash,)
+    )
+    return cur.rowcount
+
+
+def prune_expired(cur, batch_size: int = PRUNE_BATCH_SIZE) -> int:
+    """Delete up to batch_size expired tokens using the expires_at index."""
+    S = get_schema()
+    cur.execute(
+        f"""DELETE FROM {S}refresh_tokens
+            WHERE id IN (
+                SELECT id FROM {S}refresh_tokens
+                WHERE expires_at < NOW() AT TIME ZONE 'UTC'
+                ORDER BY expires_at
+                LIMIT %s
+            )""",
+        (batch_size,)
+    )
+    return cur.rowcount
+
+
+def prune_if_due(cur) -> int:
+    """
+    Run one pruning batch at most every PRUNE_INTERVAL_SECONDS per container.
+
+    Keeps expired-token cleanup off the hot path instead of scanning the
+    table on every request.
+    """
+    global _last_pruned
+    with _prune_lock:
+        now = time.monotonic()
+        if _last_pruned and now - _last_pruned < PRUNE_INTERVAL_SECONDS:
+            return 0
+        _last_pruned = now
+    return prune_expired(cur)
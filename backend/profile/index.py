@@ -1,21 +1,146 @@
 import json
 import os
-import psycopg2
+import hashlib
 from psycopg2.extras import RealDictCursor
-import jwt
+from db_pool import get_connection, release_connection
+from auth_middleware import verify_token, get_token_from_headers, get_user_id
+from profile_cache import ProfileCache
 
-DATABASE_URL = os.environ.get('DATABASE_URL')
-SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
-JWT_SECRET = os.environ.get('JWT_SECRET')
+PROFILE_COLUMNS = """
+    id, email, username, nickname, role, name, bio, avatar_url,
+    phone, telegram_username, verified, is_premium, agency_id,
+    agency_name, business_type, referral_code, created_at, updated_at
+"""
 
-def verify_token(token: str):
-    try:
-        return jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
-    except:
+PROFILE_FIELDS = (
+    'id', 'email', 'username', 'nickname', 'role', 'name', 'bio', 'avatar',
+    'phone', 'telegram', 'verified', 'isPremium', 'isAgencyOwner',
+    'agencyName', 'businessType', 'referralCode', 'createdAt'
+)
+
+# Поля, которые видны другим пользователям (чаты, отзывы, владельцы объявлений)
+PUBLIC_CARD_FIELDS = (
+    'id', 'username', 'nickname', 'name', 'avatar', 'role',
+    'verified', 'isPremium', 'agencyName', 'businessType'
+)
+
+MAX_BATCH_IDS = 300
+
+profile_cache = ProfileCache(
+    max_entries=int(os.environ.get('PROFILE_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('PROFILE_CACHE_TTL', '60'))
+)
+
+def serialize_user(user: dict) -> dict:
+    """Строка users в формате API"""
+    return {
+        'id': user['id'],
+        'email': user['email'],
+        'username': user['username'],
+        'nickname': user['nickname'],
+        'role': user['role'],
+        'name': user['name'],
+        'bio': user['bio'],
+        'avatar': user['avatar_url'],
+        'phone': user['phone'],
+        'telegram': user['telegram_username'],
+        'verified': user['verified'],
+        'isPremium': user['is_premium'],
+        'isAgencyOwner': user['agency_id'] is not None,
+        'agencyName': user['agency_name'],
+        'businessType': user['business_type'],
+        'referralCode': user['referral_code'],
+        'createdAt': user['created_at'].isoformat() if user['created_at'] else None
+    }
+
+def cache_entry(user: dict) -> tuple:
+    """(профиль, версия) для кеша; версия - updated_at строки"""
+    version = user['updated_at'] or user['created_at']
+    return serialize_user(user), version.isoformat() if version else ''
+
+def parse_fields(query_params: dict) -> list:
+    """Список полей из ?fields=nickname,avatar; None - все поля"""
+    raw = query_params.get('fields')
+    if not raw:
         return None
+    fields = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in PROFILE_FIELDS]
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(unknown)}")
+    return ['id'] + [field for field in fields if field != 'id']
+
+def profile_response(entry: tuple, fields: list, headers: dict) -> dict:
+    """Ответ с профилем; 304 если ETag совпадает с If-None-Match"""
+    user, version = entry
+    etag = '"' + hashlib.sha1(f"{user['id']}:{version}:{','.join(fields or [])}".encode()).hexdigest() + '"'
+    response_headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag',
+        'Cache-Control': 'private, no-cache',
+        'ETag': etag
+    }
+    if_none_match = headers.get('if-none-match', headers.get('If-None-Match', ''))
+    if etag in [tag.strip().replace('W/', '', 1) for tag in if_none_match.split(',')]:
+        return {'statusCode': 304, 'headers': response_headers, 'body': '', 'isBase64Encoded': False}
+    
+    if fields:
+        user = {field: user[field] for field in fields}
+    return {
+        'statusCode': 200,
+        'headers': response_headers,
+        'body': json.dumps({'success': True, 'user': user}),
+        'isBase64Encoded': False
+    }
+
+def parse_batch_ids(data: dict) -> list:
+    """Уникальные id из тела запроса в исходном порядке; ValueError при некорректном списке"""
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids:
+        raise ValueError('Передайте непустой список ids')
+    try:
+        unique_ids = list(dict.fromkeys(int(user_id) for user_id in ids))
+    except (TypeError, ValueError):
+        raise ValueError('ids должны быть числами')
+    if len(unique_ids) > MAX_BATCH_IDS:
+        raise ValueError(f'Не более {MAX_BATCH_IDS} id за запрос')
+    return unique_ids
+
+def batch_profiles(user_ids: list) -> tuple:
+    """
+    Публичные карточки пользователей: из кеша, недостающие - одним запросом WHERE id = ANY(%s).
+    Возвращает (карточки в порядке запроса, отсутствующие id).
+    """
+    entries = {}
+    misses = []
+    for user_id in user_ids:
+        cached = profile_cache.get(user_id)
+        if cached:
+            entries[user_id] = cached
+        else:
+            misses.append(user_id)
+    
+    if misses:
+        conn = get_connection()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute(f"SELECT {PROFILE_COLUMNS} FROM users WHERE id = ANY(%s)", (misses,))
+            for user in cur.fetchall():
+                entries[user['id']] = cache_entry(user)
+                profile_cache.put(user['id'], entries[user['id']])
+            cur.close()
+        finally:
+            release_connection(conn)
+    
+    cards = [
+        {field: entries[user_id][0][field] for field in PUBLIC_CARD_FIELDS}
+        for user_id in user_ids if user_id in entries
+    ]
+    missing = [user_id for user_id in user_ids if user_id not in entries]
+    return cards, missing
 
 def handler(event: dict, context) -> dict:
-    """API для получения и обновления профиля пользователя"""
+    """API для получения и обновления профиля пользователя, пакетная выдача публичных карточек"""
     
     method = event.get('httpMethod', 'GET')
     
@@ -24,15 +149,14 @@ def handler(event: dict, context) -> dict:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization, If-None-Match'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    auth_header = event.get('headers', {}).get('x-authorization', '')
-    token = auth_header.replace('Bearer ', '') if auth_header else ''
+    token = get_token_from_headers(event.get('headers', {}))
     
     if not token:
         return {
@@ -42,8 +166,8 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    payload = verify_token(token)
-    if not payload:
+    user_id = get_user_id(verify_token(token))
+    if not user_id:
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -51,17 +175,71 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(DATABASE_URL, options=f'-c search_path={SCHEMA}')
+    headers = event.get('headers', {}) or {}
+    
+    if method == 'POST':
+        try:
+            data = json.loads(event.get('body') or '{}')
+        except json.JSONDecodeError:
+            data = None
+        if not isinstance(data, dict):
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Некорректный JSON'}),
+                'isBase64Encoded': False
+            }
+        if data.get('action') != 'batch':
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Неизвестное действие'}),
+                'isBase64Encoded': False
+            }
+        try:
+            cards, missing = batch_profiles(parse_batch_ids(data))
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        except Exception as e:
+            return {
+                'statusCode': 500,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'success': True, 'users': cards, 'missing': missing}),
+            'isBase64Encoded': False
+        }
+    
+    if method == 'GET':
+        try:
+            fields = parse_fields(event.get('queryStringParameters', {}) or {})
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        
+        cached = profile_cache.get(user_id)
+        if cached:
+            return profile_response(cached, fields, headers)
+    
+    conn = get_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
         if method == 'GET':
-            cur.execute("""
-                SELECT id, email, username, nickname, role, name, bio, avatar_url, 
-                       phone, telegram_username, verified, is_premium, agency_id, 
-                       agency_name, business_type, referral_code, created_at
-                FROM users WHERE id = %s
-            """, (payload['user_id'],))
+            cur.execute(f"SELECT {PROFILE_COLUMNS} FROM users WHERE id = %s", (user_id,))
             
             user = cur.fetchone()
             
@@ -73,33 +251,9 @@ def handler(event: dict, context) -> dict:
                     'isBase64Encoded': False
                 }
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'user': {
-                        'id': user['id'],
-                        'email': user['email'],
-                        'username': user['username'],
-                        'nickname': user['nickname'],
-                        'role': user['role'],
-                        'name': user['name'],
-                        'bio': user['bio'],
-                        'avatar': user['avatar_url'],
-                        'phone': user['phone'],
-                        'telegram': user['telegram_username'],
-                        'verified': user['verified'],
-                        'isPremium': user['is_premium'],
-                        'isAgencyOwner': user['agency_id'] is not None,
-                        'agencyName': user['agency_name'],
-                        'businessType': user['business_type'],
-                        'referralCode': user['referral_code'],
-                        'createdAt': user['created_at'].isoformat() if user['created_at'] else None
-                    }
-                }),
-                'isBase64Encoded': False
-            }
+            entry = cache_entry(user)
+            profile_cache.put(user_id, entry)
+            return profile_response(entry, fields, headers)
         
         elif method == 'PUT':
             data = json.loads(event.get('body', '{}'))
@@ -129,41 +283,31 @@ def handler(event: dict, context) -> dict:
                     'isBase64Encoded': False
                 }
             
-            update_values.append(payload['user_id'])
+            update_values.append(user_id)
             
             cur.execute(f"""
                 UPDATE users 
                 SET {', '.join(update_fields)}, updated_at = NOW()
                 WHERE id = %s
-                RETURNING id, email, username, nickname, role, name, bio, avatar_url, 
-                          phone, telegram_username, verified, is_premium
+                RETURNING {PROFILE_COLUMNS}
             """, update_values)
             
             user = cur.fetchone()
             conn.commit()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'user': {
-                        'id': user['id'],
-                        'email': user['email'],
-                        'username': user['username'],
-                        'nickname': user['nickname'],
-                        'role': user['role'],
-                        'name': user['name'],
-                        'bio': user['bio'],
-                        'avatar': user['avatar_url'],
-                        'phone': user['phone'],
-                        'telegram': user['telegram_username'],
-                        'verified': user['verified'],
-                        'isPremium': user['is_premium']
-                    }
-                }),
-                'isBase64Encoded': False
-            }
+            if not user:
+                profile_cache.invalidate(user_id)
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Пользователь не найден'}),
+                    'isBase64Encoded': False
+                }
+            
+            # Write-through: следующий GET отдаётся из кеша уже с новыми данными
+            entry = cache_entry(user)
+            profile_cache.put(user_id, entry)
+            return profile_response(entry, None, {})
         
         else:
             return {
@@ -183,4 +327,4 @@ def handler(event: dict, context) -> dict:
         }
     finally:
         cur.close()
-        conn.close()
+        release_connection(conn)
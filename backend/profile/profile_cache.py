@@ -0,0 +1,36 @@
+import threading
+import time
+from collections import OrderedDict
+
+class ProfileCache:
+    """LRU-кеш профилей по user_id с TTL, живёт в тёплом контейнере"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if not entry:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id: int, value) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
@@ -0,0 +1,199 @@
+import json
+import base64
+import io
+from datetime import datetime
+from psycopg2.extras import RealDictCursor
+from db_pool import get_connection, release_connection
+from auth_middleware import get_user_id_from_token
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_EXPORT_ROWS = 100000
+MAX_FILTER_LENGTH = 50
+
+# Источники истории: таблица и её колонки суммы и времени завершения.
+# Выбираются только колонки из INCLUDE индексов idx_*_user_history (V0025)
+SOURCES = {
+    'crypto': {
+        'table': 'crypto_transactions',
+        'amount': 'amount_crypto',
+        'completed_at': 'processed_at'
+    },
+    'wallet': {
+        'table': 'wallet_transactions',
+        'amount': 'amount',
+        'completed_at': 'completed_at'
+    }
+}
+
+FILTERS = ('type', 'status', 'currency')
+
+def encode_cursor(created_at: datetime, transaction_id: int) -> str:
+    """Непрозрачный курсор для keyset-пагинации по (created_at, id)"""
+    raw = json.dumps([created_at.isoformat(), transaction_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> tuple:
+    """Разбор курсора, ValueError при некорректном значении"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, transaction_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(transaction_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def parse_history_params(user_id: int, query_params: dict) -> tuple:
+    """Источник, условия WHERE, параметры и размер страницы; ValueError при некорректных значениях"""
+    source = SOURCES.get(query_params.get('source', 'crypto'))
+    if not source:
+        raise ValueError('Invalid source')
+
+    conditions = ['user_id = %s', 'created_at IS NOT NULL']
+    params = [user_id]
+
+    for name in FILTERS:
+        value = query_params.get(name)
+        if value:
+            if len(value) > MAX_FILTER_LENGTH:
+                raise ValueError(f'Invalid {name}')
+            conditions.append(f'{name} = %s')
+            params.append(value.upper() if name == 'currency' else value)
+
+    cursor = query_params.get('cursor')
+    if cursor:
+        conditions.append('(created_at, id) < (%s, %s)')
+        params.extend(decode_cursor(cursor))
+
+    limit = query_params.get('limit')
+    try:
+        limit = int(limit) if limit else DEFAULT_PAGE_SIZE
+    except ValueError:
+        raise ValueError('Invalid limit')
+    return source, conditions, params, max(1, min(limit, MAX_PAGE_SIZE))
+
+def history_sql(source: dict, conditions: list) -> str:
+    return f"""
+        SELECT id, type, status, currency, {source['amount']} AS amount,
+               created_at, {source['completed_at']} AS completed_at
+        FROM {source['table']}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    """
+
+def export_csv(conn, sql: str, params: list) -> str:
+    """
+    CSV формирует сам Postgres через COPY ... TO STDOUT: строки пишутся в буфер
+    по мере выполнения запроса, без списка строк и словарей на стороне Python
+    """
+    cur = conn.cursor()
+    try:
+        query = cur.mogrify(sql, params).decode()
+        buffer = io.StringIO()
+        cur.copy_expert(f'COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)', buffer)
+        return buffer.getvalue()
+    finally:
+        cur.close()
+
+def handler(event: dict, context) -> dict:
+    '''
+    История операций пользователя.
+    GET ?source=crypto|wallet&type=&status=&currency=&cursor=&limit= - страница истории;
+    GET ?format=csv - выгрузка истории с теми же фильтрами в CSV.
+    '''
+    method = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method != 'GET':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    user_id = get_user_id_from_token(event.get('headers', {}))
+    if not user_id:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'}),
+            'isBase64Encoded': False
+        }
+
+    query_params = event.get('queryStringParameters', {}) or {}
+
+    try:
+        source, conditions, params, limit = parse_history_params(user_id, query_params)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        conn = get_connection()
+        try:
+            if query_params.get('format') == 'csv':
+                body = export_csv(conn, history_sql(source, conditions), params + [MAX_EXPORT_ROWS])
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'text/csv; charset=utf-8',
+                        'Content-Disposition': f'attachment; filename="{source["table"]}.csv"',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': body,
+                    'isBase64Encoded': False
+                }
+
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute(history_sql(source, conditions), params + [limit + 1])
+            rows = cur.fetchall()
+            cur.close()
+        finally:
+            release_connection(conn)
+    except Exception as e:
+        print(f"Error loading transaction history: {e}")
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+    transactions = [{
+        'id': row['id'],
+        'type': row['type'],
+        'status': row['status'],
+        'currency': row['currency'],
+        'amount': float(row['amount']),
+        'createdAt': row['created_at'].isoformat(),
+        'completedAt': row['completed_at'].isoformat() if row['completed_at'] else None
+    } for row in rows]
+
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'transactions': transactions, 'nextCursor': next_cursor}),
+        'isBase64Encoded': False
+    }
@@ -0,0 +1,230 @@
+'''Снимки балансов журнала ledger_entries и потоковая сверка снимков с журналом'''
+import json
+import os
+from decimal import Decimal
+import psycopg2
+from psycopg2 import extensions
+from worker_auth import is_worker_request
+
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+# Записи моложе этого возраста в снимок не попадают: транзакция, получившая меньший id,
+# могла ещё не закоммититься
+SNAPSHOT_LAG_SECONDS = int(os.environ.get('LEDGER_SNAPSHOT_LAG_SECONDS', '300'))
+SNAPSHOT_MAX_ENTRIES = int(os.environ.get('LEDGER_SNAPSHOT_MAX_ENTRIES', '1000000'))
+RECONCILE_FETCH_SIZE = int(os.environ.get('LEDGER_RECONCILE_FETCH_SIZE', '10000'))
+RECONCILE_MAX_MISMATCHES = int(os.environ.get('LEDGER_RECONCILE_MAX_MISMATCHES', '100'))
+
+# Ключ advisory-блокировки: два запуска снимков одновременно не идут
+SNAPSHOT_LOCK_KEY = 72310501
+
+# Позиция строки wallet_balances в потоке сверки: после всех записей счёта
+BALANCE_POSITION = 9223372036854775807
+
+def take_snapshots(conn) -> dict:
+    """
+    Снимок для каждого счёта, изменившегося в диапазоне (W, C]:
+    W - граница прошлого запуска, C - последняя запись старше SNAPSHOT_LAG_SECONDS.
+    Новый баланс = прошлый снимок счёта + сумма записей диапазона.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT pg_try_advisory_xact_lock(%s)', (SNAPSHOT_LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return {'skipped': 'another snapshot run is in progress'}
+
+        cur.execute(f'SELECT COALESCE(MAX(to_entry_id), 0) FROM {SCHEMA}.ledger_snapshot_runs')
+        from_id = cur.fetchone()[0]
+
+        cur.execute(f'''
+            SELECT MAX(id) FROM {SCHEMA}.ledger_entries
+            WHERE id > %s AND id <= %s
+              AND created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+        ''', (from_id, from_id + SNAPSHOT_MAX_ENTRIES, SNAPSHOT_LAG_SECONDS))
+        to_id = cur.fetchone()[0]
+
+        if to_id is None:
+            conn.rollback()
+            return {'from_entry_id': from_id, 'to_entry_id': from_id, 'snapshots': 0}
+
+        cur.execute(f'''
+            INSERT INTO {SCHEMA}.ledger_snapshots (account, user_id, currency, balance, last_entry_id, as_of)
+            SELECT d.account, d.user_id, d.currency, COALESCE(prev.balance, 0) + d.delta, d.last_entry_id, d.as_of
+            FROM (
+                SELECT account, user_id, currency, SUM(amount) AS delta,
+                       MAX(id) AS last_entry_id, MAX(created_at) AS as_of
+                FROM {SCHEMA}.ledger_entries
+                WHERE id > %s AND id <= %s
+                GROUP BY account, user_id, currency
+            ) d
+            LEFT JOIN LATERAL (
+                SELECT balance FROM {SCHEMA}.ledger_snapshots s
+                WHERE s.account = d.account AND s.user_id = d.user_id AND s.currency = d.currency
+                ORDER BY s.last_entry_id DESC
+                LIMIT 1
+            ) prev ON TRUE
+            ON CONFLICT (account, user_id, currency, last_entry_id) DO NOTHING
+        ''', (from_id, to_id))
+        snapshots = cur.rowcount
+
+        cur.execute(f'''
+            INSERT INTO {SCHEMA}.ledger_snapshot_runs (from_entry_id, to_entry_id, snapshots)
+            VALUES (%s, %s, %s)
+        ''', (from_id, to_id, snapshots))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    return {'from_entry_id': from_id, 'to_entry_id': to_id, 'snapshots': snapshots}
+
+def reconcile(conn) -> dict:
+    """
+    Сверка одним проходом по журналу без загрузки его в память.
+    Записи, снимки и wallet_balances сливаются в один поток, упорядоченный по счёту и позиции;
+    нарастающая сумма записей счёта сравнивается с каждым его снимком и с материализованным балансом.
+    Всё читается в одном REPEATABLE READ снимке базы, поэтому новые записи не дают ложных расхождений.
+    """
+    conn.set_session(isolation_level=extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    stats = {'entries': 0, 'accounts': 0, 'snapshots': 0, 'balances': 0, 'mismatches': []}
+
+    def mismatch(kind, key, position, expected, actual):
+        if len(stats['mismatches']) < RECONCILE_MAX_MISMATCHES:
+            stats['mismatches'].append({
+                'kind': kind,
+                'account': key[0],
+                'user_id': key[1],
+                'currency': key[2],
+                'position': position,
+                'expected': str(expected),
+                'actual': str(actual)
+            })
+
+    try:
+        cur = conn.cursor(name='ledger_reconcile')
+        cur.itersize = RECONCILE_FETCH_SIZE
+        cur.execute(f'''
+            SELECT account, user_id, currency, id AS position, 0 AS kind, amount
+            FROM {SCHEMA}.ledger_entries
+            UNION ALL
+            SELECT account, user_id, currency, last_entry_id, 1, balance
+            FROM {SCHEMA}.ledger_snapshots
+            UNION ALL
+            SELECT 'wallet', user_id, currency, %s, 2, amount
+            FROM {SCHEMA}.wallet_balances
+            ORDER BY account, user_id, currency, position, kind
+        ''', (BALANCE_POSITION,))
+
+        key = None
+        running = Decimal(0)
+        for account, user_id, currency, position, kind, amount in cur:
+            row_key = (account, user_id, currency)
+            if row_key != key:
+                key = row_key
+                running = Decimal(0)
+                stats['accounts'] += 1
+            if kind == 0:
+                running += amount
+                stats['entries'] += 1
+            elif kind == 1:
+                stats['snapshots'] += 1
+                if amount != running:
+                    mismatch('snapshot', key, position, running, amount)
+            else:
+                stats['balances'] += 1
+                if amount != running:
+                    mismatch('balance', key, None, running, amount)
+        cur.close()
+
+        # Проводки, не сходящиеся в ноль (триггер не даёт их создать, проверяем на всякий случай)
+        check = conn.cursor()
+        check.execute(f'''
+            SELECT posting_id, SUM(amount) FROM {SCHEMA}.ledger_entries
+            GROUP BY posting_id
+            HAVING SUM(amount) <> 0
+            LIMIT %s
+        ''', (RECONCILE_MAX_MISMATCHES,))
+        for posting_id, total in check.fetchall():
+            mismatch('posting', (None, None, None), posting_id, Decimal(0), total)
+        check.close()
+    finally:
+        conn.rollback()
+
+    stats['ok'] = not stats['mismatches']
+    return stats
+
+def handler(event: dict, context) -> dict:
+    '''
+    Вызывается по расписанию POST-запросом с заголовком X-Worker-Secret.
+    {"action": "snapshot"} - снять балансы счетов, изменившихся с прошлого запуска;
+    {"action": "reconcile"} - сверить снимки и wallet_balances с журналом.
+    '''
+    method = event.get('httpMethod', 'POST')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Worker-Secret',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    if not is_worker_request(event.get('headers')):
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        body = json.loads(event.get('body') or '{}')
+        if not isinstance(body, dict):
+            raise ValueError('Body must be a JSON object')
+        action = body.get('action', 'snapshot')
+        if action not in ('snapshot', 'reconcile'):
+            raise ValueError('Unknown action')
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid JSON' if isinstance(e, json.JSONDecodeError) else str(e)}),
+            'isBase64Encoded': False
+        }
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], options=f'-c search_path={SCHEMA}')
+    try:
+        result = take_snapshots(conn) if action == 'snapshot' else reconcile(conn)
+    except Exception as e:
+        print(f"Error running ledger {action}: {e}")
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    finally:
+        conn.close()
+
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(result),
+        'isBase64Encoded': False
+    }
@@ -0,0 +1,17 @@
+-- Числовая цена для фильтрации (price хранится строкой вида '5000' или '5 000 ₽')
+ALTER TABLE catalog_items ADD COLUMN IF NOT EXISTS price_value NUMERIC
+    GENERATED ALWAYS AS (substring(regexp_replace(price, '\s', '', 'g') from '[0-9]+(?:\.[0-9]+)?')::NUMERIC) STORED;
+
+-- Keyset-пагинация каталога по (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_catalog_items_active_created ON catalog_items(is_active, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_catalog_items_active_category_created ON catalog_items(is_active, category, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_catalog_items_active_country_created ON catalog_items(is_active, country, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_catalog_items_active_body_type_created ON catalog_items(is_active, body_type, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_catalog_items_active_verified_created ON catalog_items(is_active, is_verified, created_at DESC, id DESC);
+
+-- Диапазонные фильтры
+CREATE INDEX IF NOT EXISTS idx_catalog_items_active_price ON catalog_items(is_active, price_value);
+CREATE INDEX IF NOT EXISTS idx_catalog_items_active_age ON catalog_items(is_active, age);
+CREATE INDEX IF NOT EXISTS idx_catalog_items_active_height ON catalog_items(is_active, height);
+
+COMMENT ON COLUMN catalog_items.price_value IS 'Числовое значение price для фильтров minPrice/maxPrice';
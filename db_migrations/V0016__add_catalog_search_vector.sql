@@ -0,0 +1,11 @@
+-- Триграммы для поиска по подстроке (location ILIKE '%...%', нечёткий поиск по title)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Полнотекстовый вектор по заголовку и описанию (русская морфология)
+ALTER TABLE catalog_items ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', COALESCE(title, '')), 'A') ||
+        setweight(to_tsvector('russian', COALESCE(description, '')), 'B')
+    ) STORED;
+
+COMMENT ON COLUMN catalog_items.search_vector IS 'Full-text вектор title (вес A) + description (вес B) для поиска ?q=';
@@ -0,0 +1,5 @@
+-- Индексы строятся без блокировки записи в catalog_items.
+-- CONCURRENTLY нельзя выполнять в транзакции, поэтому в миграции только эти операторы.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_catalog_items_search_vector ON catalog_items USING GIN (search_vector);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_catalog_items_location_trgm ON catalog_items USING GIN (location gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_catalog_items_title_trgm ON catalog_items USING GIN (title gin_trgm_ops);
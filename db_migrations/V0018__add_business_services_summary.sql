@@ -0,0 +1,60 @@
+-- Сводка по программам услуги: список услуг не агрегирует service_programs на каждый запрос
+ALTER TABLE business_services ADD COLUMN IF NOT EXISTS programs_count INT NOT NULL DEFAULT 0;
+ALTER TABLE business_services ADD COLUMN IF NOT EXISTS min_price DECIMAL(10, 2);
+
+CREATE OR REPLACE FUNCTION refresh_business_services_summary(service_ids BIGINT[]) RETURNS VOID AS $$
+    UPDATE business_services s
+    SET programs_count = COALESCE(p.cnt, 0), min_price = p.min_price
+    FROM unnest(service_ids) AS t(service_id)
+    LEFT JOIN (
+        SELECT service_id, COUNT(*) AS cnt, MIN(price) AS min_price
+        FROM service_programs
+        WHERE service_id = ANY(service_ids)
+        GROUP BY service_id
+    ) p ON p.service_id = t.service_id
+    WHERE s.id = t.service_id;
+$$ LANGUAGE sql;
+
+-- Пересчёт только затронутых услуг, один раз на оператор (а не на каждую строку)
+CREATE OR REPLACE FUNCTION service_programs_summary_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_business_services_summary(ARRAY(SELECT DISTINCT service_id FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_business_services_summary(ARRAY(SELECT DISTINCT service_id FROM old_rows));
+    ELSE
+        PERFORM refresh_business_services_summary(ARRAY(
+            SELECT service_id FROM new_rows UNION SELECT service_id FROM old_rows
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_service_programs_summary_insert ON service_programs;
+CREATE TRIGGER trg_service_programs_summary_insert
+    AFTER INSERT ON service_programs
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION service_programs_summary_trigger();
+
+DROP TRIGGER IF EXISTS trg_service_programs_summary_update ON service_programs;
+CREATE TRIGGER trg_service_programs_summary_update
+    AFTER UPDATE ON service_programs
+    REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION service_programs_summary_trigger();
+
+DROP TRIGGER IF EXISTS trg_service_programs_summary_delete ON service_programs;
+CREATE TRIGGER trg_service_programs_summary_delete
+    AFTER DELETE ON service_programs
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION service_programs_summary_trigger();
+
+-- Заполнение сводки для существующих услуг
+SELECT refresh_business_services_summary(ARRAY(SELECT DISTINCT service_id FROM service_programs));
+
+-- Keyset-пагинация списка по (created_at, id) с фильтром по статусу и категории
+CREATE INDEX IF NOT EXISTS idx_business_services_status_created ON business_services(status, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_business_services_status_category_created ON business_services(status, category_id, created_at DESC, id DESC);
+
+COMMENT ON COLUMN business_services.programs_count IS 'Количество программ (поддерживается триггером на service_programs)';
+COMMENT ON COLUMN business_services.min_price IS 'Минимальная цена среди программ (поддерживается триггером на service_programs)';
@@ -0,0 +1,10 @@
+-- Неудачные попытки входа (auth-email), пишутся пачками; строки старше LOCKOUT_MINUTES удаляются при сбросе
+CREATE TABLE IF NOT EXISTS login_attempts (
+    id BIGSERIAL PRIMARY KEY,
+    email VARCHAR(255) NOT NULL,
+    ip_address VARCHAR(64),
+    attempted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_login_attempts_email_attempted ON login_attempts(email, attempted_at DESC);
+CREATE INDEX IF NOT EXISTS idx_login_attempts_attempted ON login_attempts(attempted_at);
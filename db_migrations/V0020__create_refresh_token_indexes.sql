@@ -0,0 +1,4 @@
+-- Индексы для пакетной очистки истёкших refresh-токенов и выхода со всех устройств.
+-- CONCURRENTLY нельзя выполнять в транзакции, поэтому в миграции только эти операторы.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_refresh_tokens_expires_at ON refresh_tokens(expires_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_refresh_tokens_user_id ON refresh_tokens(user_id);
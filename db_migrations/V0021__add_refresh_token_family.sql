@@ -0,0 +1,5 @@
+-- Семейство refresh-токенов: все токены, полученные ротацией от одного входа.
+-- Повторное использование уже обменянного токена отзывает всё семейство.
+ALTER TABLE refresh_tokens ADD COLUMN IF NOT EXISTS family_id VARCHAR(36);
+
+CREATE INDEX IF NOT EXISTS idx_refresh_tokens_family_id ON refresh_tokens(family_id);
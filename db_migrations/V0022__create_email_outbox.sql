@@ -0,0 +1,21 @@
+-- Исходящие письма: API только ставит письмо в очередь, отправкой занимается функция email-sender.
+-- status: pending - ждёт отправки, sending - взято отправителем (аренда до next_attempt_at),
+-- sent - отправлено, failed - исчерпаны попытки.
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    dedupe_key VARCHAR(255) NOT NULL UNIQUE,
+    to_email VARCHAR(255) NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    html_body TEXT NOT NULL,
+    text_body TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sending', 'sent', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+-- Выборка очереди отправителем: только неотправленные письма
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(next_attempt_at)
+    WHERE status IN ('pending', 'sending');
@@ -0,0 +1,16 @@
+-- Балансы криптокошельков: одна строка на пару (пользователь, валюта).
+-- Уникальность пары нужна вебхуку: зачисление делается одним INSERT ... ON CONFLICT DO UPDATE.
+CREATE TABLE IF NOT EXISTS wallet_balances (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    currency VARCHAR(10) NOT NULL,
+    amount DECIMAL(20, 8) NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Для таблиц, созданных раньше без ограничения
+CREATE UNIQUE INDEX IF NOT EXISTS idx_wallet_balances_user_currency ON wallet_balances(user_id, currency);
+
+COMMENT ON TABLE wallet_balances IS 'Текущий баланс пользователя в каждой криптовалюте';
+COMMENT ON COLUMN wallet_balances.amount IS 'Сумма в криптовалюте';
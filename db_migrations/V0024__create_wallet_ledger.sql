@@ -0,0 +1,131 @@
+-- Журнал движений по кошелькам: только добавление, двойная запись.
+-- Каждая проводка (posting_id) состоит из ног, сумма которых равна нулю:
+-- например, депозит = +amount на счёт wallet пользователя и -amount на счёт cryptocloud.
+-- Счёт определяется тройкой (account, user_id, currency).
+CREATE TABLE IF NOT EXISTS ledger_entries (
+    id BIGSERIAL PRIMARY KEY,
+    posting_id VARCHAR(255) NOT NULL,
+    account VARCHAR(20) NOT NULL CHECK (account IN ('wallet', 'cryptocloud', 'equity')),
+    user_id BIGINT NOT NULL,
+    currency VARCHAR(10) NOT NULL,
+    amount DECIMAL(20, 8) NOT NULL,
+    entry_type VARCHAR(30) NOT NULL,
+    reference VARCHAR(255),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (posting_id, account, user_id, currency)
+);
+
+-- История и сверка по счёту идут в порядке id
+CREATE INDEX IF NOT EXISTS idx_ledger_entries_account ON ledger_entries(account, user_id, currency, id);
+
+-- Снимки баланса: balance учитывает все записи счёта с id <= last_entry_id,
+-- as_of - время самой поздней из них. Баланс на момент времени = снимок + короткий хвост.
+CREATE TABLE IF NOT EXISTS ledger_snapshots (
+    id BIGSERIAL PRIMARY KEY,
+    account VARCHAR(20) NOT NULL,
+    user_id BIGINT NOT NULL,
+    currency VARCHAR(10) NOT NULL,
+    balance DECIMAL(20, 8) NOT NULL,
+    last_entry_id BIGINT NOT NULL,
+    as_of TIMESTAMP NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (account, user_id, currency, last_entry_id)
+);
+
+-- Запуски снимков: каждый покрывает диапазон id (from_entry_id, to_entry_id]
+CREATE TABLE IF NOT EXISTS ledger_snapshot_runs (
+    id BIGSERIAL PRIMARY KEY,
+    from_entry_id BIGINT NOT NULL,
+    to_entry_id BIGINT NOT NULL,
+    snapshots INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Начальные остатки: текущие балансы переносятся в журнал проводкой opening
+INSERT INTO ledger_entries (posting_id, account, user_id, currency, amount, entry_type)
+SELECT 'opening:' || b.user_id || ':' || b.currency, leg.account, b.user_id, b.currency, leg.sign * b.amount, 'opening'
+FROM wallet_balances b
+CROSS JOIN (VALUES ('wallet', 1), ('equity', -1)) AS leg(account, sign)
+WHERE b.amount <> 0
+ON CONFLICT (posting_id, account, user_id, currency) DO NOTHING;
+
+-- Журнал неизменяем: исправления делаются новой проводкой
+CREATE OR REPLACE FUNCTION ledger_entries_append_only() RETURNS TRIGGER AS $$
+BEGIN
+    RAISE EXCEPTION 'ledger_entries is append-only (% rejected)', TG_OP;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_ledger_entries_append_only ON ledger_entries;
+CREATE TRIGGER trg_ledger_entries_append_only
+    BEFORE UPDATE OR DELETE ON ledger_entries
+    FOR EACH ROW EXECUTE FUNCTION ledger_entries_append_only();
+
+DROP TRIGGER IF EXISTS trg_ledger_entries_no_truncate ON ledger_entries;
+CREATE TRIGGER trg_ledger_entries_no_truncate
+    BEFORE TRUNCATE ON ledger_entries
+    FOR EACH STATEMENT EXECUTE FUNCTION ledger_entries_append_only();
+
+-- Проводка должна сходиться в ноль к моменту коммита
+CREATE OR REPLACE FUNCTION ledger_entries_check_posting() RETURNS TRIGGER AS $$
+DECLARE
+    total DECIMAL(20, 8);
+BEGIN
+    SELECT SUM(amount) INTO total FROM ledger_entries WHERE posting_id = NEW.posting_id;
+    IF total <> 0 THEN
+        RAISE EXCEPTION 'Posting % is unbalanced by %', NEW.posting_id, total;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_ledger_entries_check_posting ON ledger_entries;
+CREATE CONSTRAINT TRIGGER trg_ledger_entries_check_posting
+    AFTER INSERT ON ledger_entries
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION ledger_entries_check_posting();
+
+-- wallet_balances - материализованный баланс счетов wallet, обновляется в той же транзакции,
+-- один раз на оператор и одной агрегированной строкой на (пользователь, валюта)
+CREATE OR REPLACE FUNCTION ledger_entries_apply_balances() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO wallet_balances (user_id, currency, amount, created_at, updated_at)
+    SELECT user_id, currency, SUM(amount), CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+    FROM new_rows
+    WHERE account = 'wallet'
+    GROUP BY user_id, currency
+    ON CONFLICT (user_id, currency) DO UPDATE
+    SET amount = wallet_balances.amount + EXCLUDED.amount,
+        updated_at = EXCLUDED.updated_at;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_ledger_entries_apply_balances ON ledger_entries;
+CREATE TRIGGER trg_ledger_entries_apply_balances
+    AFTER INSERT ON ledger_entries
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION ledger_entries_apply_balances();
+
+-- Баланс счёта на момент времени: последний подходящий снимок плюс записи после него
+CREATE OR REPLACE FUNCTION ledger_balance_at(p_account VARCHAR, p_user_id BIGINT, p_currency VARCHAR, p_at TIMESTAMP)
+RETURNS DECIMAL(20, 8) AS $$
+    WITH snap AS (
+        SELECT balance, last_entry_id FROM ledger_snapshots
+        WHERE account = p_account AND user_id = p_user_id AND currency = p_currency AND as_of <= p_at
+        ORDER BY last_entry_id DESC
+        LIMIT 1
+    )
+    SELECT COALESCE((SELECT balance FROM snap), 0) + COALESCE((
+        SELECT SUM(amount) FROM ledger_entries
+        WHERE account = p_account AND user_id = p_user_id AND currency = p_currency
+          AND id > COALESCE((SELECT last_entry_id FROM snap), 0)
+          AND created_at <= p_at
+    ), 0);
+$$ LANGUAGE sql STABLE;
+
+COMMENT ON TABLE ledger_entries IS 'Журнал движений по кошелькам (двойная запись, только добавление)';
+COMMENT ON COLUMN ledger_entries.posting_id IS 'Проводка: ноги с одним posting_id в сумме дают ноль (deposit:<invoice_id>, opening:...)';
+COMMENT ON COLUMN ledger_entries.amount IS 'Сумма со знаком: плюс - поступление на счёт, минус - списание';
+COMMENT ON TABLE ledger_snapshots IS 'Периодические снимки балансов счетов журнала (создаёт функция wallet-ledger)';
+COMMENT ON TABLE wallet_balances IS 'Текущий баланс пользователя в каждой криптовалюте (поддерживается триггером на ledger_entries)';
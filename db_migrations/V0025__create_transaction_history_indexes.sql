@@ -0,0 +1,13 @@
+-- Покрывающие индексы для истории операций пользователя (функция wallet-history):
+-- keyset-пагинация по (user_id, created_at DESC, id DESC), все выдаваемые колонки в INCLUDE,
+-- поэтому страница читается index-only scan без обращения к таблице.
+-- Индексы только по user_id становятся префиксом новых и удаляются.
+-- CONCURRENTLY нельзя выполнять в транзакции, поэтому в миграции только эти операторы.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_crypto_transactions_user_history
+    ON crypto_transactions(user_id, created_at DESC, id DESC)
+    INCLUDE (type, status, currency, amount_crypto, processed_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_wallet_transactions_user_history
+    ON wallet_transactions(user_id, created_at DESC, id DESC)
+    INCLUDE (type, status, currency, amount, completed_at);
+DROP INDEX CONCURRENTLY IF EXISTS idx_crypto_transactions_user_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_wallet_transactions_user;
@@ -0,0 +1,15 @@
+-- Пул заранее созданных адресов депозита (функция crypto-address-pool).
+-- status: pooled - адрес свободен (user_id пуст), active - закреплён за пользователем,
+-- expired - не был выдан до expires_at.
+ALTER TABLE crypto_deposit_addresses ALTER COLUMN user_id DROP NOT NULL;
+
+-- Выдача из пула: самый свежий свободный адрес валюты (обратный проход по индексу)
+CREATE INDEX IF NOT EXISTS idx_crypto_addresses_pooled ON crypto_deposit_addresses(currency, created_at)
+    WHERE status = 'pooled';
+
+-- Поиск адресов пользователя: один индексный проход по (user_id, currency)
+CREATE INDEX IF NOT EXISTS idx_crypto_addresses_user_active ON crypto_deposit_addresses(user_id, currency, created_at DESC)
+    WHERE status = 'active';
+
+COMMENT ON COLUMN crypto_deposit_addresses.status IS 'pooled - в пуле, active - выдан пользователю, used, expired';
+COMMENT ON COLUMN crypto_deposit_addresses.user_id IS 'Владелец адреса; пусто, пока адрес в пуле';
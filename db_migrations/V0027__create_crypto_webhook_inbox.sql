@@ -0,0 +1,26 @@
+-- Входящие вебхуки CryptoCloud: crypto-webhook только проверяет подпись и сохраняет тело,
+-- зачислением занимается функция crypto-webhook-worker.
+-- status: pending - ждёт обработки, processing - взят обработчиком (аренда до next_attempt_at),
+-- processed - обработан, dead - исчерпаны попытки (разбирается вручную или через replay).
+CREATE TABLE IF NOT EXISTS crypto_webhook_inbox (
+    id BIGSERIAL PRIMARY KEY,
+    payload_hash VARCHAR(64) NOT NULL UNIQUE,
+    invoice_id VARCHAR(255) NOT NULL,
+    payload TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'processing', 'processed', 'dead')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    received_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP
+);
+
+-- Выборка очереди обработчиком: только необработанные уведомления
+CREATE INDEX IF NOT EXISTS idx_crypto_webhook_inbox_due ON crypto_webhook_inbox(next_attempt_at)
+    WHERE status IN ('pending', 'processing');
+
+-- Повторная обработка за интервал времени
+CREATE INDEX IF NOT EXISTS idx_crypto_webhook_inbox_received ON crypto_webhook_inbox(received_at);
+
+COMMENT ON TABLE crypto_webhook_inbox IS 'Сырые уведомления CryptoCloud, принятые до обработки';
+COMMENT ON COLUMN crypto_webhook_inbox.payload_hash IS 'SHA-256 тела: повторная доставка того же уведомления не создаёт новую строку';
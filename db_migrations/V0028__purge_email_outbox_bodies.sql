@@ -0,0 +1,11 @@
+-- В теле писем лежат коды подтверждения и сброса пароля в открытом виде:
+-- после отправки (или окончательной ошибки) email-sender очищает html_body/text_body,
+-- а строки старше срока хранения удаляет.
+ALTER TABLE email_outbox ALTER COLUMN html_body DROP NOT NULL;
+ALTER TABLE email_outbox ALTER COLUMN text_body DROP NOT NULL;
+
+UPDATE email_outbox SET html_body = NULL, text_body = NULL WHERE status IN ('sent', 'failed');
+
+-- Удаление по сроку хранения: только завершённые письма
+CREATE INDEX IF NOT EXISTS idx_email_outbox_finished ON email_outbox(created_at)
+    WHERE status IN ('sent', 'failed');
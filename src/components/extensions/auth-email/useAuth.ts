@@ -169,6 +169,9 @@ export function useAuth(options: UseAuthOptions): UseAuthReturn {
       const data = await response.json();
       setAccessToken(data.access_token);
       setUser(data.user);
+      if (data.refresh_token) {
+        setStoredRefreshToken(data.refresh_token);
+      }
       scheduleRefresh(data.expires_in, refreshTokenFn);
       return true;
     } catch {
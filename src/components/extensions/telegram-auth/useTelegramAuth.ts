@@ -139,6 +139,9 @@ export function useTelegramAuth(options: UseTelegramAuthOptions): UseTelegramAut
       const data = await response.json();
       setAccessToken(data.access_token);
       setUser(data.user);
+      if (data.refresh_token) {
+        setStoredRefreshToken(data.refresh_token);
+      }
       scheduleRefresh(data.expires_in, refreshTokenFn);
       return true;
     } catch {
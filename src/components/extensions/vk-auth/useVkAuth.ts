@@ -168,6 +168,9 @@ export function useVkAuth(options: UseVkAuthOptions): UseVkAuthReturn {
       const data = await response.json();
       setAccessToken(data.access_token);
       setUser(data.user);
+      if (data.refresh_token) {
+        setStoredRefreshToken(data.refresh_token);
+      }
       scheduleRefresh(data.expires_in, refreshTokenFn);
       return true;
     } catch {